@@ -0,0 +1,31 @@
+"""
+ASGI entry point: the search routes run on the asyncio search path, every other
+route is served by the Flask app through a WSGI adapter.
+
+    uvicorn asgi:application --workers 4
+"""
+from asgiref.wsgi import WsgiToAsgi
+from src import app
+from src.api.async_routes import async_routes, handle, shutdown
+
+flask_application = WsgiToAsgi(app)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http" and (scope["method"], scope["path"]) in async_routes:
+        await handle(scope, receive, send)
+    else:
+        await flask_application(scope, receive, send)
@@ -0,0 +1,168 @@
+"""
+Offline comparison of the query-time gauss decay on created_at with the precomputed freshness rank feature.
+
+Loads synthetic products created over the last two years into a throwaway index (or uses an
+existing index), then runs the same searches and suggestions with the previous function_score
+queries and with the current rank_feature queries. Prints how much of the top results both
+rankings share and the latency percentiles of each. Suggestions used to multiply the text score
+by the decay, which a rank feature can only add to, so they are compared for several boosts.
+Needs a reachable Elasticsearch (ES_HOST, ES_USERNAME, ES_PASSWORD).
+
+Usage:
+    python -m benchmarks.freshness_benchmark [documents] [queries] [index]
+"""
+import sys
+import copy
+import time
+import random
+import datetime
+import statistics
+import pandas as pd
+from elasticsearch.helpers import bulk
+from src.data import products_mapping
+from src.db_connection.elasticsearchDBconnection import ElasticsearchDBConnection
+from src.services.document_transformer import DocumentTransformer
+from src.services.search_service import SearchService
+from benchmarks.transform_benchmark import synthetic_rows
+from benchmarks.query_benchmark import TERMS
+
+INDEX_NAME = "products_freshness_bench"
+TOP_K = 20
+SUGGESTION_BOOSTS = (1, 3, 5, 10)
+
+LEGACY_SEARCH_FUNCTIONS = [
+    {"gauss": {"created_at": {"origin": "now", "scale": "90d", "offset": "30d", "decay": 0.7}}, "weight": 0.8}
+]
+LEGACY_SUGGESTION_FUNCTIONS = [
+    {"gauss": {"created_at": {"origin": "now", "scale": "90d", "offset": "30d", "decay": 0.5}}}
+]
+
+
+def without_freshness(query):
+    query = copy.deepcopy(query)
+    should = [clause for clause in query["bool"].pop("should", []) if "rank_feature" not in clause]
+    if should:
+        query["bool"]["should"] = should
+    return query
+
+
+def legacy_search(body):
+    body = dict(body)
+    body["query"] = {"function_score": {"query": without_freshness(body["query"]),
+                                        "functions": LEGACY_SEARCH_FUNCTIONS, "boost_mode": "sum",
+                                        "score_mode": "avg"}}
+    return body
+
+
+def legacy_suggestion(body):
+    body = dict(body)
+    body["query"] = {"function_score": {"query": without_freshness(body["query"]),
+                                        "functions": LEGACY_SUGGESTION_FUNCTIONS, "boost_mode": "multiply"}}
+    return body
+
+
+def load_fixture(es, count):
+    if es.indices.exists(index=INDEX_NAME):
+        es.indices.delete(index=INDEX_NAME)
+    es.indices.create(index=INDEX_NAME, body=products_mapping.products_mapping)
+
+    now = datetime.datetime.now()
+    categories = {i: (f"Category {i}", f"Catégorie {i}") for i in range(1, 11)}
+    rows = synthetic_rows(count)
+    for row in rows:
+        row["name"] = f"{random.choice(TERMS)} {random.choice(TERMS)} {row['name']}"
+        row["country"] = random.randint(1, 5)
+        row["created_at"] = now - datetime.timedelta(days=random.uniform(0, 730))
+    documents = DocumentTransformer().transform_batch(pd.DataFrame(rows), categories)
+    bulk(es, ({"_index": INDEX_NAME, "_id": doc["id"], "_source": doc} for doc in documents))
+    es.indices.refresh(index=INDEX_NAME)
+
+
+def run(es, index_name, bodies):
+    """
+    Function to run query bodies and keep their top ids and latencies.
+    :return:
+        tuple: A list of top id lists and the sorted latencies in ms.
+    """
+    rankings, latencies = [], []
+    for body in bodies:
+        started = time.perf_counter()
+        response = es.search(index=index_name, body={**body, "size": TOP_K, "from": 0, "_source": False},
+                             request_cache=False)
+        latencies.append((time.perf_counter() - started) * 1000)
+        rankings.append([hit["_id"] for hit in response["hits"]["hits"]])
+    latencies.sort()
+    return rankings, latencies
+
+
+def overlap(before, after):
+    """
+    Function to compare two rankings of the same queries.
+    :return:
+        tuple: The mean share of the top ids found in both, and the share of queries with the same top ids in the same order.
+    """
+    shared = [len(set(a) & set(b)) / max(len(a), len(b)) for a, b in zip(before, after) if a or b]
+    identical = sum(1 for a, b in zip(before, after) if a == b)
+    return statistics.mean(shared) if shared else 1.0, identical / len(before)
+
+
+def percentile(latencies, share):
+    return latencies[max(int(len(latencies) * share) - 1, 0)]
+
+
+def report(name, latencies):
+    print(f"  {name:18} p50 {percentile(latencies, 0.5):7.2f} ms   p95 {percentile(latencies, 0.95):7.2f} ms   "
+          f"p99 {percentile(latencies, 0.99):7.2f} ms")
+
+
+def main():
+    documents = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    index_name = sys.argv[3] if len(sys.argv) > 3 else INDEX_NAME
+    es = ElasticsearchDBConnection().es_connection()
+    search_service = SearchService()
+
+    random.seed(7)
+    if index_name == INDEX_NAME:
+        load_fixture(es, documents)
+    queries = [{
+        "search_term": random.choice(TERMS),
+        "country": random.randint(1, 5),
+        "category_id": random.choice([None, random.randint(1, 10)]),
+        "sort_by": "relevance_high_low",
+    } for _ in range(count)]
+
+    try:
+        searches = [search_service.build_search_query(**params) for params in queries]
+        print(f"Search, top {TOP_K} of {count} queries:")
+        results = {}
+        for name, bodies in (("gauss (before)", [legacy_search(body) for body in searches]),
+                             ("rank_feature", searches)):
+            run(es, index_name, bodies[:50])
+            results[name] = run(es, index_name, bodies)
+            report(name, results[name][1])
+        shared, identical = overlap(results["gauss (before)"][0], results["rank_feature"][0])
+        print(f"  top ids shared {shared:.1%}, identical rankings {identical:.1%}")
+
+        print(f"Suggestions, top {TOP_K} of {count} prefixes:")
+        prefixes = [(params["country"], params["search_term"][:random.randint(2, 4)]) for params in queries]
+        legacy = [legacy_suggestion(search_service.suggestion_query(country, prefix, TOP_K, 0, "En", None))
+                  for country, prefix in prefixes]
+        run(es, index_name, legacy[:50])
+        before, latencies = run(es, index_name, legacy)
+        report("gauss (before)", latencies)
+        for boost in SUGGESTION_BOOSTS:
+            search_service.suggestion_freshness_boost = boost
+            bodies = [search_service.suggestion_query(country, prefix, TOP_K, 0, "En", None)
+                      for country, prefix in prefixes]
+            after, latencies = run(es, index_name, bodies)
+            shared, identical = overlap(before, after)
+            report(f"rank_feature x{boost}", latencies)
+            print(f"    top ids shared {shared:.1%}, identical rankings {identical:.1%}")
+    finally:
+        if index_name == INDEX_NAME:
+            es.indices.delete(index=INDEX_NAME)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Load test comparing the synchronous (WSGI) and the asyncio (ASGI) search paths.
+
+Start both servers with the same number of workers against the same Elasticsearch, e.g.
+
+    gunicorn --workers 4 --bind :8000 wsgi:app
+    uvicorn asgi:application --workers 4 --port 8001
+
+then fire the same concurrent /api/search (and /api/suggest_search_terms) traffic at each
+and compare throughput and latency percentiles. Caching should be off on both sides
+(SEARCH_CACHE_LOCAL_SIZE=0 and a short SEARCH_CACHE_TTL) so Elasticsearch is hit every time.
+
+Usage:
+    python -m benchmarks.load_test [sync_url] [async_url] [concurrency] [requests]
+"""
+import sys
+import json
+import time
+import random
+import statistics
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+TERMS = ["phone", "camera", "laptop", "tv", "boots", "jacket", "tablet", "console", "product", "chair"]
+
+
+def make_requests(count):
+    random.seed(11)
+    requests = []
+    for _ in range(count):
+        if random.random() < 0.2:
+            path = "/api/suggest_search_terms"
+            payload = {"query": random.choice(TERMS)[:3], "country": random.randint(1, 5)}
+        else:
+            path = "/api/search"
+            payload = {"query": f"{random.choice(TERMS)} {random.randint(1, 10_000)}",
+                       "country": random.randint(1, 5), "page_num": random.randint(1, 3)}
+        requests.append((path, payload))
+    return requests
+
+
+def send(base_url, path, payload):
+    request = urllib.request.Request(base_url + path, data=json.dumps(payload).encode(),
+                                     headers={"Content-Type": "application/json"}, method="POST")
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            ok = response.status == 200
+    except Exception:
+        ok = False
+    return (time.perf_counter() - started) * 1000, ok
+
+
+def run(base_url, requests, concurrency):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda request: send(base_url, *request), requests))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, ok in results)
+    return {
+        "throughput": len(results) / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "errors": sum(1 for latency, ok in results if not ok)
+    }
+
+
+def main():
+    sync_url = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:8000"
+    async_url = sys.argv[2] if len(sys.argv) > 2 else "http://localhost:8001"
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    count = int(sys.argv[4]) if len(sys.argv) > 4 else 2000
+
+    requests = make_requests(count)
+    for name, base_url in (("sync (wsgi)", sync_url), ("async (asgi)", async_url)):
+        run(base_url, requests[:100], concurrency)
+        stats = run(base_url, requests, concurrency)
+        print(f"{name:14} {stats['throughput']:8.1f} req/s   p50 {stats['p50']:7.2f} ms   "
+              f"p95 {stats['p95']:7.2f} ms   errors {stats['errors']}")
+
+
+if __name__ == "__main__":
+    main()
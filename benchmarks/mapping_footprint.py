@@ -0,0 +1,175 @@
+"""
+Per-field index footprint and bulk throughput of the products mapping profiles.
+
+Loads the same synthetic products (with long descriptions) into one throwaway index per
+mapping profile through the BulkIndexer, force merges them to one segment, runs the search,
+sort, facet and suggestion queries of SearchService on each, then prints:
+- the bulk throughput and store size of each profile,
+- the bytes of every field per profile, from the _disk_usage API, and the bytes of the norms,
+- whether the queries read the field at all, from the field usage stats API.
+With an index name, only reports the footprint and field usage of that existing index, which
+shows the fields production queries actually touch since its shards started.
+Needs a reachable Elasticsearch (ES_HOST, ES_USERNAME, ES_PASSWORD).
+
+Usage:
+    python -m benchmarks.mapping_footprint [documents] [queries]
+    python -m benchmarks.mapping_footprint --index products_index
+"""
+import sys
+import time
+import random
+import pandas as pd
+from src.data.products_mapping import mapping_profiles
+from src.db_connection.elasticsearchDBconnection import ElasticsearchDBConnection
+from src.services.bulk_indexer import BulkIndexer
+from src.services.document_transformer import DocumentTransformer
+from src.services.search_service import SearchService
+from src.data.search_templates import SORT_TABLE
+from benchmarks.transform_benchmark import synthetic_rows
+from benchmarks.query_benchmark import TERMS
+
+INDEX_PREFIX = "products_footprint_"
+WORDS = TERMS + ["black", "new", "used", "original", "fast", "delivery", "warranty", "leather", "wireless",
+                 "portable", "smart", "classic", "premium", "battery", "screen", "kitchen", "garden", "sport"]
+
+
+def synthetic_documents(count):
+    random.seed(11)
+    rows = synthetic_rows(count)
+    for row in rows:
+        name = f"{random.choice(TERMS)} {random.choice(WORDS)} {row['name']}"
+        description = " ".join(random.choices(WORDS, k=random.randint(20, 400)))
+        row.update({
+            "name": name,
+            "name_fr": f"{name} fr",
+            "description": description,
+            "description_fr": description,
+            "search_index": f"{name} {' '.join(random.choices(WORDS, k=30))}",
+            "hash": f"{random.getrandbits(64):016x}",
+            "currency": "XAF",
+            "image": f"https://cdn.example.com/products/{row['id']}.jpg",
+            "brand_id": random.randint(1, 50),
+            "whole_sale": random.randint(0, 1),
+            "country": random.randint(1, 5),
+        })
+    categories = {i: (f"Category {i}", f"Catégorie {i}") for i in range(1, 11)}
+    return DocumentTransformer().transform_batch(pd.DataFrame(rows), categories)
+
+
+def load(es, profile, documents):
+    """
+    Function to load the documents into a fresh index of a mapping profile and merge it to one segment.
+    :return:
+        tuple: The index name and the bulk throughput in documents per second.
+    """
+    index_name = f"{INDEX_PREFIX}{profile}"
+    if es.indices.exists(index=index_name):
+        es.indices.delete(index=index_name)
+    body = dict(mapping_profiles[profile])
+    body["settings"] = {"index": {"number_of_shards": 1, "number_of_replicas": 0, "refresh_interval": "-1"}}
+    es.indices.create(index=index_name, body=body)
+
+    started = time.perf_counter()
+    BulkIndexer(es).run({"_index": index_name, "_id": doc["id"], "_source": doc} for doc in documents)
+    es.indices.refresh(index=index_name)
+    throughput = len(documents) / (time.perf_counter() - started)
+
+    es.indices.forcemerge(index=index_name, max_num_segments=1)
+    return index_name, throughput
+
+
+def run_queries(es, search_service, index_name, count):
+    random.seed(5)
+    for _ in range(count):
+        term = random.choice(TERMS)
+        body = search_service.build_search_query(term, country=random.randint(1, 5),
+                                                 sort_by=random.choice(list(SORT_TABLE)),
+                                                 category_id=random.choice([None, random.randint(1, 10)]),
+                                                 locale=random.choice(["En", "Fr"]), facets=random.random() < 0.3)
+        es.search(index=index_name, body={**body, "size": 20}, request_cache=False)
+        suggestion = search_service.suggestion_query(random.randint(1, 5), term[:3], 10, 0,
+                                                     random.choice(["En", "Fr"]), None)
+        es.search(index=index_name, body=suggestion, request_cache=False)
+
+
+def field_bytes(es, index_name):
+    """
+    Function to read the footprint of an index from the _disk_usage API.
+    :return:
+        tuple: The store size, and the total and norms bytes of every field.
+    """
+    usage = es.indices.disk_usage(index=index_name, run_expensive_tasks=True)
+    index_usage = next(value for key, value in usage.items() if not key.startswith("_"))
+    fields = index_usage["fields"].items()
+    return (index_usage["store_size_in_bytes"],
+            {field: stats["total_in_bytes"] for field, stats in fields},
+            {field: stats.get("norms_in_bytes", 0) for field, stats in fields})
+
+
+def field_reads(es, index_name):
+    reads = {}
+    stats = es.indices.field_usage_stats(index=index_name)
+    for key, index_stats in stats.items():
+        if key.startswith("_"):
+            continue
+        for shard in index_stats["shards"]:
+            for field, usage in shard["stats"]["fields"].items():
+                reads[field] = reads.get(field, 0) + usage["any"]
+    return reads
+
+
+def size(value):
+    return f"{value / 1024 / 1024:9.2f} MB" if value is not None else f"{'-':>12}"
+
+
+def report_index(es, index_name):
+    store, fields, norms = field_bytes(es, index_name)
+    reads = field_reads(es, index_name)
+    print(f"{index_name}: {size(store).strip()}, norms {size(sum(norms.values())).strip()}")
+    print(f"{'field':36} {'size':>12} {'norms':>12} {'reads':>10}")
+    for field in sorted(fields, key=fields.get, reverse=True):
+        print(f"{field:36} {size(fields[field])} {size(norms[field])} {reads.get(field, 0):10}")
+
+
+def main():
+    es = ElasticsearchDBConnection().es_connection()
+    if len(sys.argv) > 2 and sys.argv[1] == "--index":
+        report_index(es, sys.argv[2])
+        return
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    documents = synthetic_documents(count)
+    search_service = SearchService()
+
+    results = {}
+    try:
+        for profile in mapping_profiles:
+            index_name, throughput = load(es, profile, documents)
+            run_queries(es, search_service, index_name, queries)
+            store, fields, norms = field_bytes(es, index_name)
+            results[profile] = {"throughput": throughput, "store": store, "fields": fields, "norms": norms,
+                                "reads": field_reads(es, index_name)}
+
+        profiles = list(results)
+        print(f"{count} documents, {queries} searches and suggestions per profile")
+        print(f"{'':36}" + "".join(f"{profile:>14}" for profile in profiles))
+        print(f"{'bulk throughput (docs/s)':36}" + "".join(f"{results[p]['throughput']:14.0f}" for p in profiles))
+        print(f"{'store size':36}" + "".join(f"  {size(results[p]['store'])}" for p in profiles))
+        print(f"{'norms':36}" + "".join(f"  {size(sum(results[p]['norms'].values()))}" for p in profiles))
+        print()
+        print(f"{'field':36}" + "".join(f"{profile:>14}" for profile in profiles)
+              + "".join(f"{profile + ' reads':>16}" for profile in profiles))
+        all_fields = sorted({field for result in results.values() for field in result["fields"]},
+                            key=lambda field: -max(result["fields"].get(field, 0) for result in results.values()))
+        for field in all_fields:
+            print(f"{field:36}" + "".join(f"  {size(results[p]['fields'].get(field))}" for p in profiles)
+                  + "".join(f"{results[p]['reads'].get(field, 0):16}" for p in profiles))
+    finally:
+        for profile in mapping_profiles:
+            if es.indices.exists(index=f"{INDEX_PREFIX}{profile}"):
+                es.indices.delete(index=f"{INDEX_PREFIX}{profile}")
+
+
+if __name__ == "__main__":
+    main()
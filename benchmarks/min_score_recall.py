@@ -0,0 +1,89 @@
+"""
+Recall check of the min_score cutoff against the baseline product search.
+
+The baseline query scored the country term (1) and, with a category, the two category
+matches (2) next to the text match and the gauss decay on created_at, and cut at 4.7. The
+current query keeps those constraints in filter context and scores text plus the freshness
+rank feature, cut at SearchService.min_score. Loads synthetic products created over the last
+two years into a throwaway index (or uses an existing index), runs the same searches with both
+queries, and prints how many of the baseline hits the current query still returns, how many
+it adds, and the same numbers for the old 4.7 cutoff kept unchanged.
+Needs a reachable Elasticsearch (ES_HOST, ES_USERNAME, ES_PASSWORD).
+
+Usage:
+    python -m benchmarks.min_score_recall [documents] [queries] [index]
+"""
+import sys
+import random
+from src.db_connection.elasticsearchDBconnection import ElasticsearchDBConnection
+from src.services.search_service import SearchService
+from benchmarks.query_benchmark import TERMS, legacy_query
+from benchmarks.freshness_benchmark import LEGACY_SEARCH_FUNCTIONS, INDEX_NAME, load_fixture
+
+BASELINE_MIN_SCORE = 4.7
+MAX_HITS = 10_000
+
+
+def baseline_body(params):
+    return {
+        "min_score": BASELINE_MIN_SCORE,
+        "query": {"function_score": {"query": legacy_query(**params), "functions": LEGACY_SEARCH_FUNCTIONS,
+                                     "boost_mode": "sum", "score_mode": "avg"}}
+    }
+
+
+def hit_ids(es, index_name, body):
+    response = es.search(index=index_name, body={**body, "size": MAX_HITS, "_source": False, "sort": ["_score"]},
+                         request_cache=False)
+    return {hit["_id"] for hit in response["hits"]["hits"]}
+
+
+def compare(baseline, current):
+    """
+    Function to compare the hits of the same searches.
+    :return:
+        tuple: The share of the baseline hits still returned, and the number of hits added.
+    """
+    expected = sum(len(ids) for ids in baseline)
+    kept = sum(len(before & after) for before, after in zip(baseline, current))
+    added = sum(len(after - before) for before, after in zip(baseline, current))
+    return kept / expected if expected else 1.0, added
+
+
+def main():
+    documents = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    index_name = sys.argv[3] if len(sys.argv) > 3 else INDEX_NAME
+    es = ElasticsearchDBConnection().es_connection()
+    search_service = SearchService()
+
+    random.seed(13)
+    if index_name == INDEX_NAME:
+        load_fixture(es, documents)
+    queries = [{
+        "search_term": random.choice(TERMS),
+        "country": random.randint(1, 5),
+        "category_id": random.choice([None, random.randint(1, 10)]),
+        "min_price": random.choice([None, 1000]),
+        "max_price": random.choice([None, 10 ** 8]),
+    } for _ in range(count)]
+
+    try:
+        baseline = [hit_ids(es, index_name, baseline_body(params)) for params in queries]
+        current, unchanged = [], []
+        for params in queries:
+            body = search_service.build_search_query(**params)
+            current.append(hit_ids(es, index_name, body))
+            unchanged.append(hit_ids(es, index_name, {**body, "min_score": BASELINE_MIN_SCORE}))
+
+        print(f"{count} searches, {sum(len(ids) for ids in baseline)} baseline hits")
+        for name, hits in (("min_score() (current)", current), (f"{BASELINE_MIN_SCORE} kept", unchanged)):
+            recall, added = compare(baseline, hits)
+            print(f"  {name:22} baseline hits kept {recall:.2%}   hits added {added}")
+    finally:
+        if index_name == INDEX_NAME:
+            es.indices.delete(index=INDEX_NAME)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Latency benchmark of the product search query shape on a fixture index.
+
+Loads synthetic products into a throwaway index, then runs the same searches with the
+previous query shape (country and category scored inside bool.must) and with the shape
+built by ProductQueryBuilder (exact-match constraints in cacheable filters), and prints
+latency percentiles for both. Needs a reachable Elasticsearch (ES_HOST, ES_USERNAME, ES_PASSWORD).
+
+Usage:
+    python -m benchmarks.query_benchmark [documents] [queries]
+"""
+import sys
+import time
+import random
+import statistics
+import pandas as pd
+from elasticsearch.helpers import bulk
+from src.data import products_mapping
+from src.db_connection.elasticsearchDBconnection import ElasticsearchDBConnection
+from src.services.document_transformer import DocumentTransformer
+from src.services.search_service import SearchService
+from benchmarks.transform_benchmark import synthetic_rows
+
+INDEX_NAME = "products_bench"
+TERMS = ["phone", "camera", "laptop", "tv", "boots", "jacket", "tablet", "console", "product"]
+
+
+def legacy_query(search_term, country, category_id, min_price, max_price):
+    must = [
+        {"multi_match": {"query": search_term, "fields": ["name^2", "category_name_en^2", "description",
+                                                           "search_index", "hash"], "fuzziness": "AUTO"}},
+        {"term": {"country": country}}
+    ]
+    if category_id:
+        must.append({"bool": {"should": [{"match": {"category_id": category_id}},
+                                         {"match": {"category_id": category_id}}], "minimum_should_match": 1}})
+    filters = []
+    if min_price:
+        filters.append({"range": {"price": {"gte": min_price}}})
+    if max_price:
+        filters.append({"range": {"price": {"lte": max_price}}})
+    return {"bool": {"must": must, "filter": filters}}
+
+
+def load_fixture(es, count):
+    if es.indices.exists(index=INDEX_NAME):
+        es.indices.delete(index=INDEX_NAME)
+    es.indices.create(index=INDEX_NAME, body=products_mapping.products_mapping)
+
+    categories = {i: (f"Category {i}", f"Catégorie {i}") for i in range(1, 11)}
+    rows = synthetic_rows(count)
+    for row in rows:
+        row["name"] = f"{random.choice(TERMS)} {row['name']}"
+        row["country"] = random.randint(1, 5)
+    documents = DocumentTransformer().transform_batch(pd.DataFrame(rows), categories)
+    bulk(es, ({"_index": INDEX_NAME, "_id": doc["id"], "_source": doc} for doc in documents))
+    es.indices.refresh(index=INDEX_NAME)
+
+
+def run(es, queries, build):
+    latencies = []
+    for params in queries:
+        body = {"size": 20, "query": {"function_score": {"query": build(**params)}}}
+        started = time.perf_counter()
+        es.search(index=INDEX_NAME, body=body, request_cache=False)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def main():
+    documents = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    es = ElasticsearchDBConnection().es_connection()
+    search_service = SearchService()
+
+    random.seed(7)
+    load_fixture(es, documents)
+    queries = [{
+        "search_term": random.choice(TERMS),
+        "country": random.randint(1, 5),
+        "category_id": random.choice([None, random.randint(1, 10)]),
+        "min_price": random.choice([None, 1000]),
+        "max_price": random.choice([None, 10 ** 8]),
+    } for _ in range(count)]
+
+    def current_query(**params):
+        return search_service.build_search_query(**params)["query"]
+
+    try:
+        for name, build in (("scored must (before)", legacy_query), ("filter context (after)", current_query)):
+            run(es, queries[:50], build)
+            p50, p95 = run(es, queries, build)
+            print(f"{name:24} p50 {p50:7.2f} ms   p95 {p95:7.2f} ms")
+    finally:
+        es.indices.delete(index=INDEX_NAME)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Micro-benchmark and regression check of the search query parser.
+
+Checks QueryParser against query_parser_corpus.json, whose expected prices were recorded
+from the previous regex cascade of Utils.extract_prices. Entries carrying a "legacy" value
+are deliberate changes (the cascade raised on decimal amounts and misread 2.5k or 1500.50);
+every other entry must give the same prices under both implementations. Then times the
+cascade, an uncached parse and a memoized parse per query.
+
+Usage:
+    python -m benchmarks.query_parser_benchmark [rounds]
+"""
+import os
+import re
+import sys
+import json
+import time
+from src.utils.query_parser import QueryParser
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_parser_corpus.json")
+
+
+class LegacyPriceExtractor:
+    """
+    The regex cascade Utils.extract_prices ran before QueryParser, kept for comparison.
+    """
+    patterns = {
+        'price': [
+            r'\b(?:\$|€|£|USD|EUR|GBP)?\s?(\d{1,3}(?:,\d{3})*(?:\.\d{1,2})?)\b',
+            r'\b(?:\$|€|£)?(\d+(?:\.\d{1,2})?)\s*[-~]\s*(?:\$|€|£)?(\d+(?:\.\d{1,2})?)\b',
+            r'\b(\d+(?:\.\d{1,2})?)([KkMmBbTt])\b',
+            r'\b(?:\$|€|£)?(\d{4,})(?:\$|€|£)?\b'
+        ],
+        'year': [
+            r'\b(19\d{2}|20\d{2})\b',
+            r'\b(\d{4})\s*(?:model|year|edition|released|version)\b'
+        ],
+        'model_number': [
+            r'\b([A-Z]+(?:\s?\d{1,4}[A-Z]*)+)\b',
+            r'\b(\d{3,4}\s?[A-Z]?)\b',
+            r'\b([A-Z]\s?\d{3,4})\b'
+        ]
+    }
+
+    def parse_suffix_number(self, value, suffix):
+        multipliers = {'K': 1_000, 'M': 1_000_000, 'B': 1_000_000_000, 'T': 1_000_000_000_000}
+        return float(value) * multipliers.get(suffix.upper(), 1)
+
+    def extract_matches(self, query, pattern):
+        extracted = []
+        for match in re.findall(pattern, query):
+            if isinstance(match, tuple) and len(match) == 2:
+                extracted.append(self.parse_suffix_number(match[0], match[1]))
+            else:
+                extracted.append(float(match.replace(',', '')) if isinstance(match, str) and
+                                 match.replace(',', '').isdigit() else match)
+        return extracted
+
+    def extract_years(self, query):
+        years = []
+        for pattern in self.patterns['year']:
+            years.extend(self.extract_matches(query, pattern))
+        return sorted(set(int(y) for y in years))
+
+    def extract_model_numbers(self, query):
+        models = []
+        for pattern in self.patterns['model_number']:
+            models.extend(self.extract_matches(query, pattern))
+        return sorted(set(m.strip() for m in models if isinstance(m, str)))
+
+    def extract_prices(self, query):
+        prices = []
+        for pattern in self.patterns['price']:
+            prices.extend(self.extract_matches(query, pattern))
+        years = self.extract_years(query)
+        models = self.extract_model_numbers(query)
+        return sorted(set(p for p in prices if p not in years and str(int(p)) not in models))
+
+
+def legacy_prices(legacy, query):
+    try:
+        return legacy.extract_prices(query)
+    except ValueError:
+        return "error"
+
+
+def check_corpus(corpus, parser, legacy):
+    failures = 0
+    for entry in corpus:
+        prices = list(parser.parse_uncached(entry["query"]).prices)
+        expected_legacy = entry.get("legacy", entry["prices"])
+        if prices != entry["prices"]:
+            failures += 1
+            print(f"FAIL  {entry['query']!r}: expected {entry['prices']}, got {prices}")
+        if legacy_prices(legacy, entry["query"]) != expected_legacy:
+            failures += 1
+            print(f"FAIL  {entry['query']!r}: the legacy cascade no longer gives {expected_legacy}")
+    changed = sum(1 for entry in corpus if "legacy" in entry)
+    print(f"corpus: {len(corpus)} queries, {changed} deliberate changes, {failures} failures")
+    return failures
+
+
+def per_query_us(function, queries, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            function(query)
+    return (time.perf_counter() - started) / (rounds * len(queries)) * 1e6
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with open(CORPUS) as corpus_file:
+        corpus = json.load(corpus_file)
+
+    parser = QueryParser()
+    legacy = LegacyPriceExtractor()
+    failures = check_corpus(corpus, parser, legacy)
+
+    queries = [entry["query"] for entry in corpus]
+    print(f"regex cascade    {per_query_us(lambda q: legacy_prices(legacy, q), queries, rounds):7.2f} us/query")
+    print(f"single pass      {per_query_us(parser.parse_uncached, queries, rounds):7.2f} us/query")
+    print(f"memoized         {per_query_us(parser.parse, queries, rounds):7.2f} us/query")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Startup benchmark of an API worker.
+
+Each run is a fresh interpreter that imports wsgi, the module gunicorn boots (cold import),
+serves its first request through the Flask test client (time to first request), and reports
+which heavy modules ended up loaded. Importing wsgi also runs schedule_tasks, so the numbers
+include whatever the scheduler settings of the environment load. The first request is /api/ unless a path is given, e.g.
+/api/search_cache_stats. Run it on two commits to compare worker boot times.
+
+Usage:
+    python -m benchmarks.startup_benchmark [runs] [path]
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+HEAVY_MODULES = ["pandas", "numpy", "sqlalchemy", "flask_sqlalchemy", "flask_login", "flask_avatars",
+                 "flask_moment", "src.services.data_ingestion_service"]
+
+WORKER = """
+import sys, json, time
+started = time.perf_counter()
+import wsgi
+imported = time.perf_counter()
+response = wsgi.app.test_client().get(sys.argv[1])
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (served - started) * 1000,
+    "status": response.status_code,
+    "loaded": [name for name in sys.argv[2:] if name in sys.modules]
+}))
+"""
+
+
+def run_worker(path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", WORKER, path, *HEAVY_MODULES], cwd=root, capture_output=True,
+                            text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    path = sys.argv[2] if len(sys.argv) > 2 else "/api/"
+
+    results = [run_worker(path) for _ in range(runs)]
+    print(f"cold import        median {statistics.median(r['import_ms'] for r in results):8.1f} ms")
+    print(f"first request      median {statistics.median(r['first_request_ms'] for r in results):8.1f} ms"
+          f"   (GET {path} -> {results[-1]['status']})")
+    print(f"heavy modules loaded: {', '.join(results[-1]['loaded']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
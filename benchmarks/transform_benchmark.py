@@ -0,0 +1,73 @@
+"""
+Benchmark of the per-document cost of turning product rows into Elasticsearch documents.
+
+Compares the previous path (DataFrame.to_dict followed by DocumentTransformer.transform_row
+on every record) with the column-wise batch stage (DocumentTransformer.transform_batch) on a
+synthetic chunk, and checks that both produce the same documents.
+
+Usage:
+    python -m benchmarks.transform_benchmark [rows]
+"""
+import sys
+import time
+import random
+import datetime
+import pandas as pd
+from src.services.document_transformer import DocumentTransformer
+
+
+def synthetic_rows(count):
+    random.seed(42)
+    created_at = datetime.datetime(2025, 3, 24, 10, 55, 36)
+    rows = []
+    for i in range(1, count + 1):
+        located = random.random() > 0.1
+        rows.append({
+            "id": i,
+            "user_id": i,
+            "name": f"Product {i}",
+            "category_id": random.randint(1, 10),
+            "price": random.choice([None, random.randint(100, 10 ** 9)]),
+            "latitude": random.uniform(-90, 90) if located else None,
+            "longitude": random.uniform(-180, 180) if located else None,
+            "country": 1,
+            "created_at": created_at,
+            "updated_at": created_at,
+            "deleted_at": None,
+        })
+    return rows
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    transformer = DocumentTransformer()
+    categories = {i: (f"Category {i}", f"Catégorie {i}") for i in range(1, 11)}
+    df = pd.DataFrame(synthetic_rows(count))
+
+    started = time.perf_counter()
+    reference = []
+    for row in df.to_dict(orient="records"):
+        row = {column: None if pd.isna(value) else value for column, value in row.items()}
+        reference.append(transformer.transform_row(row, categories))
+    per_row = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch = transformer.transform_batch(df, categories)
+    per_batch = time.perf_counter() - started
+
+    for document in reference:
+        for column in transformer.timestamp_columns:
+            if document[column] is not None:
+                document[column] = document[column].strftime("%Y-%m-%dT%H:%M:%S")
+        for column in transformer.integer_columns:
+            if document.get(column) is not None:
+                document[column] = int(document[column])
+    assert batch == reference, "batch transformation differs from the per-row reference"
+
+    print(f"rows:      {count}")
+    print(f"per-row:   {per_row * 1e6 / count:.2f} us/doc")
+    print(f"batch:     {per_batch * 1e6 / count:.2f} us/doc")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,99 @@
 import os
+import threading
+from dotenv import load_dotenv
+
+# Loaded before any submodule reads its os.getenv settings.
+load_dotenv()
+
 from decouple import config
 from flask import Flask, render_template
-from flask_avatars import Avatars
-from flask_login import LoginManager
-from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-from flask_caching import Cache
 
-from src.api.routes import api
+_app = None
+_app_lock = threading.Lock()
+_extensions = {}
+_extensions_lock = threading.RLock()
+
+# The extension packages are only imported once the application is created, not when src is
+# imported. Every extension is initialised by create_app, before the first request: SQLAlchemy,
+# LoginManager and Avatars register request hooks, which Flask refuses once requests are served.
+EXTENSIONS = ("cache", "db", "moment", "login_manager", "avatars")
+
+
+def create_app(settings=None):
+    """
+    Function to create the Flask application.
+    :param settings: The config object path, APP_SETTINGS by default.
+    :return:
+        Flask: The application.
+    """
+    from src.api.routes import api
+
+    app = Flask(__name__)
+    app.config.from_object(settings or config("APP_SETTINGS"))
+
+    for name in EXTENSIONS:
+        get_extension(name, app)
 
+    # from src.website.routes import website
+    #
+    #  Registering blueprints
+    # app.register_blueprint(website, url_prefix='/')
+    # app.register_blueprint(auth, url_prefix='/auth/')
+    app.register_blueprint(api, url_prefix='/api/')
+    return app
 
-app = Flask(__name__)
-app.config.from_object(config("APP_SETTINGS"))
 
-db = SQLAlchemy(app)
+def get_app():
+    global _app
+    with _app_lock:
+        if _app is None:
+            _app = create_app()
+    return _app
 
-app.config['SESSION_SQLALCHEMY'] = db
 
-moment = Moment(app)
+def get_extension(name, app=None):
+    """
+    Function to get a Flask extension of the application, building it when create_app has not yet.
+    :param name: cache, db, moment, login_manager or avatars.
+    :param app: The application, the default one when None.
+    :return:
+        The extension.
+    """
+    app = app or get_app()
+    with _extensions_lock:
+        key = (id(app), name)
+        if key not in _extensions:
+            _extensions[key] = build_extension(name, app)
+        return _extensions[key]
 
-login_manager = LoginManager(app)
-login_manager.login_view = 'auth.login'
 
-avatars = Avatars(app)
+def build_extension(name, app):
+    if name == "cache":
+        from flask_caching import Cache
+        extension = Cache(app)
+    elif name == "db":
+        from flask_sqlalchemy import SQLAlchemy
+        extension = SQLAlchemy(app)
+        app.config['SESSION_SQLALCHEMY'] = extension
+    elif name == "moment":
+        from flask_moment import Moment
+        extension = Moment(app)
+    elif name == "login_manager":
+        from flask_login import LoginManager
+        extension = LoginManager(app)
+        extension.login_view = 'auth.login'
+    elif name == "avatars":
+        from flask_avatars import Avatars
+        extension = Avatars(app)
+    else:
+        raise AttributeError(f"module 'src' has no attribute '{name}'")
+    return extension
 
-cache = Cache(app)
 
-# from src.website.routes import website
-#
-#  Registering blueprints
-# app.register_blueprint(website, url_prefix='/')
-# app.register_blueprint(auth, url_prefix='/auth/')
-app.register_blueprint(api, url_prefix='/api/')
+def __getattr__(name):
+    # Keeps `from src import app` and `from src import cache` working without building anything at import.
+    if name == "app":
+        return get_app()
+    if name in EXTENSIONS:
+        return get_extension(name)
+    raise AttributeError(f"module 'src' has no attribute '{name}'")
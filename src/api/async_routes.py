@@ -0,0 +1,135 @@
+import json
+import asyncio
+import logging
+from src.api.routes import search_params, map_view_params, get_search_service
+from src.services.async_search_service import AsyncSearchService
+
+async_search_service = None
+
+
+def get_async_search_service():
+    # Created on first use, from inside the event loop that serves the requests.
+    global async_search_service
+    if async_search_service is None:
+        async_search_service = AsyncSearchService()
+    return async_search_service
+
+
+async def read_json(receive):
+    """
+    Function to read and decode a JSON request body.
+    :return:
+        The decoded body, or None when it is empty or not JSON.
+    """
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+
+    try:
+        return json.loads(b"".join(chunks) or b"null")
+    except ValueError:
+        return None
+
+
+async def send_json(send, payload, status=200):
+    body = json.dumps(payload, default=str).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def search(data):
+    if not data or not data.get("query"):
+        return {"error": "query is required"}, 400
+
+    params = search_params(data)
+
+    if data.get("pagination") == "cursor" or data.get("cursor"):
+        # Cursor pages keep point-in-time state; they run on the synchronous service.
+        cursor_params = {name: value for name, value in params.items() if name not in ("page_num", "facets")}
+        try:
+            products, total, next_cursor = await asyncio.to_thread(
+                get_search_service().search_products_cursor, cursor=data.get("cursor"),
+                use_pit=bool(data.get("use_pit", False)), **cursor_params
+            )
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        return {"products": products, "total": total, "next_cursor": next_cursor}, 200
+
+    service = get_async_search_service()
+    try:
+        if data.get("suggestions"):
+            result, suggestions = await service.search_with_suggestions(params)
+            return {**service.result_entry(result), "suggestions": suggestions}, 200
+        result = await service.search_products(**params)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+    return service.result_entry(result), 200
+
+
+async def search_batch(data):
+    if not data or not isinstance(data.get("searches"), list):
+        return {"error": "searches is required"}, 400
+
+    searches = [search_params(search) if isinstance(search, dict) else {"search_term": None}
+                for search in data["searches"]]
+    results = await get_async_search_service().search_products_batch(searches)
+    return {"results": results}, 200
+
+
+async def map_view(data):
+    if not data or any(data.get(name) is None for name in ("top", "left", "bottom", "right", "zoom")):
+        return {"error": "top, left, bottom, right and zoom are required"}, 400
+
+    try:
+        result = await get_async_search_service().map_products(**map_view_params(data))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return result, 200
+
+
+async def suggest(data):
+    if not data or not data.get("query"):
+        return {"error": "query is required"}, 400
+
+    search_term = data.get("query")
+    suggestions, total = await get_async_search_service().suggest(
+        data.get("country", 1), search_term, limit=data.get("limit", 20), page_num=data.get("page_num", 1),
+        locale=data.get("locale", "En")
+    )
+    return {"suggestions": suggestions, "total": total}, 200
+
+
+async_routes = {
+    ("POST", "/api/search"): search,
+    ("POST", "/api/search/batch"): search_batch,
+    ("POST", "/api/map"): map_view,
+    ("POST", "/api/suggest_search_terms"): suggest
+}
+
+
+async def handle(scope, receive, send):
+    """
+    Function to serve one of async_routes.
+    :return:
+    """
+    handler = async_routes[(scope["method"], scope["path"])]
+    data = await read_json(receive)
+    try:
+        payload, status = await handler(data)
+    except Exception as e:
+        logging.error(f"{scope['path']} failed: {str(e)}")
+        payload, status = {"error": f"error: {str(e)}"}, 500
+    await send_json(send, payload, status)
+
+
+async def shutdown():
+    if async_search_service is not None:
+        await async_search_service.close()
@@ -1,61 +1,286 @@
+import json
+import click
+import logging
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from flask import Flask, jsonify, request, abort, make_response, Response, Blueprint
-from src.utils.utils import Utils
+from src.utils.query_parser import query_parser
 from src.services.search_service import SearchService
-from src.services.data_ingestion_service import IngestionService
+from src.services.search_cache import search_cache
+from src.services.suggestion_index import suggestion_index
+from src.services.search_batcher import SearchBatcher
+from src.utils.metrics import search_metrics
+from src.db_connection.elasticsearchDBconnection import SearchElasticsearchDBConnection
 
-utils = Utils()
-search_service = SearchService()
-ingestion_service = IngestionService()
 api = Blueprint('api', __name__)
 
+# Services are created on first use, so importing the routes opens no connection, and the
+# ingestion stack (pandas, SQLAlchemy) is only imported by a worker that serves an ingestion route.
+_services_lock = threading.Lock()
+_search_service = None
+_ingestion_service = None
+_search_batcher = None
+_reindex_thread = None
+
+
+def get_search_service():
+    global _search_service
+    with _services_lock:
+        if _search_service is None:
+            _search_service = SearchService()
+    return _search_service
+
+
+def get_ingestion_service():
+    global _ingestion_service
+    with _services_lock:
+        if _ingestion_service is None:
+            from src.services.data_ingestion_service import IngestionService
+            _ingestion_service = IngestionService()
+    return _ingestion_service
+
+
+def get_search_batcher():
+    global _search_batcher
+    search_service = get_search_service()
+    with _services_lock:
+        if _search_batcher is None:
+            _search_batcher = SearchBatcher(search_service)
+    return _search_batcher
+
 @api.route("/", methods=["GET"])
 def hello():
     return "Hello world"
 
 @api.route("/index_or_update_product", methods=["POST"])
 def index():
+    """
+    Merges the body into the stored product. With ?version_on_updated_at=true the body must be the
+    full product document: it replaces the stored one unless a newer updated_at is indexed (409).
+    """
     data = request.get_json()
     if not data or not data.get("id"):
         return make_response(jsonify({"error": "id is required"}), 400)
 
-    response = ingestion_service.index_product(data, index_name="products_index")
-    return make_response(jsonify(response), 200)
+    response = get_ingestion_service().index_product(
+        data,
+        index_name="products_index",
+        if_seq_no=request.args.get("if_seq_no", type=int),
+        if_primary_term=request.args.get("if_primary_term", type=int),
+        version_on_updated_at=request.args.get("version_on_updated_at", "false").lower() == "true"
+    )
+    return make_response(jsonify(response), response["status"])
+
+def read_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if line:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+@api.route("/index_or_update_products", methods=["POST"])
+def index_batch():
+    if request.mimetype in ("application/x-ndjson", "application/ndjson"):
+        data = read_ndjson(request.stream)
+    else:
+        data = request.get_json(silent=True)
+        if not isinstance(data, list):
+            return make_response(jsonify({"error": "a JSON array or an NDJSON body is required"}), 400)
+
+    statuses = get_ingestion_service().index_products(data)
+    errors = sum(1 for status in statuses if status["status"] >= 300)
+    return make_response(jsonify({"items": statuses, "errors": errors}), 200)
+
+def run_reindex(resume, force):
+    result = get_ingestion_service().setup_products_index(resume=resume, force=force)
+    if isinstance(result, str):
+        logging.error(f"Reindex failed: {result}")
 
 @api.route("/setup_products_index", methods=["GET"])
 def setup():
-    response = ingestion_service.setup_products_index()
-    return make_response(jsonify(response), 200)
+    """
+    Starts a full reindex in a background thread of this worker; /reindex_status follows its progress.
+    If the worker dies before the end, the checkpoint lets `flask api reindex --resume` carry on.
+    """
+    global _reindex_thread
+    resume = request.args.get("resume", "false").lower() == "true"
+    force = request.args.get("force", "false").lower() == "true"
+    ingestion_service = get_ingestion_service()
+    checkpoint = ingestion_service.reindex_state.load()
 
-@api.route("/search", methods=["POST"])
-def search():
-    data = request.get_json()
-    if not data or not data.get("query"):
-        return make_response(jsonify({"error": "query is required"}), 400)
+    with _services_lock:
+        if (_reindex_thread is not None and _reindex_thread.is_alive()) or (
+                checkpoint and ingestion_service.reindex_running(checkpoint) and not force):
+            return make_response(jsonify({"error": "a reindex is already running",
+                                          "progress": ingestion_service.reindex_progress()}), 409)
+        _reindex_thread = threading.Thread(target=run_reindex, args=(resume, force), name="products-reindex",
+                                           daemon=True)
+        _reindex_thread.start()
+
+    return make_response(jsonify({"status": "started", "progress": "/api/reindex_status"}), 202)
+
+@api.route("/reindex_status", methods=["GET"])
+def reindex_status():
+    return make_response(jsonify(get_ingestion_service().reindex_progress()), 200)
+
+@api.cli.command("reindex")
+@click.option("--resume", is_flag=True, help="Resume the last failed reindex from its checkpoint.")
+@click.option("--force", is_flag=True, help="Start even though the checkpoint says another reindex is running.")
+def reindex_command(resume, force):
+    click.echo(json.dumps(get_ingestion_service().setup_products_index(resume=resume, force=force), default=str))
+
+@api.cli.command("reindex-status")
+def reindex_status_command():
+    click.echo(json.dumps(get_ingestion_service().reindex_progress(), indent=2, default=str))
+
+@api.cli.command("country-report")
+def country_report_command():
+    click.echo(json.dumps(get_ingestion_service().country_report(), indent=2, default=str))
+
+@api.cli.command("run-scheduler")
+def run_scheduler_command():
+    """Run the background jobs; start this in exactly one process."""
+    from src.tasks.scheduler import run_scheduler
+    run_scheduler()
+
+@api.cli.command("refresh-freshness")
+def refresh_freshness_command():
+    click.echo(json.dumps(get_ingestion_service().refresh_freshness(), default=str))
 
+@api.route("/country_report", methods=["GET"])
+def country_report():
+    return make_response(jsonify(get_ingestion_service().country_report()), 200)
+
+@api.route("/sync_products_index", methods=["GET"])
+def sync():
+    response = get_ingestion_service().sync_products_delta()
+    return make_response(jsonify(response), 200)
+
+def search_params(data):
+    """
+    Function to read the search_products keyword arguments from a /search request body.
+    """
     search_term = data.get("query")
-    latitude = data.get("latitude", None)
-    longitude = data.get("longitude", None)
-    sort_by = data.get("sort_by", "relevance_high_low")
-    limit = data.get("limit", 20)
-    page_num = data.get("page_num", 1)
-    country = data.get("country", 1)
-    radius_km = data.get("radius_km", 20)
     min_price = data.get("min_price", None)
     max_price = data.get("max_price", None)
-    category_id = data.get("category_id", None)
-    locale = data.get("locale", "En")
 
-    extracted_prices = utils.extract_prices(search_term)
+    extracted_prices = query_parser.parse(search_term).prices if search_term else ()
     if len(extracted_prices) and max(extracted_prices) > 50 and not min_price and not max_price:
         max_price = max(extracted_prices)
         min_price = max_price - 0.2 * max_price
 
-    print(max_price)
-    print(min_price)
+    return {
+        "search_term": search_term,
+        "latitude": data.get("latitude", None),
+        "longitude": data.get("longitude", None),
+        "sort_by": data.get("sort_by", "relevance_high_low"),
+        "limit": data.get("limit", 20),
+        "page_num": data.get("page_num", 1),
+        "country": data.get("country", 1),
+        "radius_km": data.get("radius_km", 20),
+        "min_price": min_price,
+        "max_price": max_price,
+        "category_id": data.get("category_id", None),
+        "locale": data.get("locale", "En"),
+        "fields": data.get("fields", "listing"),
+        "brand_id": data.get("brand_id", None),
+        "whole_sale": data.get("whole_sale", None),
+        "facets": bool(data.get("facets", False))
+    }
+
+@api.route("/search", methods=["POST"])
+def search():
+    data = request.get_json()
+    if not data or not data.get("query"):
+        return make_response(jsonify({"error": "query is required"}), 400)
+
+    params = search_params(data)
+
+    if data.get("pagination") == "cursor" or data.get("cursor"):
+        try:
+            cursor_params = {name: value for name, value in params.items() if name not in ("page_num", "facets")}
+            products, total, next_cursor = get_search_service().search_products_cursor(
+                cursor=data.get("cursor"), use_pit=bool(data.get("use_pit", False)), **cursor_params
+            )
+        except ValueError as e:
+            return make_response(jsonify({"error": str(e)}), 400)
+        return make_response(jsonify({"products": products, "total": total, "next_cursor": next_cursor}), 200)
+
+    if SearchBatcher.usable(request.environ):
+        try:
+            result = get_search_batcher().submit(params).result(timeout=30)
+        except FutureTimeoutError:
+            return make_response(jsonify({"error": "search timed out"}), 503)
+        except Exception as e:
+            logging.error(f"Batched search failed: {str(e)}")
+            return make_response(jsonify({"error": str(e)}), 503)
+        if "error" in result:
+            return make_response(jsonify({"error": result["error"]}), result["status"])
+        return make_response(jsonify(result), 200)
+
+    try:
+        result = get_search_service().search_products(**params)
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
+
+    return make_response(jsonify(SearchService.result_entry(result)), 200)
+
+def map_view_params(data):
+    """
+    Function to read the map_products keyword arguments from a /map request body.
+    """
+    params = search_params(data)
+    return {
+        "top": data.get("top"),
+        "left": data.get("left"),
+        "bottom": data.get("bottom"),
+        "right": data.get("right"),
+        "zoom": data.get("zoom"),
+        **{name: params[name] for name in ("search_term", "country", "min_price", "max_price", "category_id",
+                                           "brand_id", "whole_sale", "locale")}
+    }
+
+@api.route("/map", methods=["POST"])
+def map_view():
+    data = request.get_json()
+    if not data or any(data.get(name) is None for name in ("top", "left", "bottom", "right", "zoom")):
+        return make_response(jsonify({"error": "top, left, bottom, right and zoom are required"}), 400)
+
+    try:
+        result = get_search_service().map_products(**map_view_params(data))
+    except ValueError as e:
+        return make_response(jsonify({"error": str(e)}), 400)
+
+    return make_response(jsonify(result), 200)
+
+@api.route("/search/batch", methods=["POST"])
+def search_batch():
+    data = request.get_json()
+    if not data or not isinstance(data.get("searches"), list):
+        return make_response(jsonify({"error": "searches is required"}), 400)
+
+    searches = [search_params(search) if isinstance(search, dict) else {"search_term": None}
+                for search in data["searches"]]
+    results = get_search_service().search_products_batch(searches)
+    return make_response(jsonify({"results": results}), 200)
+
+@api.route("/search_cache_stats", methods=["GET"])
+def search_cache_stats():
+    return make_response(jsonify(search_cache.get_stats()), 200)
+
+@api.route("/suggestion_index_stats", methods=["GET"])
+def suggestion_index_stats():
+    return make_response(jsonify(suggestion_index.get_stats()), 200)
 
-    products, total = search_service.search_products(search_term, latitude, longitude, sort_by, limit, page_num, country, radius_km, min_price, max_price, category_id, locale)
+@api.route("/search_metrics", methods=["GET"])
+def search_metrics_view():
+    return make_response(jsonify(search_metrics.snapshot()), 200)
 
-    return make_response(jsonify({"products": products, "total": total}), 200)
+@api.route("/es_pool_stats", methods=["GET"])
+def es_pool_stats():
+    return make_response(jsonify(SearchElasticsearchDBConnection().pool_stats()), 200)
 
 @api.route("/suggest_search_terms", methods=["POST"])
 def suggest():
@@ -64,6 +289,9 @@ def suggest():
         return make_response(jsonify({"error": "query is required"}), 400)
 
     search_term = data.get("query")
-    suggestions = search_service.product_suggestions(search_term)
+    suggestions, total = get_search_service().suggest(
+        data.get("country", 1), search_term, limit=data.get("limit", 20), page_num=data.get("page_num", 1),
+        locale=data.get("locale", "En")
+    )
 
-    return make_response(jsonify({"suggestions": suggestions}), 200)
+    return make_response(jsonify({"suggestions": suggestions, "total": total}), 200)
@@ -0,0 +1,41 @@
+# Facet aggregations returned next to the search hits. Each facet counts the products
+# matching the search and every active filter except the one on its own field.
+PRICE_RANGES = [
+    {"key": "under_5k", "to": 5_000},
+    {"key": "5k_25k", "from": 5_000, "to": 25_000},
+    {"key": "25k_100k", "from": 25_000, "to": 100_000},
+    {"key": "100k_500k", "from": 100_000, "to": 500_000},
+    {"key": "500k_1m", "from": 500_000, "to": 1_000_000},
+    {"key": "over_1m", "from": 1_000_000}
+]
+
+CATEGORY_LABEL_FIELDS = {
+    "En": "category_name_en.raw",
+    "Fr": "category_name_fr.raw"
+}
+
+facets = {
+    "category": {
+        "field": "category_id",
+        "aggregation": {"terms": {"field": "category_id", "size": 30}}
+    },
+    "brand": {
+        "field": "brand_id",
+        "aggregation": {"terms": {"field": "brand_id", "size": 30}}
+    },
+    "whole_sale": {
+        "field": "whole_sale",
+        "aggregation": {"terms": {"field": "whole_sale", "size": 2}}
+    },
+    "price": {
+        "field": "price",
+        "aggregation": {"range": {"field": "price", "ranges": PRICE_RANGES}}
+    },
+    "price_stats": {
+        "field": "price",
+        "aggregation": {"stats": {"field": "price"}}
+    }
+}
+
+# Filters on these fields become a post_filter when facets are requested.
+facet_fields = ("category_id", "brand_id", "whole_sale", "price")
@@ -0,0 +1,17 @@
+# _source projections returned by the search endpoints, selected by name through the API.
+field_sets = {
+    "listing": {
+        "excludes": ["description", "description_fr", "search_index"]
+    },
+    "detail": {
+        "excludes": ["search_index"]
+    },
+    "map_pin": {
+        "includes": ["id", "name", "name_fr", "price", "price_formatted", "currency", "image", "category_id", "location"]
+    },
+    "suggestion": {
+        "includes": ["name", "name_fr"]
+    }
+}
+
+default_field_set = "listing"
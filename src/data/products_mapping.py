@@ -69,6 +69,9 @@ products_mapping = {
                     }
                 }
             },
+            "freshness": {
+                "type": "rank_feature"
+            },
             "hash": {
                 "type": "text",
                 "analyzer": "standard"
@@ -160,3 +163,147 @@ products_mapping = {
         }
     }
 }
+
+# Same query behaviour on a smaller index. Fields only matched at their root are plain text with
+# the same analyzer (scores are unchanged); name and name_fr keep fast prefixes for the bool_prefix
+# suggestions through index_prefixes instead of shingle subfields. Keyword subfields are kept only
+# where they are sorted or aggregated on, with ignore_above. Display-only fields are kept in _source
+# but not indexed, and unknown columns are not mapped. Norms are dropped where they can not change a
+# score: hash is a single token in every document, and fields that are not indexed have none. The
+# other searched fields keep them, since BM25 would stop favouring short names and descriptions.
+lean_products_mapping = {
+    "mappings": {
+        "dynamic": False,
+        "properties": {
+            "brand_id": {
+                "type": "integer"
+            },
+            "category_id": {
+                "type": "integer"
+            },
+            "category_name_en": {
+                "type": "text",
+                "analyzer": "english",
+                "fields": {
+                    "raw": {
+                        "type": "keyword",
+                        "ignore_above": 256
+                    }
+                }
+            },
+            "category_name_fr": {
+                "type": "text",
+                "analyzer": "french",
+                "fields": {
+                    "raw": {
+                        "type": "keyword",
+                        "ignore_above": 256
+                    }
+                }
+            },
+            "country": {
+                "type": "integer"
+            },
+            "created_at": {
+                "type": "date"
+            },
+            "currency": {
+                "type": "keyword",
+                "index": False,
+                "doc_values": False
+            },
+            "deleted_at": {
+                "type": "date",
+                "index": False,
+                "doc_values": False
+            },
+            "description": {
+                "type": "text",
+                "analyzer": "english"
+            },
+            "description_fr": {
+                "type": "text",
+                "analyzer": "french"
+            },
+            "freshness": {
+                "type": "rank_feature"
+            },
+            "hash": {
+                "type": "text",
+                "analyzer": "standard",
+                "norms": False
+            },
+            "id": {
+                "type": "integer"
+            },
+            "image": {
+                "type": "keyword",
+                "index": False,
+                "doc_values": False
+            },
+            "latitude": {
+                "type": "double",
+                "index": False,
+                "doc_values": False
+            },
+            "location": {
+                "type": "geo_point"
+            },
+            "longitude": {
+                "type": "double",
+                "index": False,
+                "doc_values": False
+            },
+            "name": {
+                "type": "text",
+                "analyzer": "english",
+                "index_prefixes": {
+                    "min_chars": 1,
+                    "max_chars": 10
+                },
+                "fields": {
+                    "raw": {
+                        "type": "keyword",
+                        "ignore_above": 256
+                    }
+                }
+            },
+            "name_fr": {
+                "type": "text",
+                "analyzer": "french",
+                "index_prefixes": {
+                    "min_chars": 1,
+                    "max_chars": 10
+                }
+            },
+            "price": {
+                "type": "integer"
+            },
+            "price_formatted": {
+                "type": "keyword",
+                "index": False,
+                "doc_values": False
+            },
+            "search_index": {
+                "type": "text",
+                "analyzer": "standard"
+            },
+            "updated_at": {
+                "type": "date"
+            },
+            "user_id": {
+                "type": "integer",
+                "index": False,
+                "doc_values": False
+            },
+            "whole_sale": {
+                "type": "integer"
+            }
+        }
+    }
+}
+
+mapping_profiles = {
+    "standard": products_mapping,
+    "lean": lean_products_mapping
+}
@@ -0,0 +1,82 @@
+import os
+import json
+from src.services.query_builder import ProductQueryBuilder
+from src.utils.freshness import FRESHNESS_FIELD
+
+# Precompiled pieces of the product search query. They are shared between requests and must
+# never be mutated; the version is bumped whenever they (or products_mapping) change shape.
+SEARCH_TEMPLATE_VERSION = 4
+PRODUCTS_SEARCH_TEMPLATE_ID = f"products_search_v{SEARCH_TEMPLATE_VERSION}"
+
+# The score a product needs to be returned. The cutoff used to be 4.7 on scores that included
+# 1 for the country term and, with a category, 2 for the two category matches; those constraints
+# are filters now, so the cutoff is lowered by the same constants and the same products pass.
+MIN_SCORE = float(os.getenv("SEARCH_MIN_SCORE", 3.7))
+CATEGORY_MIN_SCORE_CREDIT = float(os.getenv("SEARCH_CATEGORY_MIN_SCORE_CREDIT", 2))
+
+SEARCH_FIELDS = {
+    "En": ["name^2", "category_name_en^2", "description", "search_index", "hash"],
+    "Fr": ["name_fr^2", "category_name_fr^2", "description_fr", "search_index", "hash"]
+}
+
+# Recency is the precomputed freshness of the product, added to the text score.
+RECENCY_CLAUSES = ProductQueryBuilder().rank_feature(FRESHNESS_FIELD).should
+
+SORT_TABLE = {
+    "alphabetically_az": {"name.raw": "asc"},
+    "alphabetically_za": {"name.raw": "desc"},
+    "price_low_high": {"price": "asc"},
+    "price_high_low": {"price": "desc"},
+    "date_old_new": {"created_at": "asc"},
+    "date_new_old": {"created_at": "desc"},
+    "relevance_low_high": {"_score": "asc"},
+    "relevance_high_low": {"_score": "desc"}
+}
+
+GEO_SORT_ORDERS = {
+    "distance_near_far": "asc",
+    "distance_far_near": "desc"
+}
+
+DEFAULT_SORT = {"_score": "desc"}
+
+# Stored mustache template of search_products: requests only send the template id and params.
+products_search_template = {
+    "script": {
+        "lang": "mustache",
+        "source": """{
+            "size": {{size}},
+            "from": {{from}},
+            "min_score": {{min_score}},
+            "_source": {{#toJson}}source{{/toJson}},
+            {{#facets}}
+            "post_filter": {"bool": {"filter": {{#toJson}}post_filter{{/toJson}}}},
+            "aggs": {{#toJson}}aggs{{/toJson}},
+            {{/facets}}
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "multi_match": {
+                                "query": {{#toJson}}query{{/toJson}},
+                                {{#fuzziness}}"fuzziness": "{{fuzziness}}",{{/fuzziness}}
+                                "fields": {{#fr}}%(fields_fr)s{{/fr}}{{^fr}}%(fields_en)s{{/fr}}
+                            }
+                        }
+                    ],
+                    "should": %(should)s,
+                    "filter": {{#toJson}}filters{{/toJson}}
+                }
+            },
+            "sort": {{#toJson}}sort{{/toJson}}
+        }""" % {
+            "fields_fr": json.dumps(SEARCH_FIELDS["Fr"]),
+            "fields_en": json.dumps(SEARCH_FIELDS["En"]),
+            "should": json.dumps(RECENCY_CLAUSES)
+        }
+    }
+}
+
+search_templates = {
+    PRODUCTS_SEARCH_TEMPLATE_ID: products_search_template
+}
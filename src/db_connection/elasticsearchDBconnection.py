@@ -1,22 +1,157 @@
 import os
-from elasticsearch import Elasticsearch
+import threading
+from urllib.parse import urlsplit
+from elasticsearch import Elasticsearch, AsyncElasticsearch
 import logging
 
+try:
+    from elasticsearch.serializer import OrjsonSerializer
+except ImportError:
+    OrjsonSerializer = None
+
 logging.basicConfig(level=logging.INFO)
 
 class ElasticsearchDBConnection:
+    """
+    Process-wide Elasticsearch client factory.
+
+    Every instance hands out the same client, so a process holds one connection pool
+    per node no matter how many services use it. Connections are kept alive between
+    requests and pooled up to connections_per_node per node. A forked worker never
+    reuses the sockets of its parent: the client is rebuilt on first use in the child.
+
+    Requests are not sent again after a timeout by default: a timed out bulk request may
+    still be applied, and a search retried on timeout can hold the caller for
+    (max_retries + 1) * request_timeout.
+    """
     host = os.getenv("ES_HOST")
     username = os.getenv("ES_USERNAME")
     password = os.getenv("ES_PASSWORD")
     port = os.getenv("ES_PORT")
+    connections_per_node = int(os.getenv("ES_CONNECTIONS_PER_NODE", 10))
+    request_timeout = float(os.getenv("ES_REQUEST_TIMEOUT", 30))
+    http_compress = os.getenv("ES_HTTP_COMPRESS", "true").lower() == "true"
+    max_retries = int(os.getenv("ES_MAX_RETRIES", 3))
+    retry_on_timeout = os.getenv("ES_RETRY_ON_TIMEOUT", "false").lower() == "true"
+    sniff = os.getenv("ES_SNIFF", "false").lower() == "true"
+    sniff_interval = float(os.getenv("ES_SNIFF_INTERVAL", 60))
+    search_request_timeout = float(os.getenv("ES_SEARCH_REQUEST_TIMEOUT", 10))
+    search_http_compress = os.getenv("ES_SEARCH_HTTP_COMPRESS", "false").lower() == "true"
+    search_max_retries = int(os.getenv("ES_SEARCH_MAX_RETRIES", 1))
+    client_class = Elasticsearch
+    purpose = "write"
+
+    _clients = {}
+    _pid = os.getpid()
+    _lock = threading.Lock()
 
     def __init__(self):
-        self.es = Elasticsearch(
-            [self.host],
-            basic_auth=(self.username, self.password),
-            verify_certs=False
-        )
+        if ElasticsearchDBConnection._pid != os.getpid():
+            ElasticsearchDBConnection.reset()
+
+        with ElasticsearchDBConnection._lock:
+            client = ElasticsearchDBConnection._clients.get((self.client_class, self.purpose))
+            if client is None:
+                client = self.create_client()
+                ElasticsearchDBConnection._clients[(self.client_class, self.purpose)] = client
+        self.es = client
+
+    @staticmethod
+    def reset():
+        """
+        Function to forget the clients of the parent process after a fork.
+        :return:
+        """
+        ElasticsearchDBConnection._clients = {}
+        ElasticsearchDBConnection._pid = os.getpid()
+        ElasticsearchDBConnection._lock = threading.Lock()
+
+    @classmethod
+    def hosts(cls):
+        """
+        Function to build the node URLs from ES_HOST (comma separated) and ES_PORT.
+        :return:
+            list: The node URLs.
+        """
+        hosts = []
+        for host in (cls.host or "").split(","):
+            host = host.strip()
+            if not host:
+                continue
+            if "://" not in host:
+                host = f"http://{host}"
+            if cls.port and urlsplit(host).port is None:
+                host = f"{host.rstrip('/')}:{cls.port}"
+            hosts.append(host)
+        return hosts
+
+    def client_options(self):
+        search = self.purpose == "search"
+        options = {
+            "basic_auth": (self.username, self.password),
+            "verify_certs": False,
+            "connections_per_node": self.connections_per_node,
+            "request_timeout": self.search_request_timeout if search else self.request_timeout,
+            "http_compress": self.search_http_compress if search else self.http_compress,
+            "max_retries": self.search_max_retries if search else self.max_retries,
+            "retry_on_timeout": False if search else self.retry_on_timeout
+        }
+        if OrjsonSerializer is not None:
+            options["serializer"] = OrjsonSerializer()
+        if self.sniff:
+            options["sniff_on_start"] = True
+            options["sniff_on_node_failure"] = True
+            options["min_delay_between_sniffing"] = self.sniff_interval
+        return options
+
+    def create_client(self):
+        logging.info(f"Creating {self.purpose} {self.client_class.__name__} client for {self.hosts()} "
+                     f"with {self.connections_per_node} connections per node.")
+        return self.client_class(self.hosts(), **self.client_options())
 
     def es_connection(self):
         return self.es
 
+    def pool_stats(self):
+        """
+        Function to report the connection pool of every node the client knows about.
+        :return:
+            dict: Per-node pool size, in-use and idle connections, connections created and requests sent.
+        """
+        nodes = []
+        for node in self.es.transport.node_pool.all():
+            stats = {"node": node.base_url, "max_connections": self.connections_per_node}
+            pool = getattr(node, "pool", None)
+            if pool is not None and hasattr(pool, "num_connections"):
+                # Every free slot sits in the pool queue: an idle connection or a None placeholder.
+                slots = list(pool.pool.queue)
+                stats.update({
+                    "in_use_connections": pool.pool.maxsize - len(slots),
+                    "idle_connections": sum(1 for conn in slots if conn is not None),
+                    "connections_created": pool.num_connections,
+                    "requests": pool.num_requests
+                })
+            nodes.append(stats)
+        return {"pid": os.getpid(), "client": self.client_class.__name__, "purpose": self.purpose, "nodes": nodes}
+
+
+class SearchElasticsearchDBConnection(ElasticsearchDBConnection):
+    """
+    Client for the search path, with its own pool.
+
+    A search gives up after search_request_timeout and is never retried on timeout, and its
+    small bodies are sent uncompressed; connection errors are retried search_max_retries times.
+    """
+    purpose = "search"
+
+
+class AsyncElasticsearchDBConnection(SearchElasticsearchDBConnection):
+    """
+    Same cluster settings as SearchElasticsearchDBConnection, on the asyncio client.
+
+    The client must be created from inside the running event loop that uses it.
+    """
+    client_class = AsyncElasticsearch
+
+
+os.register_at_fork(after_in_child=ElasticsearchDBConnection.reset)
@@ -0,0 +1,202 @@
+import time
+import asyncio
+from src.db_connection.elasticsearchDBconnection import AsyncElasticsearchDBConnection
+from src.services.search_service import SearchService, SEARCH_DEFAULTS
+from src.services.search_cache import search_cache
+from src.services.suggestion_index import suggestion_index
+from src.services.country_routing import country_routing
+from src.data.search_templates import search_templates
+from src.data.field_sets import default_field_set
+from src.utils.metrics import search_metrics
+
+
+class AsyncSearchService(SearchService):
+    """
+    SearchService on AsyncElasticsearch, for the ASGI entry point.
+
+    Queries are built by the same SearchService methods, so both paths send identical
+    requests and share the search cache. A worker no longer blocks on an Elasticsearch
+    round trip, and requests that need several searches send them concurrently. The
+    search cache client is synchronous, so cache lookups run in the default thread pool.
+    """
+    templates_lock = None
+
+    def __init__(self):
+        self.es = AsyncElasticsearchDBConnection().es_connection()
+
+    async def close(self):
+        await self.es.close()
+
+    async def search_products(self, search_term, latitude=None, longitude=None, sort_by="relevance_high_low",
+                              limit=20, page_num=1, country=1, radius_km=20, min_price=None,
+                              max_price=None, category_id=None, locale="En", fields=default_field_set,
+                              brand_id=None, whole_sale=None, facets=False):
+        """
+        Function to search products, see SearchService.search_products.
+        :return:
+            tuple: A tuple containing a list of products and the total result count, plus the facets when requested.
+        """
+        params = {
+            "search_term": search_term, "latitude": latitude, "longitude": longitude, "sort_by": sort_by,
+            "limit": limit, "page_num": page_num, "country": country, "radius_km": radius_km,
+            "min_price": min_price, "max_price": max_price, "category_id": category_id, "locale": locale,
+            "fields": fields, "brand_id": brand_id, "whole_sale": whole_sale, "facets": facets
+        }
+        self.source_filter(fields)
+        cache_key, cached = await asyncio.to_thread(search_cache.get, "products", params)
+        if cached is not None:
+            return tuple(cached)
+
+        if self.use_search_templates:
+            await self.ensure_search_templates()
+        await self.ensure_routing_checked()
+
+        for fuzziness in self.fuzziness_passes():
+            template, request = self.search_request(params, fuzziness)
+            response = await self.timed_search("search", fuzziness, template=template, **request)
+            if not self.needs_fuzzy_fallback("search", fuzziness, response):
+                break
+
+        result = self.search_result(response, params)
+        await asyncio.to_thread(search_cache.set, cache_key, list(result))
+        return result
+
+    async def search_products_batch(self, searches):
+        """
+        Function to run several product searches in a single _msearch round trip, see
+        SearchService.search_products_batch.
+        :return:
+            list: One {"products", "total"} or {"error", "status"} dictionary per search, in input order.
+        """
+        results, pending = await asyncio.to_thread(self.prepare_batch, searches)
+        if self.use_search_templates and pending:
+            await self.ensure_search_templates()
+        await self.ensure_routing_checked()
+
+        for fuzziness in self.fuzziness_passes():
+            if not pending:
+                break
+
+            template, request = self.multi_search_request(pending, fuzziness)
+            started = time.perf_counter()
+            if template:
+                response = await self.es.msearch_template(**request)
+            else:
+                response = await self.es.msearch(**request)
+            search_metrics.observe(f"msearch.{'fuzzy' if fuzziness else 'exact'}", (time.perf_counter() - started) * 1000)
+            search_metrics.incr("msearch.searches", len(pending))
+            pending = await asyncio.to_thread(self.collect_batch_responses, results, pending, fuzziness, response)
+
+        return results
+
+    async def suggest(self, country, user_input, limit=20, page_num=1, locale="En"):
+        """
+        Function to suggest product names, see SearchService.suggest.
+        :return:
+            tuple: A list of product names and the total count.
+        """
+        result = await asyncio.to_thread(suggestion_index.lookup, country, locale, user_input, limit, page_num)
+        if result is not None:
+            search_metrics.incr("suggest.prefix_index")
+            return result
+
+        search_metrics.incr("suggest.es_fallback")
+        return await self.product_suggestions("products_index", country, user_input, limit, page_num, locale,
+                                              passes=self.suggestion_fallback_passes())
+
+    async def product_suggestions(self, index_name, country, user_input, limit=20, page_num=1, locale="En",
+                                  passes=None):
+        """
+        Function to provide product suggestions, see SearchService.product_suggestions.
+        :return:
+            tuple: A tuple containing a list of relevant product names and the total result count.
+        """
+        offset = int((page_num - 1) * limit)
+        await self.ensure_routing_checked(index_name)
+
+        for fuzziness in passes or self.fuzziness_passes():
+            search_query = self.suggestion_query(country, user_input, limit, offset, locale, fuzziness)
+            response = await self.timed_search("suggest", fuzziness, index=index_name, body=search_query,
+                                               request_timeout=30, **self.routing(country, index_name))
+            if not self.needs_fuzzy_fallback("suggest", fuzziness, response):
+                break
+
+        return self.suggestion_names(response, locale)
+
+    async def map_products(self, top, left, bottom, right, zoom, search_term=None, country=1, min_price=None,
+                           max_price=None, category_id=None, brand_id=None, whole_sale=None, locale="En"):
+        """
+        Function to draw the products of a map view in a single search, see SearchService.map_products.
+        :return:
+            dict: The clusters or the products, their total, and the bounds actually covered.
+        """
+        params = self.map_params({
+            "top": top, "left": left, "bottom": bottom, "right": right, "zoom": zoom, "search_term": search_term,
+            "country": country, "min_price": min_price, "max_price": max_price, "category_id": category_id,
+            "brand_id": brand_id, "whole_sale": whole_sale, "locale": locale
+        })
+        cache_key, cached = await asyncio.to_thread(search_cache.get, "map", params)
+        if cached is not None:
+            return cached
+        await self.ensure_routing_checked()
+
+        for fuzziness in self.fuzziness_passes():
+            response = await self.timed_search("map", fuzziness, **self.map_request(params, fuzziness))
+            if not params["search_term"] or not self.needs_fuzzy_fallback("map", fuzziness, response):
+                break
+
+        result = self.map_result(response, params)
+        await asyncio.to_thread(search_cache.set, cache_key, result)
+        return result
+
+    async def search_with_suggestions(self, params, suggestions_limit=5):
+        """
+        Function to search products and suggest search terms for the same input concurrently.
+        :param params: The search_products keyword arguments.
+        :param suggestions_limit: The number of suggestions to return.
+        :return:
+            tuple: The search_products result and the suggested product names.
+        """
+        params = {**SEARCH_DEFAULTS, **params}
+        result, (suggestions, _) = await asyncio.gather(
+            self.search_products(**params),
+            self.suggest(params["country"], params["search_term"], limit=suggestions_limit, locale=params["locale"])
+        )
+        return result, suggestions
+
+    async def timed_search(self, name, fuzziness, template=False, **kwargs):
+        """
+        Function to run a search, or a stored template search, and record its latency per pass.
+        """
+        started = time.perf_counter()
+        if template:
+            response = await self.es.search_template(**kwargs)
+        else:
+            response = await self.es.search(**kwargs)
+        search_metrics.observe(f"{name}.{'fuzzy' if fuzziness else 'exact'}", (time.perf_counter() - started) * 1000)
+        return response
+
+    @staticmethod
+    async def ensure_routing_checked(index_name="products_index"):
+        """
+        Function to refresh the cached country routing of an index off the event loop when it is due.
+        :return:
+        """
+        if not country_routing.is_current(index_name, search_cache.generation):
+            await asyncio.to_thread(country_routing.routed, index_name)
+
+    async def ensure_search_templates(self):
+        """
+        Function to register the stored search templates once per process.
+        :return:
+        """
+        if SearchService.templates_registered:
+            return
+
+        if AsyncSearchService.templates_lock is None:
+            AsyncSearchService.templates_lock = asyncio.Lock()
+        async with AsyncSearchService.templates_lock:
+            if not SearchService.templates_registered:
+                await asyncio.gather(*(self.es.put_script(id=template_id, body=template)
+                                       for template_id, template in search_templates.items()))
+                SearchService.templates_registered = True
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from elasticsearch import ApiError
+from elasticsearch.helpers import expand_action
+
+
+class BulkIndexer:
+    """
+    Concurrent bulk loader for Elasticsearch.
+
+    Actions are cut into chunks bounded both in documents and in bytes, and the chunks are
+    sent from a thread pool with a bounded number of requests in flight. Items rejected with
+    a 429 are retried with exponential backoff, and every other failure is reported per document.
+    """
+    thread_count = int(os.getenv("BULK_THREAD_COUNT", 4))
+    chunk_size = int(os.getenv("BULK_CHUNK_SIZE", 500))
+    max_chunk_bytes = int(os.getenv("BULK_MAX_CHUNK_BYTES", 10 * 1024 * 1024))
+    max_in_flight = int(os.getenv("BULK_MAX_IN_FLIGHT", 8))
+    max_retries = int(os.getenv("BULK_MAX_RETRIES", 5))
+    initial_backoff = float(os.getenv("BULK_INITIAL_BACKOFF", 1))
+    max_backoff = float(os.getenv("BULK_MAX_BACKOFF", 60))
+
+    def __init__(self, es, thread_count=None, chunk_size=None, max_chunk_bytes=None, max_in_flight=None):
+        self.es = es
+        self.thread_count = thread_count or self.thread_count
+        self.chunk_size = chunk_size or self.chunk_size
+        self.max_chunk_bytes = max_chunk_bytes or self.max_chunk_bytes
+        self.max_in_flight = max(max_in_flight or self.max_in_flight, self.thread_count)
+
+    @staticmethod
+    def empty_result():
+        return {"indexed": 0, "failed": 0, "retried": 0, "failures": []}
+
+    @staticmethod
+    def merge_result(total, partial):
+        total["indexed"] += partial["indexed"]
+        total["failed"] += partial["failed"]
+        total["retried"] += partial["retried"]
+        total["failures"].extend(partial["failures"])
+        return total
+
+    def chunk_actions(self, actions):
+        """
+        Generator cutting bulk actions into chunks bounded by chunk_size and max_chunk_bytes.
+        :param actions: An iterable of bulk actions.
+        :return:
+            generator: Yields lists of (action, source) pairs.
+        """
+        chunk, chunk_bytes = [], 0
+        for data in actions:
+            action, source = expand_action(data)
+            size = len(json.dumps(action)) + 1
+            if source is not None:
+                size += len(json.dumps(source, default=str)) + 1
+
+            if chunk and (len(chunk) >= self.chunk_size or chunk_bytes + size > self.max_chunk_bytes):
+                yield chunk
+                chunk, chunk_bytes = [], 0
+
+            chunk.append((action, source))
+            chunk_bytes += size
+
+        if chunk:
+            yield chunk
+
+    def send_chunk(self, chunk, ignore_status=()):
+        """
+        Function to send one chunk, retrying the items rejected with a 429.
+        :param chunk: A list of (action, source) pairs.
+        :param ignore_status: Item statuses that count as success, e.g. 404 for deletes.
+        :return:
+            dict: The result for this chunk.
+        """
+        result = self.empty_result()
+        pending = chunk
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(min(self.max_backoff, self.initial_backoff * 2 ** (attempt - 1)))
+                result["retried"] += len(pending)
+
+            operations = []
+            for action, source in pending:
+                operations.append(action)
+                if source is not None:
+                    operations.append(source)
+
+            try:
+                response = self.es.bulk(operations=operations)
+            except ApiError as e:
+                if e.status_code == 429:
+                    continue
+                raise
+
+            rejected = []
+            for (action, source), item in zip(pending, response["items"]):
+                op_type, info = next(iter(item.items()))
+                status = info.get("status", 500)
+
+                if 200 <= status < 300 or status in ignore_status:
+                    result["indexed"] += 1
+                elif status == 429:
+                    rejected.append((action, source))
+                else:
+                    error = info.get("error", {})
+                    result["failed"] += 1
+                    result["failures"].append({
+                        "id": info.get("_id"),
+                        "status": status,
+                        "reason": error.get("reason", str(error)) if isinstance(error, dict) else str(error)
+                    })
+
+            pending = rejected
+            if not pending:
+                return result
+
+        for action, source in pending:
+            result["failed"] += 1
+            result["failures"].append({
+                "id": next(iter(action.values())).get("_id"),
+                "status": 429,
+                "reason": f"rejected after {self.max_retries} retries"
+            })
+        return result
+
+    def run(self, actions, ignore_status=()):
+        """
+        Function to bulk load actions concurrently.
+        :param actions: An iterable (list or generator) of bulk actions.
+        :param ignore_status: Item statuses that count as success.
+        :return:
+            dict: Indexed, failed and retried counts with the failing ids and reasons.
+        """
+        total = self.empty_result()
+        started = time.time()
+
+        with ThreadPoolExecutor(max_workers=self.thread_count) as executor:
+            in_flight = set()
+            for chunk in self.chunk_actions(actions):
+                if len(in_flight) >= self.max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.merge_result(total, future.result())
+
+                in_flight.add(executor.submit(self.send_chunk, chunk, ignore_status))
+
+            for future in wait(in_flight).done:
+                self.merge_result(total, future.result())
+
+        total["took_seconds"] = round(time.time() - started, 3)
+        logging.info(
+            f"Bulk load done: {total['indexed']} indexed, {total['failed']} failed, "
+            f"{total['retried']} retried in {total['took_seconds']}s"
+        )
+        return total
@@ -0,0 +1,214 @@
+import os
+import time
+import logging
+import threading
+from src.db_connection.elasticsearchDBconnection import ElasticsearchDBConnection
+from src.services.query_builder import ProductQueryBuilder
+from src.services.search_cache import search_cache
+
+
+class CountryRouting:
+    """
+    Routes the product documents of a country to the same shard.
+
+    Every search and suggestion is restricted to one country, so with routing it only
+    queries the shard (or the routing_partition_size shards) holding that country instead
+    of every shard of the index. Indices created while ES_ROUTE_BY_COUNTRY is on require
+    a _routing and are marked with _meta.routing = "country". Reads and writes only pass
+    a routing to an index carrying the mark, so switching the flag on and reindexing can
+    happen in any order.
+    """
+    enabled = os.getenv("ES_ROUTE_BY_COUNTRY", "false").lower() == "true"
+    partition_size = int(os.getenv("ES_ROUTING_PARTITION_SIZE", 1))
+    check_seconds = int(os.getenv("ES_ROUTING_CHECK_SECONDS", 60))
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked = {}
+
+    @property
+    def es(self):
+        return ElasticsearchDBConnection().es_connection()
+
+    @staticmethod
+    def key(country):
+        """
+        Function to turn a country into its routing value, "1" for 1 and "1".
+        """
+        if country is None or country == "":
+            return None
+        return str(ProductQueryBuilder.normalize("country", country))
+
+    def index_body(self, body):
+        """
+        Function to add the country routing to the body of a new products index when enabled.
+        :param body: The index body with mappings and settings.
+        :return:
+            dict: The body to create the index with.
+        """
+        if not self.enabled:
+            return body
+
+        body = dict(body)
+        body["mappings"] = {
+            **body.get("mappings", {}),
+            "_routing": {"required": True},
+            "_meta": {**body.get("mappings", {}).get("_meta", {}), "routing": "country"}
+        }
+        if self.partition_size > 1:
+            settings = dict(body.get("settings", {}))
+            settings["index"] = {**settings.get("index", {}), "routing_partition_size": self.partition_size}
+            body["settings"] = settings
+        return body
+
+    def is_current(self, index_name, generation=None):
+        checked = self.checked.get(index_name)
+        return (checked is not None and checked[2] == generation
+                and time.monotonic() - checked[1] < self.check_seconds)
+
+    def routed(self, index_name, fresh=False):
+        """
+        Function to tell whether an index, or every index behind an alias, is routed by country.
+
+        Searches reuse the answer until the search cache generation changes, which every alias
+        swap bumps, and for check_seconds at most. Writes pass fresh to read the mapping of the
+        index the alias points to right now. When the mapping can not be read the previous
+        answer is kept, or no routing is used.
+        :param index_name: An index or alias name.
+        :param fresh: Skip the cached answer.
+        :return:
+            bool: True when reads and writes must pass the country routing.
+        """
+        generation = search_cache.current_generation()
+        if not fresh and self.is_current(index_name, generation):
+            return self.checked[index_name][0]
+
+        previous = self.checked.get(index_name, (False, 0, None))[0]
+        try:
+            mappings = self.es.indices.get_mapping(index=index_name)
+            routed = bool(mappings) and all(
+                mapping["mappings"].get("_meta", {}).get("routing") == "country" for mapping in mappings.values()
+            )
+        except Exception as e:
+            logging.warning(f"Could not read the routing of {index_name}: {str(e)}")
+            routed = previous
+
+        with self.lock:
+            self.checked[index_name] = (routed, time.monotonic(), generation)
+        return routed
+
+    def forget(self, index_name=None):
+        """
+        Function to drop the cached routing of an index, or of every index, after its alias moved.
+        """
+        with self.lock:
+            if index_name is None:
+                self.checked.clear()
+            else:
+                self.checked.pop(index_name, None)
+
+    def routing(self, index_name, country):
+        """
+        Function to get the routing of a request on one country of an index.
+        :return:
+            str: The routing value, None when the index is not routed by country.
+        """
+        return self.key(country) if self.routed(index_name) else None
+
+    def stored_routings(self, index_name, ids, routings=None):
+        """
+        Function to look up where products are currently stored.
+
+        The products are first fetched in real time under the expected routing, usually the
+        routing of their country. Where the others are stored can only be searched for, so the
+        index is refreshed first to make every acknowledged write visible to the search.
+        :param index_name:
+        :param ids: The product ids.
+        :param routings: The expected routing of every product, None where it is not known.
+        :return:
+            dict: {id: routing} for the products found.
+        """
+        ids = [str(product_id) for product_id in ids]
+        if not ids:
+            return {}
+
+        stored = {}
+        expected = [(product_id, routing) for product_id, routing in zip(ids, routings or []) if routing is not None]
+        if expected:
+            response = self.es.mget(index=index_name, docs=[{"_id": product_id, "routing": routing}
+                                                            for product_id, routing in expected], _source=False)
+            for (product_id, routing), doc in zip(expected, response["docs"]):
+                if doc.get("found"):
+                    stored[product_id] = routing
+
+        remaining = list(dict.fromkeys(product_id for product_id in ids if product_id not in stored))
+        if remaining:
+            self.es.indices.refresh(index=index_name)
+            response = self.es.search(index=index_name, query={"ids": {"values": remaining}}, size=len(remaining),
+                                      _source=False, filter_path=["hits.hits._id", "hits.hits._routing"])
+            stored.update({hit["_id"]: hit.get("_routing") for hit in response.get("hits", {}).get("hits", [])})
+        return stored
+
+    def report(self, index_name):
+        """
+        Function to report how the products are spread over the countries and the shards.
+
+        Shows the document count of every country, the shards its routing maps to, and the
+        documents per shard as they are now and as country routing would place them.
+        :param index_name:
+        :return:
+            dict: The per-country and per-shard counts with their skew (largest over mean).
+        """
+        response = self.es.search(index=index_name, size=0, aggs={
+            "countries": {"terms": {"field": "country", "size": 1000}},
+            "no_country": {"missing": {"field": "country"}}
+        })
+        total = response["hits"]["total"]["value"]
+
+        countries = []
+        projected = {}
+        for bucket in response["aggregations"]["countries"]["buckets"]:
+            shard_ids = sorted({group[0]["shard"] for group in self.es.search_shards(
+                index=index_name, routing=self.key(bucket["key"]))["shards"]})
+            countries.append({
+                "country": bucket["key"],
+                "documents": bucket["doc_count"],
+                "share": round(bucket["doc_count"] / total, 4) if total else 0,
+                "shards": shard_ids
+            })
+            for shard_id in shard_ids:
+                projected[shard_id] = projected.get(shard_id, 0) + bucket["doc_count"] / len(shard_ids)
+
+        current = {}
+        stats = self.es.indices.stats(index=index_name, level="shards", metric="docs")
+        for index_stats in stats["indices"].values():
+            for shard_id, copies in index_stats["shards"].items():
+                primary = next((copy for copy in copies if copy["routing"]["primary"]), copies[0])
+                current[int(shard_id)] = current.get(int(shard_id), 0) + primary["docs"]["count"]
+
+        shard_count = max(len(current), 1)
+        for shard_id in current:
+            projected.setdefault(shard_id, 0)
+
+        return {
+            "index": index_name,
+            "routed": self.routed(index_name),
+            "documents": total,
+            "documents_without_country": response["aggregations"]["no_country"]["doc_count"],
+            "countries": countries,
+            "country_skew": self.skew([country["documents"] for country in countries]),
+            "shards": {
+                "current": current,
+                "current_skew": self.skew(list(current.values()) or [0]),
+                "with_country_routing": {shard_id: round(count) for shard_id, count in sorted(projected.items())},
+                "with_country_routing_skew": self.skew(list(projected.values()) or [0], shard_count)
+            }
+        }
+
+    @staticmethod
+    def skew(counts, buckets=None):
+        mean = sum(counts) / (buckets or len(counts) or 1)
+        return round(max(counts or [0]) / mean, 2) if mean else 0
+
+
+country_routing = CountryRouting()
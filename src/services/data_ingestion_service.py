@@ -1,58 +1,240 @@
+import os
+import math
+import time
+import socket
+from datetime import datetime, timezone
 import pandas as pd
-from elasticsearch.helpers import bulk
+from elasticsearch import ConflictError
+from elasticsearch.helpers import scan
 from sqlalchemy import text
 from src.data import products_mapping
+from src.data.search_templates import search_templates
 from src.db_connection.mysqlDBconnection import DBConnection
 from src.db_connection.elasticsearchDBconnection import ElasticsearchDBConnection
+from src.services.bulk_indexer import BulkIndexer
+from src.services.document_transformer import DocumentTransformer
+from src.services.write_buffer import WriteBuffer
+from src.services.search_cache import search_cache
+from src.services.country_routing import country_routing
 from src.utils import utils
+from src.utils.freshness import freshness, epoch_millis, FRESHNESS_FIELD, FRESHNESS_OFFSET_DAYS, FRESHNESS_HORIZON_DAYS
+from src.utils.state_store import StateStore
 import logging
 
+PRODUCTS_SELECT = """
+        SELECT
+            p.*
+        FROM
+            products p
+"""
+
+EPOCH = "1970-01-01 00:00:00"
+
 
 class IngestionService:
+    chunk_size = int(os.getenv("INGESTION_CHUNK_SIZE", 5000))
+    products_alias = "products_index"
+    number_of_replicas = int(os.getenv("ES_NUMBER_OF_REPLICAS", 1))
+    generations_to_keep = int(os.getenv("PRODUCTS_INDEX_GENERATIONS_TO_KEEP", 2))
+    # A running reindex renews its lease with every chunk; an expired lease means its owner died.
+    reindex_lease_seconds = int(os.getenv("REINDEX_LEASE_SECONDS", 600))
+    # standard or lean, see products_mapping.mapping_profiles; applied by the next reindex.
+    mapping_profile = os.getenv("PRODUCTS_MAPPING_PROFILE", "standard")
+    # Fields computed by enrich_document; every other mapped field belongs to a full document.
+    derived_fields = ("price_formatted", "location", FRESHNESS_FIELD)
+
     def __init__(self):
         self.db_connection = DBConnection()
         self.engine = self.db_connection.create_db_connection()
         self.es = ElasticsearchDBConnection().es_connection()
         self.utils = utils.Utils()
+        self.sync_state = StateStore("products_delta_sync")
+        self.reindex_state = StateStore("products_reindex")
+        self.bulk_indexer = BulkIndexer(self.es)
+        self.transformer = DocumentTransformer()
+        self.write_buffer = WriteBuffer(self.es, self.products_alias, router=self.route_documents)
+        self.categories = None
+
+    def load_categories(self, refresh=False):
+        """
+        Function to load the categories dimension into memory.
 
-    def fetch_products(self):
+        The table is tiny, so it is cached on the service and joined in Python instead of in SQL.
+        :param refresh: Reload the table even if it is already cached.
+        :return:
+            dict: A {category_id: (name, name_fr)} lookup.
         """
-        Function to fetch data from MySQL database.
+        if self.categories is None or refresh:
+            with self.engine.connect() as connection:
+                rows = connection.execute(text("SELECT id, name, name_fr FROM categories;")).all()
+            self.categories = {row[0]: (row[1], row[2]) for row in rows}
+        return self.categories
 
-        Returns:
-            list: A list of dictionaries containing the fetched data.
+    def iter_product_chunks(self, chunk_size=None, start_id=0):
         """
+        Generator paging through the products table by primary key (keyset pagination).
 
-        query = """
-        SELECT
-            p.*,
-            c.name AS category_name_en,
-            c.name_fr AS category_name_fr
-        FROM
-            products p
-        JOIN
-            categories c ON p.category_id = c.id;
+        Only one chunk of rows is held in memory at a time, so peak memory is bounded
+        by the chunk size rather than by the size of the catalog.
+        :param chunk_size: The number of rows fetched per round trip.
+        :param start_id: Only rows with a greater id are read, used to resume a reindex.
+        :return:
+            generator: Yields (documents, last_id) pairs, last_id being the last product id read.
         """
-        try:
+        chunk_size = chunk_size or self.chunk_size
+        categories = self.load_categories(refresh=True)
+        query = text(PRODUCTS_SELECT + """
+        WHERE
+            p.id > :last_id
+            AND p.deleted_at IS NULL
+        ORDER BY
+            p.id
+        LIMIT :limit;
+        """)
+
+        last_id = start_id
+        while True:
             with self.engine.connect() as connection:
-                result = pd.read_sql(text(query), connection)
-
-            result = result.to_dict(orient='records')
-
-            for item in result:
-                if 'price' in item and item['price'] is not None:
-                    item['price_formatted'] = self.utils.format_large_number(item['price'])
-
-                if item.get("latitude") is not None and item.get("longitude") is not None:
-                    latitude = round(item["latitude"], 2)
-                    longitude = round(item["longitude"], 2)
-                    item["location"] = {"lat": latitude, "lon": longitude}
-                else:
-                    item['price_formatted'] = None
-            logging.info("Products data fetched successfully.")
-            return result
+                rows = pd.read_sql(query, connection, params={"last_id": last_id, "limit": chunk_size})
+
+            if rows.empty:
+                break
+
+            last_id = int(rows["id"].iloc[-1])
+            yield self.transformer.transform_batch(rows, categories), last_id
+
+            if len(rows) < chunk_size:
+                break
+
+    def iter_changed_products(self, column, since, last_id=0, chunk_size=None):
+        """
+        Generator paging through the products changed after a watermark.
+
+        Rows are walked in (column, id) order so that rows sharing the same timestamp
+        are neither skipped nor read twice.
+        :param column: The timestamp column to follow, either updated_at or deleted_at.
+        :param since: The timestamp of the last synced row.
+        :param last_id: The id of the last synced row with that timestamp.
+        :param chunk_size: The number of rows fetched per round trip.
+        :return:
+            generator: Yields (documents, (timestamp, id)) pairs, the pair being the watermark of the chunk.
+        """
+        if column not in ("updated_at", "deleted_at"):
+            raise ValueError(f"Unsupported watermark column: {column}")
+
+        chunk_size = chunk_size or self.chunk_size
+        categories = self.load_categories(refresh=True)
+        query = text(PRODUCTS_SELECT + f"""
+        WHERE
+            p.{column} > :since
+            OR (p.{column} = :since AND p.id > :last_id)
+        ORDER BY
+            p.{column}, p.id
+        LIMIT :limit;
+        """)
+
+        while True:
+            with self.engine.connect() as connection:
+                rows = pd.read_sql(query, connection, params={"since": since, "last_id": last_id, "limit": chunk_size})
+
+            if rows.empty:
+                break
+
+            since, last_id = pd.Timestamp(rows[column].iloc[-1]).to_pydatetime(), int(rows["id"].iloc[-1])
+            yield self.transformer.transform_batch(rows, categories), (str(since), last_id)
+
+            if len(rows) < chunk_size:
+                break
+
+    def current_watermark(self):
+        """
+        Function to read the current high-water marks of the products table.
+        :return:
+            dict: The watermark state used by the delta sync.
+        """
+        query = text("SELECT MAX(updated_at) AS updated_at, MAX(deleted_at) AS deleted_at FROM products;")
+        with self.engine.connect() as connection:
+            row = connection.execute(query).mappings().first()
+
+        return {
+            "updated_at": str(row["updated_at"] or EPOCH),
+            "updated_id": 0,
+            "deleted_at": str(row["deleted_at"] or EPOCH),
+            "deleted_id": 0
+        }
+
+    def sync_products_delta(self, index_name="products_index"):
+        """
+        Function to sync the products changed since the last run into Elasticsearch.
+
+        Changed rows are upserted, soft-deleted rows are removed from the index, and the
+        watermark is persisted after every chunk that reached Elasticsearch. Runs hold the
+        watermark lock, so a run is skipped while another process is syncing or a reindex is
+        swapping the alias.
+        :param index_name:
+        :return:
+            dict: A summary of the sync.
+        """
+        with self.sync_state.lock(blocking=False) as acquired:
+            if not acquired:
+                logging.info("Delta sync skipped: another sync is running.")
+                return {"skipped": "another sync is running"}
+            return self.apply_products_delta(index_name)
+
+    def apply_products_delta(self, index_name):
+        """
+        Function to apply the changes since the watermark, the caller holding the watermark lock.
+        :param index_name:
+        :return:
+            dict: A summary of the sync.
+        """
+        state = self.sync_state.load(default={}) or {}
+        state.setdefault("updated_at", EPOCH)
+        state.setdefault("updated_id", 0)
+        state.setdefault("deleted_at", EPOCH)
+        state.setdefault("deleted_id", 0)
+
+        summary = {"upserted": 0, "deleted": 0, "failed": 0, "failures": []}
+
+        try:
+            for chunk, watermark in self.iter_changed_products("updated_at", state["updated_at"], state["updated_id"]):
+                live = [item for item in chunk if item.get("deleted_at") is None]
+                removed = [item for item in chunk if item.get("deleted_at") is not None]
+                stored = self.stored_routings(index_name, chunk)
+
+                result = self.bulk_indexer.run(
+                    list(self.generate_relocation_actions(live, index_name, stored))
+                    + list(self.generate_actions(live, index_name))
+                    + list(self.generate_delete_actions(removed, index_name, stored)),
+                    ignore_status=(404,)
+                )
+                summary["upserted"] += len(live)
+                summary["deleted"] += len(removed)
+                summary["failed"] += result["failed"]
+                summary["failures"].extend(result["failures"])
+
+                state["updated_at"], state["updated_id"] = watermark
+                self.sync_state.save(state)
+
+            for chunk, watermark in self.iter_changed_products("deleted_at", state["deleted_at"], state["deleted_id"]):
+                stored = self.stored_routings(index_name, chunk)
+                result = self.bulk_indexer.run(self.generate_delete_actions(chunk, index_name, stored),
+                                               ignore_status=(404,))
+                summary["deleted"] += len(chunk)
+                summary["failed"] += result["failed"]
+                summary["failures"].extend(result["failures"])
+
+                state["deleted_at"], state["deleted_id"] = watermark
+                self.sync_state.save(state)
+
+            if summary["upserted"] or summary["deleted"]:
+                search_cache.bump_generation()
+            logging.info(f"Delta sync done: {summary['upserted']} upserted, {summary['deleted']} deleted.")
+            summary["watermark"] = state
+            return summary
         except Exception as e:
-            logging.error(f"An error occurred: {str(e)}")
+            logging.error(f"Delta sync failed: {str(e)}")
+            return f"error: {str(e)}"
 
     def create_index(self, index_name, mapping):
         """
@@ -81,120 +263,621 @@ class IngestionService:
 
         return self.es.indices.delete(index=index_name)
 
-    def document_exists(self, index_name, doc_id):
+    def index_exists(self, index_name):
         """
-        Function to check if a document exists in an index.
+        Function to check if an index exists in Elasticsearch.
         :param index_name:
-        :param doc_id:
         :return:
 
         """
-        query = {
-            "query": {
-                "term": {"id": doc_id}
+        return self.es.indices.exists(index=index_name)
+
+    def generate_actions(self, data, index_name):
+        """
+        Generator turning product documents into bulk actions lazily.
+        :param data: An iterable of product documents.
+        :param index_name:
+        :return:
+            generator: Yields bulk actions.
+        """
+        routed = country_routing.routed(index_name, fresh=True)
+        for item in data:
+            action = {
+                "_index": index_name,
+                "_id": item["id"],
+                "_source": item
             }
-        }
-        result = self.es.search(index=index_name, body=query)
-        return result['hits']['total']['value'] > 0
+            if routed:
+                action["_routing"] = country_routing.key(item.get("country"))
+            yield action
 
-    def index_exists(self, index_name):
+    def generate_delete_actions(self, data, index_name, stored=None):
         """
-        Function to check if an index exists in Elasticsearch.
+        Generator turning product documents into bulk delete actions.
+        :param data: An iterable of product documents.
         :param index_name:
+        :param stored: The {id: routing} of the indexed products when the index is routed by country;
+            products missing from it are not indexed and are skipped.
         :return:
+            generator: Yields bulk delete actions.
+        """
+        for item in data:
+            action = {
+                "_op_type": "delete",
+                "_index": index_name,
+                "_id": item["id"]
+            }
+            if stored is not None:
+                if str(item["id"]) not in stored:
+                    continue
+                action["_routing"] = stored[str(item["id"])]
+            yield action
 
+    def stored_routings(self, index_name, data):
         """
-        return self.es.indices.exists(index=index_name)
+        Function to look up the routing the products are stored under, when the index is routed by country.
+        :param index_name:
+        :param data: An iterable of product documents.
+        :return:
+            dict: {id: routing} of the indexed products, None when the index is not routed.
+        """
+        if not country_routing.routed(index_name, fresh=True):
+            return None
+        data = list(data)
+        return country_routing.stored_routings(index_name, [item["id"] for item in data],
+                                               [country_routing.key(item.get("country")) for item in data])
+
+    @staticmethod
+    def generate_relocation_actions(data, index_name, stored):
+        """
+        Generator deleting the stored copy of the products whose country changed, which
+        are indexed again under their new routing.
+        :param data: An iterable of product documents.
+        :param index_name:
+        :param stored: The {id: routing} of the indexed products, None when the index is not routed.
+        :return:
+            generator: Yields bulk delete actions.
+        """
+        if not stored:
+            return
+        for item in data:
+            previous = stored.get(str(item["id"]))
+            routing = country_routing.key(item.get("country"))
+            if previous is not None and routing is not None and previous != routing:
+                yield {
+                    "_op_type": "delete",
+                    "_index": index_name,
+                    "_id": item["id"],
+                    "_routing": previous
+                }
+
+    def route_documents(self, documents):
+        """
+        Function to route a batch of full or partial product documents of the write buffer.
+
+        A document without a country keeps the routing it is stored under; a document whose
+        country changed gets its stored copy deleted.
+        :param documents: A list of product documents.
+        :return:
+            tuple: The routing of each document (None when the index is not routed), and the
+                (id, routing) of the stored copies to delete.
+        """
+        stored = self.stored_routings(self.products_alias, documents)
+        if stored is None:
+            return [None] * len(documents), []
+
+        routings = [country_routing.key(document.get("country")) or stored.get(str(document["id"]))
+                    for document in documents]
+        relocations = [(action["_id"], action["_routing"])
+                       for action in self.generate_relocation_actions(documents, self.products_alias, stored)]
+        return routings, relocations
+
+    def country_report(self, index_name="products_index"):
+        """
+        Function to report the per-country document counts and the shard skew of the products index.
+        :param index_name:
+        :return:
+            dict: The report, see CountryRouting.report.
+        """
+        try:
+            return country_routing.report(index_name)
+        except Exception as e:
+            return f"error: {str(e)}"
 
     def bulk_index_documents(self, data, index_name):
         """
-        Function to bulk index data in Elasticsearch.
-        :param data:
+        Function to bulk index data in Elasticsearch through the concurrent bulk indexer.
+        :param data: A list or a generator of product documents.
         :param index_name:
         :return:
-            dict: The response from Elasticsearch.
+            dict: Indexed, failed and retried counts with the failing ids and reasons.
         """
-        actions = []
-        for item in data:
-            actions.append({
-                "_index": index_name,
-                "_id": item["id"],
-                "_source": item
-            })
+        actions = self.generate_actions(data, index_name)
 
         try:
-            response = bulk(self.es, actions, index=index_name, raise_on_error=False)
-            logging.info(f"Indexed {len(data)} documents")
+            response = self.bulk_indexer.run(actions)
+            logging.info(f"Indexed {response['indexed']} documents into {index_name}")
+            for failure in response["failures"]:
+                logging.error(f"Failed to index product {failure['id']}: {failure['reason']}")
             return response
         except Exception as e:
             return f"error: {str(e)}"
 
-    def setup_products_index(self):
+    def create_versioned_index(self, alias_name, mapping):
+        """
+        Function to create a new generation of an index with bulk-friendly settings.
+
+        Refreshes are disabled and no replicas are allocated while the index is loaded;
+        finalize_index restores both once loading is done.
+        :param alias_name: The alias the generation will be served under.
+        :param mapping: The mapping for the index.
+        :return:
+            str: The name of the new index.
+        """
+        index_name = f"{alias_name}_v{time.strftime('%Y%m%d%H%M%S')}"
+        body = country_routing.index_body(mapping)
+        body["settings"] = {
+            **body.get("settings", {}),
+            "index": {
+                **body.get("settings", {}).get("index", {}),
+                "refresh_interval": "-1",
+                "number_of_replicas": 0
+            }
+        }
+        self.create_index(index_name, body)
+        return index_name
+
+    def finalize_index(self, index_name):
+        """
+        Function to restore the serving settings of a freshly loaded index and refresh it.
+        :param index_name:
+        :return:
+        """
+        self.es.indices.put_settings(
+            index=index_name,
+            body={"index": {"refresh_interval": None, "number_of_replicas": self.number_of_replicas}}
+        )
+        self.es.indices.refresh(index=index_name)
+
+    def swap_alias(self, alias_name, index_name):
+        """
+        Function to atomically point an alias at a new index.
+
+        If an index still exists under the alias name (the layout used before versioned
+        indices), it is removed in the same atomic operation.
+        :param alias_name:
+        :param index_name:
+        :return:
+            dict: The response from Elasticsearch.
+        """
+        actions = []
+        if self.es.indices.exists_alias(name=alias_name):
+            for old_index in self.es.indices.get_alias(name=alias_name):
+                actions.append({"remove": {"index": old_index, "alias": alias_name}})
+        elif self.index_exists(alias_name):
+            actions.append({"remove_index": {"index": alias_name}})
+
+        actions.append({"add": {"index": index_name, "alias": alias_name}})
+        return self.es.indices.update_aliases(body={"actions": actions})
+
+    def cleanup_old_generations(self, alias_name):
         """
-        Function to setup the products index in Elasticsearch.
+        Function to delete the old generations of an index that are no longer served.
+
+        The newest generations_to_keep generations are kept so that a rollback only needs an alias swap.
+        :param alias_name:
+        :return:
+            list: The names of the deleted indices.
+        """
+        generations = sorted(self.es.indices.get(index=f"{alias_name}_v*"), reverse=True)
+        live = set(self.es.indices.get_alias(name=alias_name)) if self.es.indices.exists_alias(name=alias_name) else set()
+
+        deleted = []
+        for index_name in generations[self.generations_to_keep:]:
+            if index_name in live:
+                continue
+            self.delete_index(index_name)
+            deleted.append(index_name)
+
+        if deleted:
+            logging.info(f"Deleted old index generations: {', '.join(deleted)}")
+        return deleted
+
+    def count_products(self, start_id=0):
+        """
+        Function to count the products a full reindex reads after a given id.
+        :param start_id:
+        :return:
+            int: The number of products.
+        """
+        query = text("""
+        SELECT COUNT(*)
+        FROM products p
+        JOIN categories c ON p.category_id = c.id
+        WHERE p.id > :start_id AND p.deleted_at IS NULL;
+        """)
+        with self.engine.connect() as connection:
+            return connection.execute(query, {"start_id": start_id}).scalar()
+
+    def reindex_progress(self):
+        """
+        Function to report the progress of the current or last full reindex.
+        :return:
+            dict: The checkpoint with the rate (documents per second) and ETA (seconds).
+        """
+        checkpoint = self.reindex_state.load()
+        if not checkpoint:
+            return {"status": "never_run"}
+
+        progress = dict(checkpoint)
+        elapsed = max(checkpoint["updated_at"] - checkpoint["started_at"], 1e-6)
+        rate = checkpoint["processed"] / elapsed
+        remaining = max(checkpoint["total"] - checkpoint["processed"], 0)
+        progress["rate"] = round(rate, 2)
+        progress["eta_seconds"] = round(remaining / rate) if rate and checkpoint["status"] == "running" else None
+        return progress
+
+    def products_mapping(self):
+        """
+        Function to get the products mapping of the configured mapping profile.
+        :return:
+            dict: The index body with the mappings.
+        """
+        if self.mapping_profile not in products_mapping.mapping_profiles:
+            raise ValueError(f"unknown mapping profile: {self.mapping_profile}")
+        return products_mapping.mapping_profiles[self.mapping_profile]
+
+    def register_search_templates(self):
+        """
+        Function to store the search templates that match the current products_mapping.
+        :return:
+        """
+        for template_id, template in search_templates.items():
+            self.es.put_script(id=template_id, body=template)
+
+    def setup_products_index(self, resume=False, force=False):
+        """
+        Function to rebuild the products index in Elasticsearch without downtime.
+
+        The catalog is loaded into a new versioned index while the products_index alias keeps
+        serving the previous generation, then the alias is swapped atomically. A checkpoint
+        is persisted after every chunk, so a failed run can be resumed from the last
+        committed chunk with resume=True.
+
+        Delta syncs keep updating the served generation during the build. The alias swap and
+        the rewind of the sync watermark to where the build started happen under the watermark
+        lock, so no sync can save a later watermark over it; the first sync after the swap then
+        replays the changes made during the build into the new generation.
+
+        Only one reindex runs per host, guarded by the reindex lock; a checkpoint still running
+        under a valid lease (a reindex on another host) is never deleted or resumed unless force is set.
 
         Returns:
             dict: The response from Elasticsearch.
         """
+        with self.reindex_state.lock(blocking=False) as acquired:
+            if not acquired:
+                return "error: a reindex is already running"
 
-        index_name = "products_index"
-        mapping = products_mapping.products_mapping
+            checkpoint = self.reindex_state.load()
+            if checkpoint and self.reindex_running(checkpoint) and not force:
+                return (f"error: a reindex into {checkpoint['index_name']} is still running on "
+                        f"{checkpoint.get('owner')}; retry once it is done or its lease expires, or force it")
+            if checkpoint and self.reindex_running(checkpoint):
+                logging.warning(f"Forcing a reindex over the running one on {checkpoint.get('owner')}")
 
-        try:
-            if self.index_exists(index_name):
-                self.delete_index(index_name)
-                self.create_index(index_name, mapping)
+            return self.rebuild_products_index(resume)
+
+    @staticmethod
+    def reindex_running(checkpoint):
+        return checkpoint["status"] == "running" and checkpoint.get("lease_until", 0) > time.time()
+
+    def renew_lease(self, checkpoint):
+        checkpoint["owner"] = f"{socket.gethostname()}:{os.getpid()}"
+        checkpoint["updated_at"] = time.time()
+        checkpoint["lease_until"] = checkpoint["updated_at"] + self.reindex_lease_seconds
+
+    def rebuild_products_index(self, resume):
+        """
+        Function to load the products into a new index generation and serve it, the caller holding the reindex lock.
+        :param resume: Resume the last failed reindex from its checkpoint.
+        :return:
+            dict: The response from Elasticsearch.
+        """
+        alias_name = self.products_alias
+        checkpoint = self.reindex_state.load()
 
-            data = self.fetch_products()
-            result = self.bulk_index_documents(data, index_name)
-            return result
+        try:
+            mapping = self.products_mapping()
+            if resume and checkpoint and checkpoint["status"] != "done" and self.index_exists(checkpoint["index_name"]):
+                logging.info(f"Resuming reindex into {checkpoint['index_name']} after product {checkpoint['last_id']}")
+                checkpoint["status"] = "running"
+                checkpoint.pop("error", None)
+            else:
+                if checkpoint and checkpoint["status"] != "done" and self.index_exists(checkpoint["index_name"]):
+                    self.delete_index(checkpoint["index_name"])
+
+                now = time.time()
+                checkpoint = {
+                    "index_name": self.create_versioned_index(alias_name, mapping),
+                    "watermark": self.current_watermark(),
+                    "last_id": 0,
+                    "processed": 0,
+                    "total": self.count_products(),
+                    "result": BulkIndexer.empty_result(),
+                    "status": "running",
+                    "started_at": now,
+                    "updated_at": now
+                }
+            self.renew_lease(checkpoint)
+            self.reindex_state.save(checkpoint)
+            index_name = checkpoint["index_name"]
+
+            for chunk, last_id in self.iter_product_chunks(start_id=checkpoint["last_id"]):
+                result = self.bulk_index_documents(chunk, index_name)
+                if isinstance(result, str):
+                    raise RuntimeError(result.replace("error: ", "", 1))
+
+                BulkIndexer.merge_result(checkpoint["result"], result)
+                checkpoint["last_id"] = last_id
+                checkpoint["processed"] += len(chunk)
+                self.renew_lease(checkpoint)
+                self.reindex_state.save(checkpoint)
+
+            self.finalize_index(index_name)
+            self.register_search_templates()
+            with self.sync_state.lock():
+                self.swap_alias(alias_name, index_name)
+                self.sync_state.save(checkpoint["watermark"])
+            country_routing.forget(alias_name)
+            search_cache.bump_generation()
+            logging.info(f"{alias_name} now points to {index_name}")
+
+            checkpoint["status"] = "done"
+            checkpoint["updated_at"] = time.time()
+            self.reindex_state.save(checkpoint)
+
+            self.cleanup_old_generations(alias_name)
+            return checkpoint["result"]
 
         except Exception as e:
+            if checkpoint and checkpoint["status"] == "running":
+                checkpoint["status"] = "failed"
+                checkpoint["error"] = str(e)
+                checkpoint["updated_at"] = time.time()
+                self.reindex_state.save(checkpoint)
             return f"error: {str(e)}"
 
-    def index_product(self, product_document, index_name="products_index"):
+    def enrich_document(self, product_document):
         """
-        Function to index a product in Elasticsearch.
+        Function to add the derived fields to a full or partial product document.
+
+        Derived fields are only touched when their source fields are present, so a partial
+        update never clears fields it did not send. A write without updated_at is stamped
+        with the current time, so readers following updated_at see it.
         :param product_document:
         :return:
+            dict: The enriched document.
+        """
+        document = dict(product_document)
+        if "price" in document:
+            price = document["price"]
+            document["price_formatted"] = self.utils.format_large_number(price) if price is not None else None
 
+        if document.get("latitude") is not None and document.get("longitude") is not None:
+            document["location"] = {"lat": round(document["latitude"], 2), "lon": round(document["longitude"], 2)}
+
+        if "created_at" in document:
+            document[FRESHNESS_FIELD] = freshness(document["created_at"])
+
+        if document.get("updated_at") is None:
+            document["updated_at"] = datetime.now(timezone.utc).isoformat()
+        return document
+
+    def refresh_freshness(self, index_name="products_index"):
+        """
+        Function to recompute the freshness of the indexed products as they age.
+
+        Freshness only changes between FRESHNESS_OFFSET_DAYS and FRESHNESS_HORIZON_DAYS after
+        creation, so only those products, and the products without a freshness yet, are read.
+        Scores that did not change are not rewritten.
+        :param index_name:
+        :return:
+            dict: The number of products read and updated, with the bulk result.
+        """
+        try:
+            self.es.indices.put_mapping(index=index_name, properties={
+                FRESHNESS_FIELD: self.products_mapping()["mappings"]["properties"][FRESHNESS_FIELD]
+            })
+
+            # One day of margin on each side for the time between two runs.
+            query = {"bool": {"should": [
+                {"range": {"created_at": {"gte": f"now-{math.ceil(FRESHNESS_HORIZON_DAYS) + 1}d",
+                                          "lte": f"now-{FRESHNESS_OFFSET_DAYS - 1}d"}}},
+                {"bool": {"must_not": {"exists": {"field": FRESHNESS_FIELD}}}}
+            ], "minimum_should_match": 1}}
+            hits = scan(self.es, index=index_name, size=5000,
+                        query={"query": query, "_source": ["created_at", FRESHNESS_FIELD]})
+
+            summary = {"read": 0, "updated": 0}
+            result = self.bulk_indexer.run(self.generate_freshness_actions(hits, index_name, summary),
+                                           ignore_status=(404,))
+            if summary["updated"]:
+                search_cache.bump_generation()
+            logging.info(f"Freshness refreshed: {summary['updated']} of {summary['read']} products updated.")
+            return {**summary, "result": result}
+        except Exception as e:
+            logging.error(f"Freshness refresh failed: {str(e)}")
+            return f"error: {str(e)}"
+
+    @staticmethod
+    def generate_freshness_actions(hits, index_name, summary):
+        """
+        Generator turning the scanned products whose freshness changed into bulk partial updates.
+        :param hits: The scanned hits, with created_at and freshness in _source.
+        :param index_name:
+        :param summary: Counts of the products read and updated, updated in place.
+        :return:
+            generator: Yields bulk update actions.
+        """
+        now = datetime.now(timezone.utc)
+        for hit in hits:
+            summary["read"] += 1
+            source = hit.get("_source", {})
+            score = freshness(source.get("created_at"), now)
+            if source.get(FRESHNESS_FIELD) == score:
+                continue
+
+            summary["updated"] += 1
+            action = {
+                "_op_type": "update",
+                "_index": index_name,
+                "_id": hit["_id"],
+                "retry_on_conflict": 3,
+                "doc": {FRESHNESS_FIELD: score}
+            }
+            if hit.get("_routing") is not None:
+                action["_routing"] = hit["_routing"]
+            yield action
+
+    @staticmethod
+    def external_version(updated_at):
+        """
+        Function to turn an updated_at value into an external document version (epoch milliseconds).
+        :param updated_at: Epoch milliseconds, a datetime or an ISO formatted string.
+        :return:
+            int: The version, None when updated_at is not a date.
+        """
+        return epoch_millis(updated_at)
+
+    def missing_fields(self, product_document):
         """
-        if product_document["id"] is None:
-            return f"error: product id is required"
+        Function to list the fields a full product document lacks; a null value counts as sent.
+        :return:
+            list: The missing field names.
+        """
+        fields = self.products_mapping()["mappings"]["properties"]
+        return sorted(field for field in fields if field not in self.derived_fields and field not in product_document)
 
-        if 'price' in product_document and product_document['price'] is not None:
-            product_document['price_formatted'] = self.utils.format_large_number(product_document['price'])
-        else:
-            product_document['price_formatted'] = None
+    def index_product(self, product_document, index_name="products_index", if_seq_no=None,
+                      if_primary_term=None, version_on_updated_at=False):
+        """
+        Function to upsert a product in Elasticsearch in a single round trip keyed on _id.
+
+        By default the document is merged into the stored one with a partial update
+        (doc_as_upsert). Optimistic concurrency is available either through
+        if_seq_no/if_primary_term, or through external versioning on updated_at, in which
+        case the document replaces the stored one and older writes are rejected. Partial
+        documents are refused in that mode, since the fields they do not send would be erased.
+        :param product_document:
+        :param index_name:
+        :param if_seq_no: Only apply the update if the stored document has this sequence number.
+        :param if_primary_term: Only apply the update if the stored document has this primary term.
+        :param version_on_updated_at: Index the full document with updated_at as an external version.
+        :return:
+            dict: {"id", "status", "result"} when the write was applied, {"id", "status", "error"}
+                otherwise, with a 409 status when it lost a concurrency check, like the items of index_products.
+        """
+        product_id = product_document.get("id")
+        if product_id is None:
+            return {"id": None, "status": 400, "error": "product id is required"}
+
+        if version_on_updated_at:
+            missing = self.missing_fields(product_document)
+            if missing:
+                return {"id": product_id, "status": 400,
+                        "error": f"version_on_updated_at needs the full document, missing: {', '.join(missing)}"}
+            version = self.external_version(product_document["updated_at"])
+            if version is None:
+                return {"id": product_id, "status": 400, "error": "updated_at is required for external versioning"}
+
+        document = self.enrich_document(product_document)
 
         try:
-            # if document exist, update it
-            if self.document_exists(index_name, product_document["id"]):
-                response = self.es.update_by_query(
+            routing = self.route_product(document, index_name)
+            if isinstance(routing, str):
+                return {"id": product_id, "status": 400, "error": routing.replace("error: ", "", 1)}
+
+            if version_on_updated_at:
+                response = self.es.index(
                     index=index_name,
-                    body={
-                        "script": {
-                            "source": f"""
-                                {"".join([f"ctx._source.{field} = params.document.{field};" for field in product_document.keys()])}
-                            """,
-                            "lang": "painless",
-                            "params": {"document": product_document}
-                        },
-                        "query": {"term": {"id": product_document.get("id")}}
-                    }
+                    id=product_id,
+                    document=document,
+                    version=version,
+                    version_type="external_gte",
+                    **routing
                 )
-
-                if response.get("updated", 0) > 0:
-                    logging.info("Product updated successfully.")
-                    return True
-                else:
-                    return False
             else:
-                if "latitude" and "longitude" in product_document:
-                    product_document["location"] = {"lat": product_document["latitude"], "lon": product_document["longitude"]}
+                concurrency = {}
+                if if_seq_no is not None and if_primary_term is not None:
+                    concurrency = {"if_seq_no": if_seq_no, "if_primary_term": if_primary_term}
 
-                self.es.index(index=index_name, id=product_document["id"], body=product_document)
-                logging.info("Product indexed successfully.")
-                return True
+                response = self.es.update(
+                    index=index_name,
+                    id=product_id,
+                    doc=document,
+                    doc_as_upsert=True,
+                    **concurrency,
+                    **routing
+                )
+
+            search_cache.schedule_bump()
+            logging.info("Product indexed successfully.")
+            return {"id": product_id, "status": 201 if response["result"] == "created" else 200,
+                    "result": response["result"]}
+        except ConflictError:
+            logging.info(f"Product {product_id} was not written: a newer version is already indexed.")
+            return {"id": product_id, "status": 409, "error": "a newer version of the product is already indexed"}
         except Exception as e:
-            return f"error: {str(e)}"
+            return {"id": product_id, "status": 500, "error": str(e)}
+
+    def route_product(self, document, index_name):
+        """
+        Function to get the routing of a single product write, moving the stored copy when its country changed.
+        :param document: A full or partial product document.
+        :param index_name:
+        :return:
+            dict: {"routing": value}, or an empty dict when the index is not routed by country.
+        """
+        stored = self.stored_routings(index_name, [document])
+        if stored is None:
+            return {}
+
+        previous = stored.get(str(document["id"]))
+        routing = country_routing.key(document.get("country")) or previous
+        if routing is None:
+            return f"error: country is required for a new product"
+        if previous is not None and previous != routing:
+            self.es.delete(index=index_name, id=document["id"], routing=previous)
+        return {"routing": routing}
+
+    def index_products(self, product_documents, timeout=30):
+        """
+        Function to upsert many products through the coalescing write buffer.
+
+        Writes from this call and from concurrent calls are flushed together as bulk requests.
+        :param product_documents: An iterable (list or generator) of product documents.
+        :param timeout: Seconds to wait for the writes to be flushed.
+        :return:
+            list: A status per product, in input order.
+        """
+        results = []
+        for position, product_document in enumerate(product_documents):
+            if not isinstance(product_document, dict) or product_document.get("id") is None:
+                results.append({"position": position, "status": 400, "error": "id is required"})
+                continue
+            results.append(self.write_buffer.add(self.enrich_document(product_document)))
+
+        statuses = []
+        for position, result in enumerate(results):
+            if isinstance(result, dict):
+                statuses.append(result)
+                continue
+            try:
+                statuses.append({"position": position, **result.result(timeout=timeout)})
+            except Exception as e:
+                statuses.append({"position": position, "status": 504, "error": f"error: {str(e)}"})
+
+        if any(200 <= status["status"] < 300 for status in statuses):
+            search_cache.schedule_bump()
+        return statuses
@@ -0,0 +1,107 @@
+import time
+import numpy as np
+import pandas as pd
+from src.utils import utils
+from src.utils.freshness import (
+    freshness, FRESHNESS_FIELD, FRESHNESS_SCALE_DAYS, FRESHNESS_OFFSET_DAYS, FRESHNESS_DECAY, FRESHNESS_FLOOR,
+    FRESHNESS_PRECISION
+)
+
+
+class DocumentTransformer:
+    """
+    Turns product rows into Elasticsearch documents.
+
+    transform_row is the per-row reference; transform_batch produces the same documents
+    for a whole DataFrame chunk with column-wise operations.
+    """
+    timestamp_columns = ("created_at", "updated_at", "deleted_at")
+    integer_columns = ("id", "user_id", "category_id", "price", "country", "brand_id", "whole_sale")
+
+    def __init__(self):
+        self.utils = utils.Utils()
+
+    def transform_row(self, item, categories=None):
+        """
+        Function to enrich a single product row before it is sent to Elasticsearch.
+        :param item: A dictionary representing a product row.
+        :param categories: An optional {category_id: (name, name_fr)} lookup.
+        :return:
+            dict: The enriched product document.
+        """
+        if categories is not None:
+            name_en, name_fr = categories.get(item.get("category_id"), (None, None))
+            item["category_name_en"] = name_en
+            item["category_name_fr"] = name_fr
+
+        if 'price' in item and item['price'] is not None:
+            item['price_formatted'] = self.utils.format_large_number(item['price'])
+        else:
+            item['price_formatted'] = None
+
+        if item.get("latitude") is not None and item.get("longitude") is not None:
+            latitude = round(item["latitude"], 2)
+            longitude = round(item["longitude"], 2)
+            item["location"] = {"lat": latitude, "lon": longitude}
+
+        item[FRESHNESS_FIELD] = freshness(item.get("created_at"))
+        return item
+
+    def transform_batch(self, df, categories):
+        """
+        Function to turn a DataFrame of product rows into Elasticsearch documents column by column.
+
+        Rows whose category is unknown are dropped, like the inner join they replace.
+        :param df: A DataFrame of rows from the products table.
+        :param categories: A {category_id: (name, name_fr)} lookup.
+        :return:
+            list: A list of product documents.
+        """
+        df = df[df["category_id"].isin(categories.keys())].copy()
+        if df.empty:
+            return []
+
+        df["category_name_en"] = df["category_id"].map({key: names[0] for key, names in categories.items()})
+        df["category_name_fr"] = df["category_id"].map({key: names[1] for key, names in categories.items()})
+        df["price_formatted"] = self.utils.format_large_numbers(df["price"])
+
+        columns = {}
+        for column in df.columns:
+            series = df[column]
+            if column in self.timestamp_columns:
+                timestamps = pd.to_datetime(series).to_numpy(dtype="datetime64[s]")
+                values = np.datetime_as_string(timestamps, unit="s").astype(object)
+                values[np.isnat(timestamps)] = None
+                columns[column] = values.tolist()
+            elif column in self.integer_columns:
+                columns[column] = series.astype("Int64").astype(object).where(series.notna(), None).tolist()
+            else:
+                columns[column] = series.astype(object).where(series.notna(), None).tolist()
+
+        names = list(columns)
+        documents = [dict(zip(names, values)) for values in zip(*columns.values())]
+        for document, latitude, longitude in zip(documents, columns["latitude"], columns["longitude"]):
+            if latitude is not None and longitude is not None:
+                document["location"] = {"lat": round(latitude, 2), "lon": round(longitude, 2)}
+
+        created_at = pd.to_datetime(df["created_at"]).to_numpy(dtype="datetime64[s]")
+        for document, score in zip(documents, self.freshness_scores(created_at)):
+            document[FRESHNESS_FIELD] = score
+        return documents
+
+    @staticmethod
+    def freshness_scores(timestamps, now=None):
+        """
+        Function to compute the freshness of a whole column of creation dates, see utils.freshness.
+        :param timestamps: A datetime64[s] array, NaT for missing dates.
+        :param now: The reference time in epoch seconds, the current time by default.
+        :return:
+            list: The freshness of each product.
+        """
+        missing = np.isnat(timestamps)
+        now = np.datetime64(int(now or time.time()), "s")
+        age_days = (now - np.where(missing, now, timestamps)).astype("float64") / 86400
+
+        distance = np.maximum(age_days - FRESHNESS_OFFSET_DAYS, 0) / FRESHNESS_SCALE_DAYS
+        scores = np.maximum(np.exp(np.log(FRESHNESS_DECAY) * distance ** 2), FRESHNESS_FLOOR)
+        return np.round(np.where(missing, 1.0, scores), FRESHNESS_PRECISION).tolist()
@@ -0,0 +1,132 @@
+class ProductQueryBuilder:
+    """
+    Owns where the clauses of a product query are placed.
+
+    Text relevance goes into bool.must and is scored. Precomputed ranking signals go into
+    bool.should as rank_feature clauses, which add to the score without preventing
+    Elasticsearch from skipping non-competitive documents. Exact-match constraints (country,
+    category, brand, wholesale, price range, geo) always compile to non-scoring bool.filter
+    clauses, which Elasticsearch can cache per segment. Filters are emitted in a fixed order
+    with normalized values, so identical constraints always produce identical JSON and reuse
+    the same cache entries.
+    """
+    integer_fields = ("country", "category_id", "brand_id", "whole_sale", "id")
+
+    def __init__(self):
+        self.must = []
+        self.should = []
+        self.filters = {}
+
+    @classmethod
+    def normalize(cls, field, value):
+        if field in cls.integer_fields and isinstance(value, str) and value.strip().lstrip("-").isdigit():
+            return int(value)
+        return value
+
+    def text(self, query, fields, fuzziness="AUTO", **options):
+        """
+        Function to add a scored multi_match clause.
+        """
+        clause = {"query": query, "fields": fields}
+        if fuzziness:
+            clause["fuzziness"] = fuzziness
+        clause.update(options)
+        self.must.append({"multi_match": clause})
+        return self
+
+    def rank_feature(self, field, boost=None):
+        """
+        Function to add the value of a rank_feature field to the score.
+        """
+        clause = {"field": field, "linear": {}}
+        if boost is not None:
+            clause["boost"] = boost
+        self.should.append({"rank_feature": clause})
+        return self
+
+    def term(self, field, value):
+        """
+        Function to add an exact-match filter; None values are ignored and lists become a terms filter.
+        """
+        if value is None or value == "" or value == []:
+            return self
+
+        if isinstance(value, (list, tuple, set)):
+            values = sorted({self.normalize(field, item) for item in value})
+            clause = {"term": {field: values[0]}} if len(values) == 1 else {"terms": {field: values}}
+        else:
+            clause = {"term": {field: self.normalize(field, value)}}
+
+        self.filters[("0", field)] = clause
+        return self
+
+    def range(self, field, gte=None, lte=None):
+        """
+        Function to add a range filter; both bounds go into a single clause.
+        """
+        bounds = {}
+        if gte is not None:
+            bounds["gte"] = gte
+        if lte is not None:
+            bounds["lte"] = lte
+        if bounds:
+            self.filters[("1", field)] = {"range": {field: bounds}}
+        return self
+
+    def geo_distance(self, latitude, longitude, radius_km, field="location"):
+        """
+        Function to add a geo_distance filter around a point.
+        """
+        if latitude is None or longitude is None:
+            return self
+
+        self.filters[("2", field)] = {
+            "geo_distance": {
+                "distance": f"{radius_km}km",
+                field: {"lat": latitude, "lon": longitude}
+            }
+        }
+        return self
+
+    def geo_bounding_box(self, top, left, bottom, right, field="location"):
+        """
+        Function to add a geo_bounding_box filter; a left edge east of the right one crosses the dateline.
+        """
+        self.filters[("3", field)] = {
+            "geo_bounding_box": {
+                field: {
+                    "top_left": {"lat": top, "lon": left},
+                    "bottom_right": {"lat": bottom, "lon": right}
+                }
+            }
+        }
+        return self
+
+    def filter_clauses(self):
+        return [self.filters[key] for key in sorted(self.filters)]
+
+    def take_filters(self, fields):
+        """
+        Function to remove the filters on the given fields from the query, e.g. to apply them as a post_filter.
+        :param fields: The field names.
+        :return:
+            dict: {field: clause} in the usual filter order.
+        """
+        taken = {}
+        for key in sorted(self.filters):
+            if key[1] in fields:
+                taken[key[1]] = self.filters.pop(key)
+        return taken
+
+    def build(self):
+        """
+        Function to compile the clauses into a bool query.
+        :return:
+            dict: The bool query.
+        """
+        query = {"bool": {"filter": self.filter_clauses()}}
+        if self.must:
+            query["bool"]["must"] = list(self.must)
+        if self.should:
+            query["bool"]["should"] = list(self.should)
+        return query
@@ -0,0 +1,80 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class SearchBatcher:
+    """
+    Micro-batcher grouping concurrent single searches into one _msearch.
+
+    Searches submitted within window_ms of the first one in a batch (up to max_batch of them)
+    are sent together through SearchService.search_products_batch.
+    """
+    enabled = os.getenv("SEARCH_MICRO_BATCH", "false").lower() == "true"
+    window_ms = int(os.getenv("SEARCH_MICRO_BATCH_WINDOW_MS", 5))
+    max_batch = int(os.getenv("SEARCH_MICRO_BATCH_MAX", 32))
+    dispatchers = int(os.getenv("SEARCH_MICRO_BATCH_DISPATCHERS", 4))
+
+    def __init__(self, search_service):
+        self.search_service = search_service
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.collector = None
+        self.executor = None
+
+    @classmethod
+    def usable(cls, environ):
+        """
+        Function to tell whether the searches of a request are batched.
+
+        Only workers serving concurrent requests (gunicorn's gthread, gevent and eventlet workers)
+        have searches to batch; a sync worker would make every search wait the window alone.
+        :param environ: The WSGI environ of the request.
+        :return:
+            bool: True when SEARCH_MICRO_BATCH is on and the worker is threaded or asynchronous.
+        """
+        return cls.enabled and bool(environ.get("wsgi.multithread"))
+
+    def submit(self, search):
+        """
+        Function to queue a search for the next batch.
+        :param search: The keyword arguments of search_products.
+        :return:
+            Future: Resolved with {"products", "total"} or {"error", "status"}.
+        """
+        with self.lock:
+            if self.collector is None or not self.collector.is_alive():
+                self.executor = self.executor or ThreadPoolExecutor(max_workers=self.dispatchers)
+                self.collector = threading.Thread(target=self.collect, name="search-batcher", daemon=True)
+                self.collector.start()
+
+        future = Future()
+        self.queue.put((search, future))
+        return future
+
+    def collect(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window_ms / 1000
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.executor.submit(self.dispatch, batch)
+
+    def dispatch(self, batch):
+        try:
+            results = self.search_service.search_products_batch([search for search, future in batch])
+        except Exception as e:
+            logging.error(f"Batched search of {len(batch)} queries failed: {str(e)}")
+            results = [{"error": str(e), "status": 503}] * len(batch)
+
+        for (search, future), result in zip(batch, results):
+            future.set_result(result)
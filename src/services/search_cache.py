@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+
+class SearchCache:
+    """
+    Two-tier cache of search results.
+
+    A small in-process LRU sits in front of the Redis cache configured for Flask-Caching.
+    Keys are built from the normalized search parameters and an index generation counter.
+    Reindexes and delta syncs bump it right away; single product writes bump it at most once
+    per bump_interval, so a steady write rate does not keep emptying the cache, and a result
+    is served at most bump_interval after a write changed it.
+    """
+    local_size = int(os.getenv("SEARCH_CACHE_LOCAL_SIZE", 256))
+    local_ttl = int(os.getenv("SEARCH_CACHE_LOCAL_TTL", 30))
+    remote_ttl = int(os.getenv("SEARCH_CACHE_TTL", 300))
+    geo_precision = int(os.getenv("SEARCH_CACHE_GEO_PRECISION", 2))
+    generation_ttl = float(os.getenv("SEARCH_CACHE_GENERATION_TTL", 1))
+    bump_interval = float(os.getenv("SEARCH_CACHE_BUMP_INTERVAL", 30))
+    generation_key = "search:generation"
+    folded_params = ("search_term",)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = OrderedDict()
+        self.generation = None
+        self.generation_checked_at = 0
+        self.bumped_at = None
+        self.bump_timer = None
+        self.stats = {"local_hits": 0, "remote_hits": 0, "misses": 0, "errors": 0}
+
+    @property
+    def backend(self):
+        # Imported lazily: src imports the routes, which import this module.
+        from src import cache
+        return cache
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def normalize(self, params):
+        """
+        Function to normalize search parameters so that equivalent searches share a key.
+
+        Only the search term is case-folded and has its whitespace collapsed: the other
+        parameters (locale, sort_by, fields) are matched exactly by the search, so they key as sent.
+        :param params: A dictionary of search parameters.
+        :return:
+            dict: The normalized parameters.
+        """
+        normalized = {}
+        for name, value in params.items():
+            if isinstance(value, str) and name in self.folded_params:
+                value = " ".join(value.lower().split())
+            elif isinstance(value, float) and name in ("latitude", "longitude"):
+                value = round(value, self.geo_precision)
+            normalized[name] = value
+        return normalized
+
+    def current_generation(self):
+        """
+        Function to read the index generation, re-checking Redis at most every generation_ttl seconds.
+        :return:
+            int: The index generation.
+        """
+        now = time.monotonic()
+        if self.generation is None or now - self.generation_checked_at >= self.generation_ttl:
+            try:
+                self.generation = int(self.backend.get(self.generation_key) or 0)
+            except Exception as e:
+                logging.error(f"Could not read the search cache generation: {str(e)}")
+                self.count("errors")
+                self.generation = self.generation or 0
+            self.generation_checked_at = now
+        return self.generation
+
+    def key(self, namespace, params):
+        payload = json.dumps(self.normalize(params), sort_keys=True, default=str)
+        digest = hashlib.sha1(payload.encode()).hexdigest()
+        return f"search:{namespace}:{self.current_generation()}:{digest}"
+
+    def get(self, namespace, params):
+        """
+        Function to look a search up in the local tier, then in Redis.
+        :param namespace: The kind of search, e.g. products or suggestions.
+        :param params: The search parameters.
+        :return:
+            tuple: (key, value), value being None on a miss.
+        """
+        key = self.key(namespace, params)
+
+        with self.lock:
+            entry = self.local.get(key)
+            if entry and entry[1] > time.monotonic():
+                self.local.move_to_end(key)
+                self.stats["local_hits"] += 1
+                return key, entry[0]
+
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logging.error(f"Search cache read failed: {str(e)}")
+            self.count("errors")
+            value = None
+
+        if value is None:
+            self.count("misses")
+            return key, None
+
+        self.count("remote_hits")
+        self.set_local(key, value)
+        return key, value
+
+    def set_local(self, key, value):
+        with self.lock:
+            self.local[key] = (value, time.monotonic() + self.local_ttl)
+            self.local.move_to_end(key)
+            while len(self.local) > self.local_size:
+                self.local.popitem(last=False)
+
+    def set(self, key, value, timeout=None):
+        """
+        Function to store a search result in both tiers.
+        :param key: The key returned by get.
+        :param value: The search result.
+        :param timeout: The Redis TTL in seconds.
+        :return:
+        """
+        self.set_local(key, value)
+        try:
+            self.backend.set(key, value, timeout=timeout or self.remote_ttl)
+        except Exception as e:
+            logging.error(f"Search cache write failed: {str(e)}")
+            self.count("errors")
+
+    def bump_generation(self):
+        """
+        Function to invalidate every cached search after the index changed.
+        :return:
+        """
+        try:
+            # Flask-Caching does not proxy inc; the backend's inc is an atomic INCR on Redis.
+            self.backend.cache.inc(self.generation_key)
+        except Exception as e:
+            logging.error(f"Could not bump the search cache generation: {str(e)}")
+            self.count("errors")
+
+        with self.lock:
+            self.local.clear()
+            self.generation = None
+            self.bumped_at = time.monotonic()
+
+    def schedule_bump(self):
+        """
+        Function to invalidate every cached search after a product write, coalescing bursts of writes.
+
+        The first write after a quiet bump_interval bumps the generation right away; the writes
+        that follow within the interval share a single bump at its end.
+        :return:
+        """
+        with self.lock:
+            if self.bump_timer is not None:
+                return
+            wait = 0 if self.bumped_at is None else self.bumped_at + self.bump_interval - time.monotonic()
+            if wait > 0:
+                self.bump_timer = threading.Timer(wait, self.flush_scheduled_bump)
+                self.bump_timer.daemon = True
+                self.bump_timer.start()
+                return
+        self.bump_generation()
+
+    def flush_scheduled_bump(self):
+        with self.lock:
+            self.bump_timer = None
+        self.bump_generation()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["local_entries"] = len(self.local)
+        lookups = stats["local_hits"] + stats["remote_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["local_hits"] + stats["remote_hits"]) / lookups, 4) if lookups else None
+        return stats
+
+
+search_cache = SearchCache()
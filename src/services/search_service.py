@@ -1,20 +1,57 @@
 
-from src.db_connection.mysqlDBconnection import DBConnection
-from src.db_connection.elasticsearchDBconnection import ElasticsearchDBConnection
-from src.utils import utils
+import os
+import json
+import time
+import base64
+from src.db_connection.elasticsearchDBconnection import SearchElasticsearchDBConnection
+from src.services.search_cache import search_cache
+from src.services.suggestion_index import suggestion_index
+from src.services.country_routing import country_routing
+from src.data.field_sets import field_sets, default_field_set
+from src.data.facets import facets as facet_definitions, facet_fields, CATEGORY_LABEL_FIELDS
+from src.services.query_builder import ProductQueryBuilder
+from src.data.search_templates import (
+    search_templates, PRODUCTS_SEARCH_TEMPLATE_ID, MIN_SCORE, CATEGORY_MIN_SCORE_CREDIT, SEARCH_FIELDS, SORT_TABLE,
+    GEO_SORT_ORDERS, DEFAULT_SORT
+)
+from src.utils.freshness import FRESHNESS_FIELD
+from src.utils.geotiles import snap_bounding_box, MAX_PRECISION
+from src.utils.metrics import search_metrics
 import logging
 
 
+SEARCH_DEFAULTS = {
+    "search_term": None, "latitude": None, "longitude": None, "sort_by": "relevance_high_low", "limit": 20,
+    "page_num": 1, "country": 1, "radius_km": 20, "min_price": None, "max_price": None, "category_id": None,
+    "locale": "En", "fields": default_field_set, "brand_id": None, "whole_sale": None, "facets": False
+}
+
+MAP_DEFAULTS = {
+    "top": None, "left": None, "bottom": None, "right": None, "zoom": None, "search_term": None, "country": 1,
+    "min_price": None, "max_price": None, "category_id": None, "brand_id": None, "whole_sale": None, "locale": "En"
+}
+
+
 class SearchService:
+    pit_keep_alive = "2m"
+    adaptive_fuzziness = os.getenv("SEARCH_ADAPTIVE_FUZZINESS", "true").lower() == "true"
+    fuzzy_min_hits = int(os.getenv("SEARCH_FUZZY_MIN_HITS", 5))
+    use_search_templates = os.getenv("SEARCH_USE_TEMPLATES", "true").lower() == "true"
+    suggestion_freshness_boost = float(os.getenv("SUGGEST_FRESHNESS_BOOST", 3))
+    # Clusters are geotile cells this many levels below the map zoom (4x4 cells per map tile).
+    map_cluster_precision_offset = int(os.getenv("MAP_CLUSTER_PRECISION_OFFSET", 2))
+    map_pin_zoom = int(os.getenv("MAP_PIN_ZOOM", 15))
+    map_max_clusters = int(os.getenv("MAP_MAX_CLUSTERS", 2000))
+    map_max_pins = int(os.getenv("MAP_MAX_PINS", 500))
+    templates_registered = False
+
     def __init__(self):
-        self.db_connection = DBConnection()
-        self.engine = self.db_connection.create_db_connection()
-        self.es = ElasticsearchDBConnection().es_connection()
-        self.utils = utils.Utils()
+        self.es = SearchElasticsearchDBConnection().es_connection()
 
     def search_products(self, search_term, latitude=None, longitude=None, sort_by="relevance_high_low",
                         limit=20, page_num=1, country=1, radius_km=20, min_price=None,
-                        max_price=None, category_id=None, locale="En"):
+                        max_price=None, category_id=None, locale="En", fields=default_field_set,
+                        brand_id=None, whole_sale=None, facets=False):
         """
         Function to search products using Elasticsearch, incorporating relevance and boosting functionality.
         :param search_term:
@@ -29,150 +66,644 @@ class SearchService:
         :param max_price:
         :param category_id:
         :param locale: The locale of the user.
+        :param fields: The name of the _source field set to return (listing, detail or map_pin).
+        :param brand_id: Restrict the results to a brand.
+        :param whole_sale: Restrict the results to wholesale (1) or retail (0) products.
+        :param facets: Also return the category, brand, wholesale and price facets of the search.
         :return:
-            tuple: A tuple containing a list of products and the total result count.
+            tuple: A tuple containing a list of products and the total result count, plus the facets when requested.
         """
 
-        offset = (page_num - 1) * limit
+        params = {
+            "search_term": search_term, "latitude": latitude, "longitude": longitude, "sort_by": sort_by,
+            "limit": limit, "page_num": page_num, "country": country, "radius_km": radius_km,
+            "min_price": min_price, "max_price": max_price, "category_id": category_id, "locale": locale,
+            "fields": fields, "brand_id": brand_id, "whole_sale": whole_sale, "facets": facets
+        }
+        self.source_filter(fields)
+        cache_key, cached = search_cache.get("products", params)
+        if cached is not None:
+            return tuple(cached)
 
-        if locale == "En":
-            search_fields = [
-                "name^2",
-                "category_name_en^2",
-                "description",
-                "search_index",
-                "hash"
-            ]
+        if self.use_search_templates:
+            self.ensure_search_templates()
+
+        for fuzziness in self.fuzziness_passes():
+            template, request = self.search_request(params, fuzziness)
+            response = self.timed_search("search", fuzziness, template=template, **request)
+            if not self.needs_fuzzy_fallback("search", fuzziness, response):
+                break
+
+        result = self.search_result(response, params)
+        search_cache.set(cache_key, list(result))
+        return result
+
+    def search_result(self, response, params):
+        """
+        Function to read the products, the total and, when requested, the facets out of a search response.
+        :return:
+            tuple: The products and the total result count, plus the facets when requested.
+        """
+        search_results = [hit["_source"] for hit in response["hits"].get("hits", [])]
+        total_results_count = response["hits"]["total"]["value"]
+        if params.get("facets"):
+            return search_results, total_results_count, self.facet_results(response, params["locale"])
+        return search_results, total_results_count
+
+    @staticmethod
+    def result_entry(result):
+        entry = {"products": result[0], "total": result[1]}
+        if len(result) > 2:
+            entry["facets"] = result[2]
+        return entry
+
+    def search_request(self, params, fuzziness):
+        """
+        Function to build the keyword arguments of one search_products pass.
+        :param params: The search_products keyword arguments.
+        :param fuzziness: The fuzziness of the pass.
+        :return:
+            tuple: Whether the request is a template search, and the request keyword arguments.
+        """
+        request = {"index": "products_index", "filter_path": ["hits.total.value", "hits.hits._source", "aggregations"],
+                   "request_timeout": 30, **self.routing(params["country"])}
+        body = self.multi_search_body(params, fuzziness)
+        if self.use_search_templates:
+            request.update(body)
         else:
-            search_fields = [
-                "name_fr^2",
-                "category_name_fr^2",
-                "description_fr",
-                "search_index",
-                "hash"
-            ]
+            request["body"] = body
+        return self.use_search_templates, request
 
-        # base query
-        search_query = {
-            "size": limit,
-            "from": offset,
-            "min_score": 4.7,
-            "query": {
-                "function_score": {
-                    "query": {
-                        "bool": {
-                            "must": [
-                                {
-                                    "multi_match": {
-                                        "query": search_term,
-                                        "fields": search_fields,
-                                        "fuzziness": "AUTO"
-                                    }
-                                },
-                                {
-                                    "term": {"country": country}
-                                }
-                            ],
-                            "filter": []
+    def search_products_batch(self, searches):
+        """
+        Function to run several product searches in a single _msearch round trip.
+
+        Each entry takes the keyword arguments of search_products. Cached entries are answered
+        from the search cache; the others go out in one multi search per fuzziness pass.
+        :param searches: A list of search_products keyword argument dictionaries.
+        :return:
+            list: One {"products", "total"} or {"error", "status"} dictionary per search, in input order.
+        """
+        results, pending = self.prepare_batch(searches)
+        if self.use_search_templates and pending:
+            self.ensure_search_templates()
+
+        for fuzziness in self.fuzziness_passes():
+            if not pending:
+                break
+
+            template, request = self.multi_search_request(pending, fuzziness)
+            started = time.perf_counter()
+            response = self.es.msearch_template(**request) if template else self.es.msearch(**request)
+            search_metrics.observe(f"msearch.{'fuzzy' if fuzziness else 'exact'}", (time.perf_counter() - started) * 1000)
+            search_metrics.incr("msearch.searches", len(pending))
+            pending = self.collect_batch_responses(results, pending, fuzziness, response)
+
+        return results
+
+    def prepare_batch(self, searches):
+        """
+        Function to validate a batch of searches and answer what the search cache already holds.
+        :param searches: A list of search_products keyword argument dictionaries.
+        :return:
+            tuple: The result list, and the (position, params, cache_key) entries still to search.
+        """
+        results = [None] * len(searches)
+        pending = []
+        for position, search in enumerate(searches):
+            try:
+                params = {**SEARCH_DEFAULTS, **search}
+                unknown = set(params) - set(SEARCH_DEFAULTS)
+                if unknown:
+                    raise ValueError(f"unknown search parameters: {', '.join(sorted(unknown))}")
+                if not params["search_term"]:
+                    raise ValueError("query is required")
+                self.source_filter(params["fields"])
+            except ValueError as e:
+                results[position] = {"error": str(e), "status": 400}
+                continue
+
+            cache_key, cached = search_cache.get("products", params)
+            if cached is not None:
+                results[position] = self.result_entry(cached)
+            else:
+                pending.append((position, params, cache_key))
+        return results, pending
+
+    def multi_search_request(self, pending, fuzziness):
+        """
+        Function to build the keyword arguments of one _msearch pass over the pending searches.
+        :return:
+            tuple: Whether the request is a template multi search, and the request keyword arguments.
+        """
+        requests = []
+        for position, params, cache_key in pending:
+            requests.append({"index": "products_index", **self.routing(params["country"])})
+            requests.append(self.multi_search_body(params, fuzziness))
+
+        request = {"filter_path": ["responses.hits.total.value", "responses.hits.hits._source",
+                                   "responses.aggregations", "responses.error.reason", "responses.status"],
+                   "request_timeout": 30}
+        if self.use_search_templates:
+            request["search_templates"] = requests
+        else:
+            request["searches"] = requests
+        return self.use_search_templates, request
+
+    def collect_batch_responses(self, results, pending, fuzziness, response):
+        """
+        Function to fill in the results of an _msearch pass and cache them.
+        :return:
+            list: The pending entries that need the fuzzy pass.
+        """
+        retry = []
+        for (position, params, cache_key), item in zip(pending, response["responses"]):
+            if "error" in item:
+                results[position] = {"error": item["error"].get("reason", "search failed"),
+                                      "status": item.get("status", 500)}
+            elif self.needs_fuzzy_fallback("search", fuzziness, item):
+                retry.append((position, params, cache_key))
+            else:
+                result = self.search_result(item, params)
+                search_cache.set(cache_key, list(result))
+                results[position] = self.result_entry(result)
+        return retry
+
+    def multi_search_body(self, params, fuzziness):
+        """
+        Function to build one _msearch entry: template params or an inline body.
+        """
+        offset = (params["page_num"] - 1) * params["limit"]
+        if self.use_search_templates:
+            template_params = self.search_template_params(
+                params["search_term"], params["latitude"], params["longitude"], params["sort_by"], params["limit"],
+                offset, params["country"], params["radius_km"], params["min_price"], params["max_price"],
+                params["category_id"], params["locale"], params["fields"], params["brand_id"], params["whole_sale"],
+                fuzziness, params["facets"]
+            )
+            return {"id": PRODUCTS_SEARCH_TEMPLATE_ID, "params": template_params}
+
+        body = self.build_search_query(
+            params["search_term"], params["latitude"], params["longitude"], params["sort_by"], params["country"],
+            params["radius_km"], params["min_price"], params["max_price"], params["category_id"], params["locale"],
+            params["brand_id"], params["whole_sale"], fuzziness, params["facets"]
+        )
+        body["_source"] = self.source_filter(params["fields"])
+        body["size"] = params["limit"]
+        body["from"] = offset
+        return body
+
+    @staticmethod
+    def source_filter(fields):
+        """
+        Function to resolve a named field set into a _source filter.
+        :param fields: The name of the field set.
+        :return:
+            dict: The _source includes/excludes.
+        """
+        if fields not in field_sets:
+            raise ValueError(f"unknown field set: {fields}")
+        return field_sets[fields]
+
+    @staticmethod
+    def routing(country, index_name="products_index"):
+        """
+        Function to get the routing keyword argument of a search on one country, so it only
+        queries the shards holding that country when the index is routed by country.
+        :return:
+            dict: {"routing": value}, or an empty dict.
+        """
+        routing = country_routing.routing(index_name, country)
+        return {"routing": routing} if routing else {}
+
+    def fuzziness_passes(self):
+        """
+        Function to list the fuzziness of each query pass: exact first, then fuzzy when adaptive.
+        """
+        return (None, "AUTO") if self.adaptive_fuzziness else ("AUTO",)
+
+    def timed_search(self, name, fuzziness, template=False, **kwargs):
+        """
+        Function to run a search, or a stored template search, and record its latency per pass.
+        """
+        started = time.perf_counter()
+        response = self.es.search_template(**kwargs) if template else self.es.search(**kwargs)
+        search_metrics.observe(f"{name}.{'fuzzy' if fuzziness else 'exact'}", (time.perf_counter() - started) * 1000)
+        return response
+
+    def needs_fuzzy_fallback(self, name, fuzziness, response):
+        """
+        Function to decide whether an exact pass found too few hits and the fuzzy pass must run.
+        """
+        if fuzziness is not None:
+            return False
+        if response["hits"]["total"]["value"] >= self.fuzzy_min_hits:
+            search_metrics.incr(f"{name}.exact_only")
+            return False
+        search_metrics.incr(f"{name}.fuzzy_fallbacks")
+        return True
+
+    @staticmethod
+    def encode_cursor(state):
+        return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        Function to read the state of the next page back from a cursor made by encode_cursor.
+        :param cursor: The opaque cursor sent by the client.
+        :return:
+            dict: The search_after values, the fuzziness and, when pinned, the point in time id.
+        """
+        try:
+            state = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (AttributeError, ValueError):
+            raise ValueError("invalid cursor")
+
+        if (not isinstance(state, dict) or set(state) - {"search_after", "fuzziness", "pit_id"}
+                or not isinstance(state.get("search_after"), list) or not state["search_after"]
+                or "fuzziness" not in state or state["fuzziness"] not in (None, "AUTO")
+                or not isinstance(state.get("pit_id", ""), str)):
+            raise ValueError("invalid cursor")
+        return state
+
+    def search_products_cursor(self, search_term, latitude=None, longitude=None, sort_by="relevance_high_low",
+                               limit=20, cursor=None, country=1, radius_km=20, min_price=None,
+                               max_price=None, category_id=None, locale="En", use_pit=False,
+                               fields=default_field_set, brand_id=None, whole_sale=None):
+        """
+        Function to search products page by page with search_after, so deep pages cost the same as the first one.
+
+        The sort always ends with a tiebreaker on id. With use_pit the first page opens a
+        point in time and every following page reads the same snapshot of the index.
+        :param cursor: The opaque cursor returned with the previous page, None for the first page.
+        :param use_pit: Pin the pages to a point in time.
+        :param fields: The name of the _source field set to return.
+        :return:
+            tuple: A list of products, the total result count and the cursor of the next page (None on the last page).
+        """
+        state = self.decode_cursor(cursor) if cursor else {}
+
+        pit_id = state.get("pit_id")
+        if use_pit and not pit_id and not state:
+            pit_id = self.es.open_point_in_time(index="products_index", keep_alive=self.pit_keep_alive,
+                                                **self.routing(country))["id"]
+
+        # Later pages reuse the fuzziness the first page settled on, so every page ranks alike.
+        passes = (state["fuzziness"],) if "fuzziness" in state else self.fuzziness_passes()
+        for fuzziness in passes:
+            search_query = self.build_search_query(search_term, latitude, longitude, sort_by, country, radius_km,
+                                                   min_price, max_price, category_id, locale, brand_id, whole_sale,
+                                                   fuzziness)
+            search_query["_source"] = self.source_filter(fields)
+            search_query["size"] = limit
+            search_query["sort"].append({"id": "asc"})
+            if state.get("search_after"):
+                search_query["search_after"] = state["search_after"]
+
+            if pit_id:
+                search_query["pit"] = {"id": pit_id, "keep_alive": self.pit_keep_alive}
+                response = self.timed_search("search", fuzziness, body=search_query, request_timeout=30)
+            else:
+                response = self.timed_search("search", fuzziness, index="products_index", body=search_query,
+                                             request_timeout=30, **self.routing(country))
+            if "fuzziness" in state or not self.needs_fuzzy_fallback("search", fuzziness, response):
+                break
+
+        hits = response["hits"]["hits"]
+        total_results_count = response["hits"]["total"]["value"]
+        search_results = [hit["_source"] for hit in hits]
+
+        next_cursor = None
+        if len(hits) == limit:
+            next_state = {"search_after": hits[-1]["sort"], "fuzziness": fuzziness}
+            if pit_id:
+                next_state["pit_id"] = response.get("pit_id", pit_id)
+            next_cursor = self.encode_cursor(next_state)
+        elif pit_id:
+            self.close_point_in_time(pit_id)
+
+        return search_results, total_results_count, next_cursor
+
+    def close_point_in_time(self, pit_id):
+        try:
+            self.es.close_point_in_time(id=pit_id)
+        except Exception as e:
+            logging.warning(f"Could not close point in time: {str(e)}")
+
+    def build_search_query(self, search_term, latitude=None, longitude=None, sort_by="relevance_high_low",
+                           country=1, radius_km=20, min_price=None, max_price=None, category_id=None, locale="En",
+                           brand_id=None, whole_sale=None, fuzziness="AUTO", facets=False):
+        """
+        Function to build the Elasticsearch query body of a product search, without pagination.
+
+        Only the text match and the freshness rank feature are scored; every exact-match constraint
+        is compiled into a cacheable filter by ProductQueryBuilder. With facets, the filters on
+        faceted fields become a post_filter and the facet aggregations are added.
+        :return:
+            dict: The query body.
+        """
+        builder = self.filter_builder(latitude, longitude, country, radius_km, min_price, max_price, category_id,
+                                      brand_id, whole_sale)
+        builder.text(search_term, SEARCH_FIELDS["En" if locale == "En" else "Fr"], fuzziness=fuzziness)
+        builder.rank_feature(FRESHNESS_FIELD)
+        active_filters = builder.take_filters(facet_fields) if facets else {}
+
+        body = {
+            "min_score": self.min_score(category_id),
+            "query": builder.build(),
+            "sort": self.build_sort(sort_by, latitude, longitude)
+        }
+        if facets:
+            body["post_filter"] = {"bool": {"filter": list(active_filters.values())}}
+            body["aggs"] = self.facet_aggregations(active_filters, locale)
+        return body
+
+    @staticmethod
+    def min_score(category_id=None):
+        """
+        Function to get the min_score of a search: MIN_SCORE, lowered by CATEGORY_MIN_SCORE_CREDIT with a category.
+        """
+        return round(max(MIN_SCORE - (CATEGORY_MIN_SCORE_CREDIT if category_id else 0), 0), 4)
+
+    @staticmethod
+    def facet_aggregations(active_filters, locale="En"):
+        """
+        Function to build the facet aggregations of a search.
+
+        Each facet is scoped to the active filters on the other fields, so selecting a
+        category narrows the brand counts but still lists every category.
+        :param active_filters: The {field: clause} filters applied as post_filter.
+        :param locale: The locale of the category labels.
+        :return:
+            dict: The aggregations.
+        """
+        aggregations = {}
+        for name, facet in facet_definitions.items():
+            aggregation = dict(facet["aggregation"])
+            if name == "category":
+                label_field = CATEGORY_LABEL_FIELDS["En" if locale == "En" else "Fr"]
+                aggregation["aggs"] = {"label": {"terms": {"field": label_field, "size": 1}}}
+
+            others = [clause for field, clause in active_filters.items() if field != facet["field"]]
+            aggregations[name] = {"filter": {"bool": {"filter": others}}, "aggs": {"values": aggregation}}
+        return aggregations
+
+    @staticmethod
+    def facet_results(response, locale="En"):
+        """
+        Function to read the facets out of a search response.
+        :return:
+            dict: Category, brand and wholesale counts, price range counts and price stats.
+        """
+        aggregations = response.get("aggregations")
+        if not aggregations:
+            return {}
+
+        def buckets(name):
+            return aggregations[name]["values"]["buckets"]
+
+        categories = []
+        for bucket in buckets("category"):
+            labels = bucket.get("label", {}).get("buckets", [])
+            categories.append({"id": bucket["key"], "label": labels[0]["key"] if labels else None,
+                               "count": bucket["doc_count"]})
+
+        stats = aggregations["price_stats"]["values"]
+        return {
+            "category": categories,
+            "brand": [{"id": bucket["key"], "count": bucket["doc_count"]} for bucket in buckets("brand")],
+            "whole_sale": [{"value": bucket["key"], "count": bucket["doc_count"]} for bucket in buckets("whole_sale")],
+            "price": [{"key": bucket["key"], "from": bucket.get("from"), "to": bucket.get("to"),
+                       "count": bucket["doc_count"]} for bucket in buckets("price")],
+            "price_stats": {"min": stats.get("min"), "max": stats.get("max"), "avg": stats.get("avg")}
+        }
+
+    def map_products(self, top, left, bottom, right, zoom, search_term=None, country=1, min_price=None,
+                     max_price=None, category_id=None, brand_id=None, whole_sale=None, locale="En"):
+        """
+        Function to draw the products of a map view in a single search.
+
+        Below map_pin_zoom the products are clustered on a geotile grid, each cluster with its
+        count and centroid; from map_pin_zoom the products themselves are returned as pins, with
+        the map_pin field set. The text, category, brand, wholesale and price filters select the
+        same products as search_products.
+        :param top: The north edge of the view.
+        :param left: The west edge of the view.
+        :param bottom: The south edge of the view.
+        :param right: The east edge of the view.
+        :param zoom: The zoom level of the map.
+        :return:
+            dict: The clusters or the products, their total, and the bounds actually covered.
+        """
+        params = self.map_params({
+            "top": top, "left": left, "bottom": bottom, "right": right, "zoom": zoom, "search_term": search_term,
+            "country": country, "min_price": min_price, "max_price": max_price, "category_id": category_id,
+            "brand_id": brand_id, "whole_sale": whole_sale, "locale": locale
+        })
+        cache_key, cached = search_cache.get("map", params)
+        if cached is not None:
+            return cached
+
+        for fuzziness in self.fuzziness_passes():
+            response = self.timed_search("map", fuzziness, **self.map_request(params, fuzziness))
+            if not params["search_term"] or not self.needs_fuzzy_fallback("map", fuzziness, response):
+                break
+
+        result = self.map_result(response, params)
+        search_cache.set(cache_key, result)
+        return result
+
+    def map_params(self, params):
+        """
+        Function to validate a map view and snap it to the edges of its cluster cells.
+        :param params: The map_products keyword arguments.
+        :return:
+            dict: The parameters with the snapped bounds and the cluster precision.
+        """
+        params = {**MAP_DEFAULTS, **params}
+        try:
+            top, left, bottom, right = (float(params[edge]) for edge in ("top", "left", "bottom", "right"))
+            zoom = int(params["zoom"])
+        except (TypeError, ValueError):
+            raise ValueError("top, left, bottom, right and zoom must be numbers")
+        if not (-90 <= bottom < top <= 90) or not (-180 <= left <= 180 and -180 <= right <= 180):
+            raise ValueError("invalid bounds")
+        if not 0 <= zoom <= MAX_PRECISION:
+            raise ValueError(f"zoom must be between 0 and {MAX_PRECISION}")
+
+        precision = min(zoom + self.map_cluster_precision_offset, MAX_PRECISION)
+        top, left, bottom, right = snap_bounding_box(top, left, bottom, right, precision)
+        return {**params, "top": top, "left": left, "bottom": bottom, "right": right, "zoom": zoom,
+                "precision": precision, "pins": zoom >= self.map_pin_zoom}
+
+    def map_request(self, params, fuzziness):
+        """
+        Function to build the keyword arguments of one map_products pass.
+        :return:
+            dict: The search keyword arguments.
+        """
+        builder = self.filter_builder(None, None, params["country"], None, params["min_price"], params["max_price"],
+                                      params["category_id"], params["brand_id"], params["whole_sale"])
+        builder.geo_bounding_box(params["top"], params["left"], params["bottom"], params["right"])
+
+        body = {"size": 0}
+        if params["search_term"]:
+            builder.text(params["search_term"], SEARCH_FIELDS["En" if params["locale"] == "En" else "Fr"],
+                         fuzziness=fuzziness)
+            builder.rank_feature(FRESHNESS_FIELD)
+            body["min_score"] = self.min_score(params["category_id"])
+        body["query"] = builder.build()
+
+        if params["pins"]:
+            body["size"] = self.map_max_pins
+            body["_source"] = self.source_filter("map_pin")
+            body["sort"] = [DEFAULT_SORT]
+            filter_path = ["hits.total", "hits.hits._source"]
+        else:
+            body["track_total_hits"] = True
+            body["aggs"] = {
+                "clusters": {
+                    "geotile_grid": {
+                        "field": "location",
+                        "precision": params["precision"],
+                        "size": self.map_max_clusters,
+                        "bounds": {
+                            "top_left": {"lat": params["top"], "lon": params["left"]},
+                            "bottom_right": {"lat": params["bottom"], "lon": params["right"]}
                         }
                     },
-                    "functions": [
-                        {
-                            "gauss": {
-                                "created_at": {
-                                    "origin": "now",
-                                    "scale": "90d",
-                                    "offset": "30d",
-                                    "decay": 0.7
-                                }
-                            },
-                            "weight": 0.8
-                        }
-                    ],
-                    "boost_mode": "sum",
-                    "score_mode": "avg"
+                    "aggs": {
+                        "centroid": {"geo_centroid": {"field": "location"}}
+                    }
                 }
-            },
-            "sort": []
-        }
+            }
+            filter_path = ["hits.total", "aggregations.clusters.buckets.key", "aggregations.clusters.buckets.doc_count",
+                           "aggregations.clusters.buckets.centroid.location"]
 
-        # category filter
-        if category_id:
-            search_query["query"]["function_score"]["query"]["bool"]["must"].append({
-                "bool": {
-                    "should": [
-                        {"match": {"category_id": category_id}},
-                        {"match": {"category_id": category_id}}
-                    ],
-                    "minimum_should_match": 1
-                }
-            })
+        return {"index": "products_index", "body": body, "filter_path": filter_path, "request_timeout": 30,
+                **self.routing(params["country"])}
+
+    @staticmethod
+    def map_result(response, params):
+        """
+        Function to read the clusters or the pins out of a map_products response.
+        :return:
+            dict: The zoom, the snapped bounds, the total, and the clusters or the products.
+        """
+        result = {
+            "zoom": params["zoom"],
+            "bounds": {edge: params[edge] for edge in ("top", "left", "bottom", "right")},
+            "total": response["hits"]["total"]["value"]
+        }
+        if params["pins"]:
+            result["products"] = [hit["_source"] for hit in response["hits"].get("hits", [])]
+            result["truncated"] = result["total"] > len(result["products"])
+        else:
+            result["clusters"] = [{
+                "key": bucket["key"],
+                "count": bucket["doc_count"],
+                "location": bucket["centroid"]["location"]
+            } for bucket in response.get("aggregations", {}).get("clusters", {}).get("buckets", [])]
+        return result
 
-        # location filter
+    @staticmethod
+    def filter_builder(latitude=None, longitude=None, country=1, radius_km=20, min_price=None, max_price=None,
+                       category_id=None, brand_id=None, whole_sale=None):
+        """
+        Function to compile the exact-match constraints of a product search into filters.
+        :return:
+            ProductQueryBuilder: A builder holding the filters.
+        """
+        builder = ProductQueryBuilder()
+        builder.term("country", country)
+        builder.term("category_id", category_id)
+        builder.term("brand_id", brand_id)
+        builder.term("whole_sale", whole_sale)
+        builder.range("price", gte=min_price or None, lte=max_price or None)
         if latitude and longitude:
-            search_query["query"]["function_score"]["query"]["bool"]["filter"].append({
-                "geo_distance": {
-                    "distance": f"{radius_km}km",
-                    "location": {
-                        "lat": latitude,
-                        "lon": longitude
-                    }
-                }
-            })
-
-        # price filter
-        if min_price:
-            search_query["query"]["function_score"]["query"]["bool"]["filter"].append(
-                {"range": {"price": {"gte": min_price}}})
-        if max_price:
-            search_query["query"]["function_score"]["query"]["bool"]["filter"].append(
-                {"range": {"price": {"lte": max_price}}})
-
-        # Sorting
-        if sort_by == 'alphabetically_az':
-            search_query["sort"].append({"name.keyword": "asc"})
-        elif sort_by == 'alphabetically_za':
-            search_query["sort"].append({"name.keyword": "desc"})
-        elif sort_by == 'price_low_high':
-            search_query["sort"].append({"price": "asc"})
-        elif sort_by == 'price_high_low':
-            search_query["sort"].append({"price": "desc"})
-        elif sort_by == 'date_old_new':
-            search_query["sort"].append({"created_at": "asc"})
-        elif sort_by == 'date_new_old':
-            search_query["sort"].append({"created_at": "desc"})
-        elif sort_by == 'relevance_low_high':
-            search_query["sort"].append({"_score": "asc"})
-        elif sort_by == 'relevance_high_low':
-            search_query["sort"].append({"_score": "desc"})
-        elif sort_by == 'distance_near_far' and latitude and longitude:
-            search_query["sort"].append({
-                "_geo_distance": {
-                    "location": {"lat": latitude, "lon": longitude},
-                    "order": "asc",
-                    "unit": "km",
-                    "mode": "min"
-                }
-            })
-        elif sort_by == 'distance_far_near' and latitude and longitude:
-            search_query["sort"].append({
+            builder.geo_distance(latitude, longitude, radius_km)
+        return builder
+
+    @staticmethod
+    def build_sort(sort_by, latitude=None, longitude=None):
+        """
+        Function to look the sort clause up in the sort table.
+        :return:
+            list: A new sort list, safe to extend.
+        """
+        if sort_by in GEO_SORT_ORDERS and latitude and longitude:
+            return [{
                 "_geo_distance": {
                     "location": {"lat": latitude, "lon": longitude},
-                    "order": "desc",
+                    "order": GEO_SORT_ORDERS[sort_by],
                     "unit": "km",
                     "mode": "min"
                 }
-            })
-        else:
-            search_query["sort"].append({"_score": "desc"})
+            }]
+        return [SORT_TABLE.get(sort_by, DEFAULT_SORT)]
 
-        response = self.es.search(index="products_index", body=search_query, request_timeout=30)
+    def ensure_search_templates(self):
+        """
+        Function to register the stored search templates once per process.
+        :return:
+        """
+        if not SearchService.templates_registered:
+            for template_id, template in search_templates.items():
+                self.es.put_script(id=template_id, body=template)
+            SearchService.templates_registered = True
 
-        total_results_count = response["hits"]["total"]["value"]
-        search_results = [hit["_source"] for hit in response["hits"]["hits"]]
-        return search_results, total_results_count
+    def search_template_params(self, search_term, latitude, longitude, sort_by, limit, offset, country, radius_km,
+                               min_price, max_price, category_id, locale, fields, brand_id, whole_sale, fuzziness,
+                               facets=False):
+        """
+        Function to build the params of the stored products search template.
+        :return:
+            dict: The template params.
+        """
+        builder = self.filter_builder(latitude, longitude, country, radius_km, min_price, max_price, category_id,
+                                      brand_id, whole_sale)
+        active_filters = builder.take_filters(facet_fields) if facets else {}
+        params = {
+            "query": search_term,
+            "fr": locale != "En",
+            "fuzziness": fuzziness,
+            "min_score": self.min_score(category_id),
+            "filters": builder.filter_clauses(),
+            "sort": self.build_sort(sort_by, latitude, longitude),
+            "source": self.source_filter(fields),
+            "size": limit,
+            "from": offset
+        }
+        if facets:
+            params["facets"] = True
+            params["post_filter"] = list(active_filters.values())
+            params["aggs"] = self.facet_aggregations(active_filters, locale)
+        return params
+
+    def suggest(self, country, user_input, limit=20, page_num=1, locale="En"):
+        """
+        Function to suggest product names for what the user typed so far.
+
+        Answered from the in-process prefix index; Elasticsearch is only queried, fuzzy, when
+        the index has no name for the prefix (typos) or is not built yet.
+        :return:
+            tuple: A list of product names and the total count.
+        """
+        result = suggestion_index.lookup(country, locale, user_input, limit, page_num)
+        if result is not None:
+            search_metrics.incr("suggest.prefix_index")
+            return result
+
+        search_metrics.incr("suggest.es_fallback")
+        return self.product_suggestions("products_index", country, user_input, limit, page_num, locale,
+                                        passes=self.suggestion_fallback_passes())
+
+    def suggestion_fallback_passes(self):
+        # An exact prefix the index does not know will not match in Elasticsearch either, once the index is built.
+        return ("AUTO",) if suggestion_index.ready else None
 
-    def product_suggestions(self, index_name, country, user_input, limit=20, page_num=1, locale="En"):
+    def product_suggestions(self, index_name, country, user_input, limit=20, page_num=1, locale="En", passes=None):
         """
         Function to provide product suggestions based on user input using Elasticsearch,
         incorporating relevance and boosting functionality.
@@ -184,6 +715,7 @@ class SearchService:
             limit (integer): The number of suggestions to return.
             page_num (integer): The page/offset of suggestions to return.
             locale (str): The locale of the user.
+            passes (tuple): The fuzziness of each query pass, fuzziness_passes() by default.
 
         Returns:
             tuple: A tuple containing a list of relevant product names and the total result count.
@@ -191,59 +723,48 @@ class SearchService:
 
         offset = int((page_num - 1) * limit)
 
+        for fuzziness in passes or self.fuzziness_passes():
+            search_query = self.suggestion_query(country, user_input, limit, offset, locale, fuzziness)
+            response = self.timed_search("suggest", fuzziness, index=index_name, body=search_query, request_timeout=30,
+                                         **self.routing(country, index_name))
+            if not self.needs_fuzzy_fallback("suggest", fuzziness, response):
+                break
+
+        return self.suggestion_names(response, locale)
+
+    def suggestion_query(self, country, user_input, limit, offset, locale, fuzziness):
+        """
+        Function to build the query body of one product_suggestions pass.
+        :return:
+            dict: The query body.
+        """
         if locale == "En":
             search_fields = ["name^2"]
         else:
             search_fields = ["name_fr^2"]
 
-        search_query = {
+        builder = ProductQueryBuilder()
+        builder.text(user_input, search_fields, fuzziness=fuzziness, type="bool_prefix")
+        builder.rank_feature(FRESHNESS_FIELD, boost=self.suggestion_freshness_boost)
+        builder.term("country", country)
+
+        return {
             "size": limit,
             "from": offset,
-            "query": {
-                "function_score": {
-                    "query": {
-                        "bool": {
-                            "must": [
-                                {
-                                    "multi_match": {
-                                        "query": user_input,
-                                        "fields": search_fields,
-                                        "fuzziness": "AUTO",
-                                        "type": "bool_prefix"
-                                    }
-                                }
-                            ],
-                            "filter": [
-                                {
-                                    "term": {
-                                        "country": country
-                                    }
-                                }
-                            ]
-                        }
-                    },
-                    "functions": [
-                        {
-                            "gauss": {
-                                "created_at": {
-                                    "origin": "now",
-                                    "scale": "90d",
-                                    "offset": "30d",
-                                    "decay": 0.5
-                                }
-                            }
-                        }
-                    ],
-                    "boost_mode": "multiply"
-                }
-            },
+            "_source": self.source_filter("suggestion"),
+            "query": builder.build(),
             "sort": [
                 {"_score": "desc"}
             ]
         }
 
-        response = self.es.search(index=index_name, body=search_query, request_timeout=30)
-
+    @staticmethod
+    def suggestion_names(response, locale):
+        """
+        Function to read the suggested product names out of a suggestions response.
+        :return:
+            tuple: A list of product names and the total result count.
+        """
         total_results_count = response["hits"]["total"]["value"]
 
         hits = response["hits"]["hits"]
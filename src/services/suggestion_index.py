@@ -0,0 +1,282 @@
+import os
+import time
+import heapq
+import logging
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone
+from elasticsearch.helpers import scan
+from src.db_connection.elasticsearchDBconnection import ElasticsearchDBConnection
+from src.services.search_cache import search_cache
+from src.utils.freshness import freshness, epoch_millis, FRESHNESS_FIELD
+
+LOCALES = ("En", "Fr")
+
+
+def normalize(text):
+    """
+    Function to fold a name or a typed prefix: lower case, no accents, single spaces.
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return " ".join("".join(char for char in text if not unicodedata.combining(char)).split())
+
+
+class PrefixTable:
+    """
+    Compact prefix index of the product names of one country and locale.
+
+    Every word-suffix of every name ("iphone 13 pro", "13 pro", "pro") is a key of one sorted
+    list, so a prefix is a bisect range, like a bool_prefix match on any word. Names are
+    stored once and referenced by position; their weight is the sum of the freshness
+    of the products carrying them, so popular and recent names come first. The best names
+    of every prefix up to top_prefix_length characters are precomputed.
+    """
+
+    def __init__(self, weighted_names, top_prefix_length=2, top_size=100):
+        self.names = list(weighted_names)
+        self.weights = array("d", (weighted_names[name] for name in self.names))
+
+        entries = []
+        for name_id, name in enumerate(self.names):
+            words = normalize(name).split()
+            for position in range(len(words)):
+                entries.append((" ".join(words[position:]), name_id))
+        entries.sort()
+        self.keys = [key for key, name_id in entries]
+        self.name_ids = array("I", (name_id for key, name_id in entries))
+
+        self.top_prefix_length = top_prefix_length
+        by_prefix = {}
+        for key, name_id in entries:
+            for length in range(1, min(len(key), top_prefix_length) + 1):
+                by_prefix.setdefault(key[:length], set()).add(name_id)
+        self.top = {prefix: (self.best(name_ids, top_size), len(name_ids)) for prefix, name_ids in by_prefix.items()}
+
+    def best(self, name_ids, count):
+        return heapq.nlargest(count, name_ids, key=lambda name_id: (self.weights[name_id], -name_id))
+
+    def lookup(self, prefix, limit, offset=0):
+        """
+        Function to find the best names having a word starting with the prefix.
+        :param prefix: A normalized prefix.
+        :return:
+            tuple: A list of names and the number of names matching the prefix.
+        """
+        if len(prefix) <= self.top_prefix_length:
+            best, total = self.top.get(prefix, ([], 0))
+            if offset + limit <= len(best) or len(best) == total:
+                return [self.names[name_id] for name_id in best[offset:offset + limit]], total
+
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + "\uffff", start)
+        name_ids = set(self.name_ids[start:end])
+        best = self.best(name_ids, offset + limit)
+        return [self.names[name_id] for name_id in best[offset:]], len(name_ids)
+
+
+class SuggestionIndex:
+    """
+    In-process autocomplete over the product names, per country and locale.
+
+    Built in a background thread from products_index on first use and answered from memory
+    afterwards. When ingestion bumps the search cache generation, only the products updated
+    since the last build are fetched, the products of the countries that lost documents are
+    checked for deletions, and the tables of the changed countries rebuilt; everything is
+    rebuilt every full_rebuild_seconds. Until the first build is done lookups return None
+    and callers use Elasticsearch.
+    """
+    enabled = os.getenv("SUGGEST_PREFIX_INDEX", "true").lower() == "true"
+    full_rebuild_seconds = int(os.getenv("SUGGEST_INDEX_FULL_REBUILD_SECONDS", 3600))
+    top_prefix_length = int(os.getenv("SUGGEST_INDEX_TOP_PREFIX_LENGTH", 2))
+    top_size = int(os.getenv("SUGGEST_INDEX_TOP_SIZE", 100))
+    retry_seconds = int(os.getenv("SUGGEST_INDEX_RETRY_SECONDS", 30))
+    index_name = "products_index"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.products = {}
+        self.product_countries = {}
+        self.generation = None
+        self.watermark = None
+        self.built_at = None
+        self.refresher = None
+        self.failed_at = None
+
+    @property
+    def es(self):
+        return ElasticsearchDBConnection().es_connection()
+
+    @property
+    def ready(self):
+        return self.built_at is not None
+
+    def lookup(self, country, locale, prefix, limit=20, page_num=1):
+        """
+        Function to suggest product names starting with a prefix.
+        :param country: The country of the products.
+        :param locale: En or Fr.
+        :param prefix: What the user typed so far.
+        :param limit: The number of suggestions to return.
+        :param page_num: The page of suggestions to return.
+        :return:
+            tuple: A list of product names and the total count, or None when the index can not answer.
+        """
+        if not self.enabled:
+            return None
+        self.maybe_refresh()
+
+        table = self.tables.get((self.country_key(country), "En" if locale == "En" else "Fr"))
+        prefix = normalize(prefix or "")
+        if not self.ready or table is None or not prefix:
+            return None
+
+        suggestions, total = table.lookup(prefix, int(limit), int((page_num - 1) * limit))
+        return (suggestions, total) if total else None
+
+    @staticmethod
+    def country_key(country):
+        try:
+            return int(country)
+        except (TypeError, ValueError):
+            return country
+
+    def maybe_refresh(self):
+        """
+        Function to start a background refresh when the index is missing, stale or behind the search cache generation.
+        :return:
+        """
+        generation = search_cache.current_generation()
+        full = not self.ready or time.monotonic() - self.built_at >= self.full_rebuild_seconds
+        if not full and generation == self.generation:
+            return
+        if self.failed_at is not None and time.monotonic() - self.failed_at < self.retry_seconds:
+            return
+
+        with self.lock:
+            if self.refresher is not None and self.refresher.is_alive():
+                return
+            self.refresher = threading.Thread(target=self.refresh, args=(full, generation),
+                                              name="suggestion-index-refresh", daemon=True)
+            self.refresher.start()
+
+    def fetch_products(self, since=None):
+        query = {"range": {"updated_at": {"gte": since, "format": "epoch_millis"}}} if since else {"match_all": {}}
+        return scan(self.es, index=self.index_name, size=5000, query={
+            "query": query,
+            "_source": ["id", "country", "name", "name_fr", "created_at", "updated_at", FRESHNESS_FIELD]
+        })
+
+    def refresh(self, full, generation):
+        """
+        Function to rebuild every table, or only the tables of the countries with updated products.
+        :param full: Rebuild from every product instead of the products updated since the last build.
+        :param generation: The search cache generation the refresh catches up with.
+        :return:
+        """
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        products = {} if full else dict(self.products)
+        product_countries = {} if full else dict(self.product_countries)
+        watermark = None if full else self.watermark
+        changed = set()
+
+        try:
+            for hit in self.fetch_products(since=watermark):
+                source = hit["_source"]
+                product_id = source.get("id", hit["_id"])
+                country = self.country_key(source.get("country"))
+
+                previous = product_countries.get(product_id)
+                if previous is not None:
+                    if previous not in changed:
+                        products[previous] = dict(products[previous])
+                        changed.add(previous)
+                    products[previous].pop(product_id, None)
+                if country not in changed:
+                    products[country] = dict(products.get(country, {}))
+                    changed.add(country)
+
+                weight = source.get(FRESHNESS_FIELD) or freshness(source.get("created_at"), now)
+                products[country][product_id] = (source.get("name"), source.get("name_fr"), weight)
+                product_countries[product_id] = country
+                updated_at = epoch_millis(source.get("updated_at"))
+                if updated_at is not None and (watermark is None or updated_at > watermark):
+                    watermark = updated_at
+
+            if not full:
+                for product_id in self.find_deleted(product_countries):
+                    country = product_countries.pop(product_id)
+                    if country not in changed:
+                        products[country] = dict(products[country])
+                        changed.add(country)
+                    products[country].pop(product_id, None)
+        except Exception as e:
+            logging.error(f"Suggestion index refresh failed: {str(e)}")
+            self.failed_at = time.monotonic()
+            return
+
+        tables = {} if full else dict(self.tables)
+        for country in changed:
+            for locale in LOCALES:
+                tables[(country, locale)] = self.build_table(products[country].values(), locale)
+
+        self.products, self.product_countries, self.tables = products, product_countries, tables
+        self.watermark, self.generation, self.failed_at = watermark, generation, None
+        if full:
+            self.built_at = time.monotonic()
+        logging.info(f"Suggestion index {'rebuilt' if full else 'updated'}: {len(changed)} countries, "
+                     f"{len(product_countries)} products in {time.perf_counter() - started:.2f}s.")
+
+    def find_deleted(self, product_countries):
+        """
+        Function to find the products deleted from the index since they were loaded.
+
+        A country holding more products here than in the index lost some, and only the
+        product ids of those countries are read again.
+        :param product_countries: The {product id: country} of the products held, updates included.
+        :return:
+            set: The ids of the deleted products.
+        """
+        response = self.es.search(index=self.index_name, size=0, aggs={
+            "countries": {"terms": {"field": "country", "size": 10000}}
+        })
+        indexed = {self.country_key(bucket["key"]): bucket["doc_count"]
+                   for bucket in response["aggregations"]["countries"]["buckets"]}
+
+        held = {}
+        for product_id, country in product_countries.items():
+            held.setdefault(country, set()).add(product_id)
+
+        deleted = set()
+        for country, product_ids in held.items():
+            if country is None or len(product_ids) <= indexed.get(country, 0):
+                continue
+            live = {hit["_source"].get("id", hit["_id"]) for hit in scan(self.es, index=self.index_name, size=5000, query={
+                "query": {"term": {"country": country}},
+                "_source": ["id"]
+            })}
+            deleted.update(product_ids - live)
+        return deleted
+
+    def build_table(self, products, locale):
+        weighted_names = {}
+        for name, name_fr, weight in products:
+            label = (name_fr or name) if locale == "Fr" else name
+            if label:
+                weighted_names[label] = weighted_names.get(label, 0) + weight
+        return PrefixTable(weighted_names, self.top_prefix_length, self.top_size)
+
+    def get_stats(self):
+        return {
+            "ready": self.ready,
+            "generation": self.generation,
+            "watermark": self.watermark,
+            "products": len(self.product_countries),
+            "tables": {f"{country}:{locale}": len(table.names) for (country, locale), table in self.tables.items()}
+        }
+
+
+suggestion_index = SuggestionIndex()
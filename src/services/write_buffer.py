@@ -0,0 +1,126 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Future
+
+
+class WriteBuffer:
+    """
+    Coalesces single-document upserts into bulk requests.
+
+    Upserts are queued in memory and flushed as one bulk request once max_actions are
+    pending or the oldest one has waited max_wait_ms. Every queued upsert gets a Future
+    resolved with its own per-item status, so callers can wait for their writes. An
+    optional router gives the routing of each document of a batch, and the stored
+    copies to delete first when a document moved.
+    """
+    max_actions = int(os.getenv("WRITE_BUFFER_MAX_ACTIONS", 500))
+    max_wait_ms = int(os.getenv("WRITE_BUFFER_MAX_WAIT_MS", 50))
+
+    def __init__(self, es, index_name, max_actions=None, max_wait_ms=None, router=None):
+        self.es = es
+        self.index_name = index_name
+        self.router = router
+        self.max_actions = max_actions or self.max_actions
+        self.max_wait_ms = max_wait_ms or self.max_wait_ms
+        self.lock = threading.Lock()
+        self.pending = []
+        self.oldest = None
+        self.flusher = None
+
+    def add(self, document):
+        """
+        Function to queue an upsert of a product document.
+        :param document: An enriched product document with an id.
+        :return:
+            Future: Resolved with {"id", "status", "result"} or {"id", "status", "error"}.
+        """
+        future = Future()
+        with self.lock:
+            self.start_flusher()
+            if not self.pending:
+                self.oldest = time.monotonic()
+            self.pending.append((document, future))
+            batch = self.take_batch() if len(self.pending) >= self.max_actions else None
+
+        if batch:
+            self.send(batch)
+        return future
+
+    def take_batch(self):
+        batch, self.pending, self.oldest = self.pending, [], None
+        return batch
+
+    def start_flusher(self):
+        if self.flusher is None or not self.flusher.is_alive():
+            self.flusher = threading.Thread(target=self.run_flusher, name="write-buffer-flusher", daemon=True)
+            self.flusher.start()
+
+    def run_flusher(self):
+        interval = self.max_wait_ms / 1000
+        while True:
+            time.sleep(interval / 2)
+            with self.lock:
+                due = self.pending and time.monotonic() - self.oldest >= interval
+                batch = self.take_batch() if due else None
+            if batch:
+                self.send(batch)
+
+    def flush(self):
+        """
+        Function to send everything that is queued right away.
+        :return:
+        """
+        with self.lock:
+            batch = self.take_batch()
+        if batch:
+            self.send(batch)
+
+    def send(self, batch):
+        """
+        Function to send a batch of upserts as one bulk request and resolve their futures.
+        :param batch: A list of (document, future) pairs.
+        :return:
+        """
+        try:
+            operations = self.operations(batch)
+            response = self.es.bulk(operations=operations)
+        except Exception as e:
+            logging.error(f"Bulk upsert of {len(batch)} products failed: {str(e)}")
+            for document, future in batch:
+                future.set_result({"id": document["id"], "status": 500, "error": str(e)})
+            return
+
+        for (document, future), item in zip(batch, response["items"][len(operations) - 2 * len(batch):]):
+            info = item["update"]
+            status = info.get("status", 500)
+            if 200 <= status < 300:
+                future.set_result({"id": document["id"], "status": status, "result": info.get("result")})
+            else:
+                error = info.get("error", {})
+                reason = error.get("reason", str(error)) if isinstance(error, dict) else str(error)
+                future.set_result({"id": document["id"], "status": status, "error": reason})
+
+        logging.info(f"Flushed {len(batch)} product upserts in one bulk request.")
+
+    def operations(self, batch):
+        """
+        Function to build the bulk operations of a batch: the deletes of moved documents, then one upsert per document.
+        :param batch: A list of (document, future) pairs.
+        :return:
+            list: The bulk operations.
+        """
+        documents = [document for document, future in batch]
+        routings, relocations = self.router(documents) if self.router else ([None] * len(documents), [])
+
+        operations = []
+        for product_id, routing in relocations:
+            operations.append({"delete": {"_index": self.index_name, "_id": product_id, "routing": routing}})
+        for document, routing in zip(documents, routings):
+            action = {"_index": self.index_name, "_id": document["id"]}
+            if routing:
+                action["routing"] = routing
+            operations.append({"update": action})
+            operations.append({"doc": document, "doc_as_upsert": True})
+        return operations
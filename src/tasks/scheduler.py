@@ -0,0 +1,102 @@
+import os
+import logging
+import threading
+from datetime import datetime
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
+
+scheduler = BackgroundScheduler()
+
+SYNC_INTERVAL_SECONDS = int(os.getenv("SYNC_INTERVAL_SECONDS", 60))
+FRESHNESS_REFRESH_SECONDS = int(os.getenv("FRESHNESS_REFRESH_SECONDS", 24 * 3600))
+# Runs the jobs inside the web process: only for single-process setups, every gunicorn worker
+# would otherwise run its own copy. Deployments run `flask api run-scheduler` in one process instead.
+SYNC_SCHEDULER_ENABLED = os.getenv("SYNC_SCHEDULER_ENABLED", "false").lower() == "true"
+
+_ingestion_service = None
+_ingestion_service_lock = threading.Lock()
+
+
+def get_ingestion_service():
+    global _ingestion_service
+    with _ingestion_service_lock:
+        if _ingestion_service is None:
+            from src.services.data_ingestion_service import IngestionService
+            _ingestion_service = IngestionService()
+    return _ingestion_service
+
+
+def sync_products():
+    """
+    Job syncing the products changed since the last run into Elasticsearch.
+    :return:
+    """
+    result = get_ingestion_service().sync_products_delta()
+    if isinstance(result, str):
+        logging.error(f"Products delta sync failed: {result}")
+
+
+def refresh_freshness():
+    """
+    Job recomputing the freshness of the products as they age.
+    :return:
+    """
+    result = get_ingestion_service().refresh_freshness()
+    if isinstance(result, str):
+        logging.error(f"Freshness refresh failed: {result}")
+
+
+def add_jobs(target, freshness=False):
+    """
+    Function to register the background jobs on a scheduler.
+    :param target: The scheduler running the jobs.
+    :param freshness: Also register the freshness refresh, only done in the dedicated scheduler process.
+    :return:
+    """
+    target.add_job(
+        sync_products,
+        "interval",
+        seconds=SYNC_INTERVAL_SECONDS,
+        id="products_delta_sync",
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+    if not freshness:
+        return
+
+    # Also runs when the scheduler starts, which backfills the products indexed before the freshness
+    # field existed. A run only reads the products still decaying or without the field.
+    target.add_job(
+        refresh_freshness,
+        "interval",
+        seconds=FRESHNESS_REFRESH_SECONDS,
+        next_run_time=datetime.now(),
+        id="products_freshness_refresh",
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
+
+
+def schedule_tasks():
+    """
+    Function to start the background jobs inside the web process when SYNC_SCHEDULER_ENABLED is set.
+    :return:
+    """
+    if not SYNC_SCHEDULER_ENABLED:
+        return
+
+    add_jobs(scheduler)
+    scheduler.start()
+
+
+def run_scheduler():
+    """
+    Function to run the background jobs in the foreground, in the one process dedicated to them.
+    :return:
+    """
+    blocking_scheduler = BlockingScheduler()
+    add_jobs(blocking_scheduler, freshness=True)
+    logging.info("Scheduler started.")
+    blocking_scheduler.start()
@@ -0,0 +1,77 @@
+import math
+from datetime import datetime, timezone
+
+# Freshness of a product: a gauss decay on its age, precomputed at ingestion and stored in the
+# freshness rank_feature field. Same curve as the gauss function searches used to evaluate on
+# created_at at query time: 1 for 30 days, 0.7 at 120 days.
+FRESHNESS_FIELD = "freshness"
+FRESHNESS_SCALE_DAYS = 90
+FRESHNESS_OFFSET_DAYS = 30
+FRESHNESS_DECAY = 0.7
+FRESHNESS_PRECISION = 4
+
+# rank_feature values must be positive, so the decay stops at the floor.
+FRESHNESS_FLOOR = 0.0001
+# Age in days after which a product sits at the floor; only products younger than this ever change.
+FRESHNESS_HORIZON_DAYS = FRESHNESS_OFFSET_DAYS + FRESHNESS_SCALE_DAYS * math.sqrt(
+    math.log(FRESHNESS_FLOOR) / math.log(FRESHNESS_DECAY)
+)
+
+
+def parse_timestamp(value):
+    """
+    Function to read a datetime, a pandas Timestamp or an ISO formatted string as an aware UTC datetime.
+    :return:
+        datetime: The timestamp, None when it is missing or unreadable.
+    """
+    if value is None or value == "":
+        return None
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if value != value:
+        # NaT
+        return None
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def epoch_millis(value):
+    """
+    Function to read a date as epoch milliseconds, like Elasticsearch reads a date field.
+    :param value: Epoch milliseconds (a number or a string of digits), a datetime or an ISO formatted string.
+    :return:
+        int: The epoch milliseconds, None when the date is missing or unreadable.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+        return int(value)
+    timestamp = parse_timestamp(value)
+    return int(timestamp.timestamp() * 1000) if timestamp is not None else None
+
+
+def decay(age_days):
+    """
+    Function to apply the freshness curve to an age in days.
+    """
+    distance = max(age_days - FRESHNESS_OFFSET_DAYS, 0) / FRESHNESS_SCALE_DAYS
+    return round(max(math.exp(math.log(FRESHNESS_DECAY) * distance ** 2), FRESHNESS_FLOOR), FRESHNESS_PRECISION)
+
+
+def freshness(created_at, now=None):
+    """
+    Function to compute the freshness of a product.
+
+    A product without a creation date gets 1, like the gauss function on a missing field did.
+    :param created_at: The creation date of the product.
+    :param now: The reference time, the current time by default.
+    :return:
+        float: The freshness, between FRESHNESS_FLOOR and 1.
+    """
+    created = parse_timestamp(created_at)
+    if created is None:
+        return 1.0
+    now = now or datetime.now(timezone.utc)
+    return decay((now - created).total_seconds() / 86400)
@@ -0,0 +1,48 @@
+import math
+
+# The Web Mercator tiles Elasticsearch's geotile_grid uses: at precision p the world is split
+# into 2^p x 2^p tiles, between the latitudes the projection can show.
+MAX_LATITUDE = 85.0511287798066
+MAX_PRECISION = 29
+
+
+def tile(latitude, longitude, precision):
+    """
+    Function to find the tile of a point.
+    :return:
+        tuple: The x (west to east) and y (north to south) of the tile.
+    """
+    tiles = 1 << precision
+    latitude = max(min(latitude, MAX_LATITUDE), -MAX_LATITUDE)
+    x = int((longitude + 180) / 360 * tiles)
+    sin_latitude = math.sin(math.radians(latitude))
+    y = int((0.5 - math.log((1 + sin_latitude) / (1 - sin_latitude)) / (4 * math.pi)) * tiles)
+    return min(max(x, 0), tiles - 1), min(max(y, 0), tiles - 1)
+
+
+def tile_longitude(x, precision):
+    return x / (1 << precision) * 360 - 180
+
+
+def tile_latitude(y, precision):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / (1 << precision)))))
+
+
+def snap_bounding_box(top, left, bottom, right, precision):
+    """
+    Function to grow a bounding box to the edges of the tiles it touches.
+
+    Tiles cut by the edge of the box would otherwise be counted in part, and their counts and
+    centroids would change as the map pans; snapped boxes also repeat, so they can be cached.
+    :return:
+        tuple: The top, left, bottom and right of the snapped box.
+    """
+    left_x, top_y = tile(top, left, precision)
+    right_x, bottom_y = tile(bottom, right, precision)
+    # The first and last rows reach the poles: products beyond the projection belong to them.
+    return (
+        tile_latitude(top_y, precision) if top_y > 0 else 90.0,
+        tile_longitude(left_x, precision),
+        tile_latitude(bottom_y + 1, precision) if bottom_y + 1 < 1 << precision else -90.0,
+        tile_longitude(right_x + 1, precision)
+    )
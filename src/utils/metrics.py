@@ -0,0 +1,34 @@
+import threading
+
+
+class Metrics:
+    """
+    Thread-safe in-process counters and timers, exposed as a plain dictionary by the API.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, milliseconds):
+        with self.lock:
+            timer = self.timers.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            timer["count"] += 1
+            timer["total_ms"] += milliseconds
+            timer["max_ms"] = max(timer["max_ms"], milliseconds)
+
+    def snapshot(self):
+        with self.lock:
+            timers = {
+                name: {**timer, "avg_ms": round(timer["total_ms"] / timer["count"], 3) if timer["count"] else None}
+                for name, timer in self.timers.items()
+            }
+            return {"counters": dict(self.counters), "timers": timers}
+
+
+search_metrics = Metrics()
@@ -0,0 +1,90 @@
+import os
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+# One pass over the query finds every token that carries a number: digit-led tokens (with
+# thousands separators, up to two decimals and attached letters such as 5k, 1TB or 2000D,
+# optionally right after a USD/EUR/GBP code) and letter-led product codes such as A52 or T480.
+QUERY_TOKEN = re.compile(r"""
+    (?P<code>\b(?!(?:USD|EUR|GBP)\d)[^\W\d_]+\d\w*)
+    |
+    (?:\b(?P<currency>USD|EUR|GBP)|(?<!\w))
+    (?P<digits>\d+(?:,\d{3}(?!\d))*)
+    (?:\.(?P<decimals>\d{1,2})(?!\d))?
+    (?P<unit>[^\W\d_]*)
+""", re.VERBOSE)
+
+# A 3-4 digit number followed by a word is a spec such as "128 GB" or "500 watts",
+# unless that word is a single capital letter ("fridge 300 L").
+SPEC_FOLLOWER = re.compile(r"\s(?=\w)(?![A-Z](?!\w))")
+YEAR = re.compile(r"(?:19|20)\d{2}")
+YEAR_KEYWORD = re.compile(r"\s*(?:model|year|edition|released|version)\b")
+
+SUFFIX_MULTIPLIERS = {"k": 1_000, "m": 1_000_000, "b": 1_000_000_000, "t": 1_000_000_000_000}
+
+
+class ParsedQuery(NamedTuple):
+    prices: tuple
+    years: tuple
+    model_numbers: tuple
+    numbers: tuple
+
+
+class QueryParser:
+    """
+    Classifies the numbers of a search query as prices, years, model numbers or plain numbers.
+
+    Prices are bare or currency-marked amounts and 5k/1.5m/2B style amounts. Years are
+    19xx/20xx or a 4 digit number followed by model, year, edition, released or version.
+    Model numbers are product codes (A52, T480) and specs ("128 GB"). Numbers with an
+    attached unit (50kg, 200w) are plain numbers. A value found as a year or spec is never
+    a price. Results are memoized per query string.
+    """
+    cache_size = int(os.getenv("QUERY_PARSER_CACHE_SIZE", 4096))
+
+    def __init__(self, cache_size=None):
+        self.parse = lru_cache(maxsize=cache_size or self.cache_size)(self.parse_uncached)
+
+    def parse_uncached(self, query):
+        """
+        Function to tokenize a query once and classify each number in it.
+        :param query: The search query.
+        :return:
+            ParsedQuery: Sorted prices, years and model numbers, and the plain numbers in query order.
+        """
+        candidates = []
+        years = set()
+        model_numbers = set()
+        numbers = []
+
+        for match in QUERY_TOKEN.finditer(query):
+            if match.group("code"):
+                model_numbers.add(match.group("code"))
+                continue
+
+            digits = match.group("digits")
+            decimals = match.group("decimals")
+            unit = match.group("unit")
+            value = float(digits.replace(",", "") + (f".{decimals}" if decimals else ""))
+            integer = decimals is None and "," not in digits
+
+            if integer and len(digits) == 4 and YEAR_KEYWORD.match(query, match.end("digits")):
+                years.add(int(digits))
+            elif not unit:
+                if integer and len(digits) == 4 and YEAR.fullmatch(digits):
+                    years.add(int(digits))
+                elif (integer and len(digits) in (3, 4) and not match.group("currency")
+                      and SPEC_FOLLOWER.match(query, match.end())):
+                    model_numbers.add(digits)
+                candidates.append(value)
+            elif len(unit) == 1 and unit.lower() in SUFFIX_MULTIPLIERS:
+                candidates.append(value * SUFFIX_MULTIPLIERS[unit.lower()])
+            else:
+                numbers.append(value)
+
+        prices = {price for price in candidates if price not in years and str(int(price)) not in model_numbers}
+        return ParsedQuery(tuple(sorted(prices)), tuple(sorted(years)), tuple(sorted(model_numbers)), tuple(numbers))
+
+
+query_parser = QueryParser()
@@ -0,0 +1,67 @@
+import json
+import os
+import fcntl
+import logging
+from contextlib import contextmanager
+
+
+class StateStore:
+    """
+    Small JSON file store used by background jobs to persist their progress between runs.
+    """
+    state_dir = os.getenv("INGESTION_STATE_DIR", ".ingestion_state")
+
+    def __init__(self, name):
+        self.path = os.path.join(self.state_dir, f"{name}.json")
+        self.lock_path = os.path.join(self.state_dir, f"{name}.lock")
+
+    def load(self, default=None):
+        """
+        Function to read the persisted state.
+        :param default: The value returned when no state has been saved yet.
+        :return:
+            dict: The persisted state.
+        """
+        if not os.path.exists(self.path):
+            return default
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read state file {self.path}: {str(e)}")
+            return default
+
+    def save(self, state):
+        """
+        Function to atomically persist the state.
+        :param state: A JSON serializable dictionary.
+        :return:
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, default=str)
+        os.replace(tmp_path, self.path)
+
+    @contextmanager
+    def lock(self, blocking=True):
+        """
+        Function to hold an exclusive lock on the state across the processes of the host.
+
+        The lock is released when the block exits or the process dies, so a crashed job never
+        leaves it behind.
+        :param blocking: Wait for the lock instead of giving up when another process holds it.
+        :return:
+            bool: Whether the lock was acquired.
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(self.lock_path, "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
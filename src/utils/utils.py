@@ -1,25 +1,6 @@
-import re
+from src.utils.query_parser import query_parser
 
 class Utils:
-    def __init__(self):
-        self.patterns = {
-            'price': [
-                r'\b(?:\$|€|£|USD|EUR|GBP)?\s?(\d{1,3}(?:,\d{3})*(?:\.\d{1,2})?)\b',
-                r'\b(?:\$|€|£)?(\d+(?:\.\d{1,2})?)\s*[-~]\s*(?:\$|€|£)?(\d+(?:\.\d{1,2})?)\b',
-                r'\b(\d+(?:\.\d{1,2})?)([KkMmBbTt])\b',
-                r'\b(?:\$|€|£)?(\d{4,})(?:\$|€|£)?\b'
-            ],
-            'year': [
-                r'\b(19\d{2}|20\d{2})\b',
-                r'\b(\d{4})\s*(?:model|year|edition|released|version)\b'
-            ],
-            'model_number': [
-                r'\b([A-Z]+(?:\s?\d{1,4}[A-Z]*)+)\b',
-                r'\b(\d{3,4}\s?[A-Z]?)\b',
-                r'\b([A-Z]\s?\d{3,4})\b'
-            ]
-        }
-
     def format_large_number(self, number):
         units = ['', 'K', 'M', 'B', 'T']
         abs_number = abs(number)
@@ -31,50 +12,53 @@ class Utils:
         sign = '-' if number < 0 else ''
         return f'{sign}{formatted_number}{units[i]}'
 
-    def parse_suffix_number(self, value, suffix):
-        multipliers = {'K': 1_000, 'M': 1_000_000, 'B': 1_000_000_000, 'T': 1_000_000_000_000}
-        return float(value) * multipliers.get(suffix.upper(), 1)
+    def format_large_numbers(self, numbers):
+        """
+        Vectorized format_large_number over a pandas Series; missing values become None.
+        """
+        # Only the ingestion path formats whole columns; search workers never load numpy.
+        import numpy as np
+
+        units = np.array(['', 'K', 'M', 'B', 'T'])
+        present = numbers.notna().to_numpy()
+        values = numbers.fillna(0).to_numpy(dtype=float)
 
-    def extract_matches(self, query, pattern):
-        matches = re.findall(pattern, query)
-        extracted = []
-        for match in matches:
-            if isinstance(match, tuple) and len(match) == 2:
-                extracted.append(self.parse_suffix_number(match[0], match[1]))
-            else:
-                extracted.append(float(match.replace(',', '')) if isinstance(match, str) and match.replace(',',
-                                                                                                           '').isdigit() else match)
-        return extracted
+        abs_numbers = np.abs(values)
+        i = np.zeros(len(values), dtype=int)
+        for _ in range(len(units) - 1):
+            scale = abs_numbers >= 1000
+            abs_numbers = np.where(scale, abs_numbers / 1000, abs_numbers)
+            i += scale
+
+        formatted = np.char.rstrip(np.char.rstrip(np.char.mod('%.1f', abs_numbers), '0'), '.')
+        signs = np.where(values < 0, '-', '')
+        result = np.char.add(np.char.add(signs, formatted), units[i]).astype(object)
+        result[~present] = None
+        return result
 
     def extract_years(self, query):
-        years = []
-        for pattern in self.patterns['year']:
-            years.extend(self.extract_matches(query, pattern))
-        return sorted(set(int(y) for y in years))
+        return list(query_parser.parse(query).years)
 
     def extract_model_numbers(self, query):
-        models = []
-        for pattern in self.patterns['model_number']:
-            models.extend(self.extract_matches(query, pattern))
-
-        models = [m.strip() for m in models if isinstance(m, str)]
-        return sorted(set(models))
+        return list(query_parser.parse(query).model_numbers)
 
     def extract_prices(self, query):
-        prices = []
-        for pattern in self.patterns['price']:
-            prices.extend(self.extract_matches(query, pattern))
+        return list(query_parser.parse(query).prices)
 
-        years = self.extract_years(query)
-        models = self.extract_model_numbers(query)
-
-        prices = [p for p in prices if p not in years and str(int(p)) not in models]
-
-        return sorted(set(prices))
+    def parse_query(self, query):
+        """
+        Function to classify every number of a query at once.
+        :param query: The search query.
+        :return:
+            ParsedQuery: The prices, years, model numbers and plain numbers of the query.
+        """
+        return query_parser.parse(query)
 
     def classify_numbers(self, query):
-        years = self.extract_years(query)
-        models = self.extract_model_numbers(query)
-        prices = self.extract_prices(query)
-
-        return prices
+        """
+        Function to get the prices of a query once its years and model numbers are set apart.
+        :param query: The search query.
+        :return:
+            list: The prices, in ascending order.
+        """
+        return list(self.parse_query(query).prices)